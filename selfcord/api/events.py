@@ -1,14 +1,79 @@
-import itertools
+import asyncio
 from time import perf_counter
+from typing import Optional
 from aioconsole import aprint
-from ..models import Guild, Convert, User, Message, Member, MessageAck, MessageReactionAdd, PresenceUpdate
+from ..models import Guild, Convert, User, Message, Member, MessageAck, MessageReactionAdd, PresenceUpdate, Role
 import ujson
 
 class Handler:
     def __init__(self, bot) -> None:
         self.bot = bot
+        self._ready_data: dict = {}
+        # Set while no READY is being hydrated, READY_SUPPLEMENTAL waits on it
+        self._ready_done = asyncio.Event()
+        self._ready_done.set()
+        self._hydrated = 0
+        self._partial: list[Guild] = []
+        # guild id -> users with a cached presence, only kept for guilds with a presence limit
+        self._presences: dict[Optional[int], set[int]] = {}
+        # guild id -> members cached before READY that it hasn't confirmed yet, see _drop_unconfirmed
+        self._unconfirmed: dict[int, set[int]] = {}
+
+    async def _hydrate_tick(self, cost: int = 1):
+        # READY builds a lot of objects, give the loop a turn every ready_batch_size of them
+        # so heartbeats and other events aren't stuck behind it
+        self._hydrated += cost
+        if self._hydrated >= self.bot.ready_batch_size:
+            self._hydrated = 0
+            await self._flush_partial()
+            await asyncio.sleep(0)
+
+    def _confirm(self, guild_id: int, members):
+        # Members READY or a chunk still has, they aren't dropped with the ones that left while offline
+        unconfirmed = self._unconfirmed.get(guild_id)
+        if unconfirmed:
+            for member in members:
+                user = member.get("user")
+                unconfirmed.discard(int(user["id"] if user is not None else member["user_id"]))
+
+    def _drop_unconfirmed(self):
+        # Members from before READY (a snapshot, or the last session) that READY, READY_SUPPLEMENTAL
+        # and chunks in between didn't have anymore, they left while the client was away
+        unconfirmed, self._unconfirmed = self._unconfirmed, {}
+        for guild_id, user_ids in unconfirmed.items():
+            guild = self.bot.fetch_guild(guild_id)
+            user_ids.discard(self.bot.user.id)
+            if guild is None or not user_ids:
+                continue
+            for user_id in user_ids:
+                guild.members.remove(user_id)
+            self.bot.permissions.invalidate_guild(guild_id)
+
+    async def _flush_partial(self):
+        if self._partial:
+            guilds, self._partial = self._partial, []
+            await self.bot.emit("ready_partial", guilds)
+
+    def _initial_first(self, guilds: list[dict]) -> list[int]:
+        # Indexes of the guilds in hydration order, the initial guild goes first
+        order = list(range(len(guilds)))
+        initial = self.bot.initial_guild
+        if initial is not None:
+            for index, guild in enumerate(guilds):
+                if int(guild['id']) == initial:
+                    order.insert(0, order.pop(index))
+                    break
+        return order
 
     async def handle_ready(self, data: dict):
+        self._ready_done.clear()
+        try:
+            await self._hydrate_ready(data)
+        finally:
+            self._ready_done.set()
+        await self.bot.emit("ready", perf_counter() - self.bot.startup)
+
+    async def _hydrate_ready(self, data: dict):
         self._ready_data = data
         # with open("test.json", "a+") as f:
         #     ujson.dump(data, f, indent=4)
@@ -20,174 +85,225 @@ class Handler:
         private_channels = data.get("private_channels", [])
         users = data.get("users", [])
         relationships = data.get("relationships", [])
-        merged_members = data.get("merged_members", [])
-        for guild, channel, user, relation in itertools.zip_longest(
-            guilds,
-            private_channels,
-            users,
-            relationships,
-        ):
-            if guild is not None:
-                self.bot.user.guilds.append(Guild(guild, self.bot))
-            if channel is not None:
+        # Users first, everything else only references them by id
+        for user in users:
+            self.bot.store_user(user)
+            await self._hydrate_tick()
+
+        # The cache may already be filled from a snapshot, READY is applied over it as a diff.
+        # Objects that still exist are updated in place, the rest is dropped below.
+        stale_guilds = set(self.bot.cached_guilds)
+        stale_channels = {channel.id for channel in self.bot.user.private_channels}
+        self._unconfirmed = {guild.id: guild.members.ids() for guild in self.bot.cached_guilds.values()}
+        self.bot.user.private_channels = []
+        self.bot.user.friends = []
+        self.bot.user.blocked = []
+
+        for index in self._initial_first(guilds):
+            guild = guilds[index]
+            cached = self.bot.fetch_guild(guild['id'])
+            if cached is not None:
+                self._confirm(cached.id, guild.get("members", ()))
+                cached.update(guild)
+                self.bot.permissions.invalidate_guild(cached.id)
+                stale_guilds.discard(cached.id)
+            else:
+                cached = Guild(guild, self.bot)
+                self.bot.cached_guilds[cached.id] = cached
+            self._partial.append(cached)
+            await self._hydrate_tick(1 + len(guild.get("channels", ())) + len(guild.get("members", ())))
+
+        for channel in private_channels:
+            chan = self.bot.fetch_channel(channel['id'])
+            if chan is not None and chan.type == channel['type']:
+                chan.update(channel)
+            else:
                 chan = Convert(channel, self.bot)
-                self.bot.user.private_channels.append(chan)
-                self.bot.cached_channels[chan.id] = chan
-            if user is not None:
-                check_user = self.bot.fetch_user(user["id"])
-                if check_user is None:
-                    user = User(user, self.bot)
-                    self.bot.cached_users[user.id] = user
-                else:
-                    check_user.partial_update(user)
-            if relation is not None:
-                check_user = self.bot.fetch_user(relation["id"])
-                if check_user is None:
-                    user = User(relation, self.bot)
-                    self.bot.cached_users[user.id] = user
-                
-                    if relation["type"] == 1:
-                        self.bot.user.friends.append(user)
-                    if relation["type"] == 2:
-                        self.bot.user.blocked.append(user)
-                else:
-                    check_user.partial_update(relation)
+            stale_channels.discard(chan.id)
+            self.bot.user.private_channels.append(chan)
+            self.bot.cached_channels[chan.id] = chan
+            await self._hydrate_tick()
+
+        for relation in relationships:
+            user = self.bot.store_user(relation.get("user") or relation)
+            if relation["type"] == 1:
+                self.bot.user.friends.append(user)
+            if relation["type"] == 2:
+                self.bot.user.blocked.append(user)
+            await self._hydrate_tick()
+
+        # Left while we were away
+        for guild_id in stale_guilds:
+            self._drop_guild(guild_id)
+        for channel_id in stale_channels:
+            self.bot.cached_channels.pop(channel_id, None)
+        await self._flush_partial()
 
-        await self.bot.emit("ready", perf_counter() - self.bot.startup)
+    async def handle_ready_supplemental(self, data: dict):
+        # READY yields while it hydrates, this can come in before it's done
+        await self._ready_done.wait()
+        await self._hydrate_ready_supplemental(data)
 
+        await self.bot.inbuilt_commands()
+        await self.bot.emit("ready_supplemental")
 
-    async def handle_ready_supplemental(self, data: dict):
+    async def _hydrate_ready_supplemental(self, data: dict):
         # Ok discord bad code
         # I have to use data from ready and this event to properly form payloads
-        # Discord Bad CODE
-
-        temp_members = {}
-        temp_guilds = {}
-
-        for guild, members, extra_members in itertools.zip_longest(
-            data.get("guilds", []),
-            self._ready_data.get("merged_members", []),
-            data.get("merged_members", {}),
-        ):
-            if members is not None:
-                index = self._ready_data.get("merged_members", []).index(members)
-                temp_members.setdefault(str(index), []).extend(members)
-
-                for member in members:
-                    check_user = self.bot.fetch_user(member['user_id'])
-                    if check_user is None:
-                        member = Member(member, self.bot)
-                        self.bot.cached_users[member.id] = member
-                    else:
-                        check_user.partial_update(member)
-            
-            if extra_members is not None:
-                index = data.get("merged_members", []).index(extra_members)
-                temp_members.setdefault(str(index), []).extend(extra_members)
-
-                for member in extra_members:
-                    check_user = self.bot.fetch_user(member['user_id'])
-                    if check_user is None:
-                        member = Member(member, self.bot)
-                        self.bot.cached_users[member.id] = member
-                    else:
-                        check_user.partial_update(member)
-            # DISCORD BAD
-            if guild is not None:
-                guilds: list = data.get("guilds", [])
-                index = guilds.index(guild)
-                temp_guilds.setdefault(str(index), []).append(guild)
-                # print(temp_guilds[str(index)])
-                # print(index, guild)
-
-                check_guild = self.bot.fetch_guild(guild['id'])
-                if check_guild is None:
-                    guild = Guild(guild, self.bot)
-                    self.bot.user.guilds.append(guild)
-                    for member in temp_members[str(index)]:
-                        check_user = guild.fetch_member(member['user_id'])
-                        if check_user is None:
-                            user = Member(member, self.bot)
-                            
-                            guild.members.append(user)
-                        else:
-                            check_user.partial_update(member)
-                            
-                            guild.members.append(check_user)
-
-                else:
-                    check_guild.partial_update(guild)
-                    for member in temp_members[str(index)]:
-                        check_user = check_guild.fetch_member(member['user_id'])
-                        if check_user is None:
-                            user = Member(member, self.bot)
-                          
-                            check_guild.members.append(user)
-                        else:
-                            check_user.partial_update(member)
-                            
-                            check_guild.members.append(check_user)
-
-
-        # DISCORD BAD
+        # guilds[i] lines up with merged_members[i] in both payloads and with
+        # merged_presences["guilds"][i], so everything merges in one indexed pass
+        ready_guilds = self._ready_data.get("guilds", [])
+        ready_members = self._ready_data.get("merged_members", [])
+        guilds = data.get("guilds", [])
+        extra_members = data.get("merged_members", [])
         merged_presences = data.get("merged_presences", {})
-        guilds = merged_presences.get("guilds")
-        for index, users in enumerate(guilds):
-            temp_members.setdefault(str(index), []).extend(users)
-            for user in users:
-                # print(user['user_id'])
-                check_user = self.bot.fetch_user(user['user_id'])
-                if check_user is None:
-                    user = User(user, self.bot)
-                    self.bot.cached_users[user.id] = user
-                else:
-                    check_user.partial_update(user)
-
-        friends = merged_presences.get("friends")
-        for user in friends:
-            check_user = self.bot.fetch_user(user['user_id'])
-            if check_user is None:
-                user = User(user, self.bot)
-                self.bot.cached_users[user.id] = user
-            else:
-                check_user.partial_update(user)
-
-        # DISCORD BAD x100000
-        for index, indexed_guild in temp_guilds.items():
-            members = temp_members[str(index)]
-            guild = self.bot.fetch_guild(indexed_guild[0]['id'])
+        presences = merged_presences.get("guilds", [])
+
+        for index in self._initial_first(guilds if len(guilds) >= len(ready_guilds) else ready_guilds):
+            payload = guilds[index] if index < len(guilds) else ready_guilds[index]
+            guild = self.bot.fetch_guild(payload['id'])
+            if guild is None:
+                guild = Guild(payload, self.bot)
+                self.bot.cached_guilds[guild.id] = guild
+            elif index < len(guilds):
+                guild.partial_update(payload)
+
+            merged = 0
+            for chunk in (ready_members, extra_members):
+                if index >= len(chunk):
+                    continue
+                self._confirm(guild.id, chunk[index])
+                for member in chunk[index]:
+                    self._merge_member(guild, member)
+                merged += len(chunk[index])
+
+            if index < len(presences):
+                for presence in presences[index]:
+                    self._merge_presence(presence, guild.id)
+                merged += len(presences[index])
+            self._partial.append(guild)
+            await self._hydrate_tick(1 + merged)
+
+        for presence in merged_presences.get("friends", []):
+            self._merge_presence(presence)
+        self._drop_unconfirmed()
+        await self._flush_partial()
+
+        # Everything we needed from READY has been merged, no point holding onto it
+        self._ready_data = {}
+
+    def _merge_member(self, guild: Guild, payload: dict):
+        # Merged members only carry a user_id, the member shares the cached User.
+        # Members the cache policy leaves out aren't built at all
+        if "members" not in self.bot.cache_policy.unrestricted:
+            user_id = int(payload["user_id"])
+            if user_id not in guild.members and not self.bot.should_cache("members", guild.id, user_id, len(guild.members)):
+                return
+        guild.members.merge(payload)
+
+    def _merge_presence(self, payload: dict, guild_id: Optional[int] = None):
+        # Presences live on the cached User, so a left out one just isn't applied
+        policy = self.bot.cache_policy
+        if "presences" in policy.unrestricted:
+            self.bot.store_user(payload)
+            return
+        user = payload.get("user")
+        user_id = int(user["id"] if user is not None else payload["user_id"])
+        if policy.limit("presences", guild_id) is None:
+            if not self.bot.should_cache("presences", guild_id, user_id):
+                return
+        else:
+            cached = self._presences.setdefault(guild_id, set())
+            if user_id not in cached:
+                if not self.bot.should_cache("presences", guild_id, user_id, len(cached)):
+                    return
+                cached.add(user_id)
+        self.bot.store_user(payload)
+
+    def _cache_message(self, message: Message) -> bool:
+        # Whether the cache policy lets a new message in, counting the guild's cached messages only when capped
+        guild = message.guild
+        if guild is None:
+            return self.bot.should_cache("messages")
+        count = 0
+        if self.bot.cache_policy.limit("messages", guild.id) is not None:
+            channels = self.bot.cached_messages.channels
+            count = sum(len(channels[channel.id]) for channel in guild.channels if channel.id in channels)
+        return self.bot.should_cache("messages", guild.id, count=count)
+
+    def _interact(self, data: dict):
+        author = data.get("author")
+        if author is None:
+            return
+        guild_id = int(data["guild_id"]) if data.get("guild_id") else None
+        author_id = int(author["id"])
+        if self.bot.cache_policy.interact(guild_id, author_id, own=author_id == self.bot.user.id):
+            guild = self.bot.fetch_guild(guild_id)
             if guild is not None:
-                guild.members.extend(members)
-                guild.partial_update(indexed_guild[0])
-
-
-        await self.bot.inbuilt_commands()
-        await self.bot.emit("ready_supplemental")
+                guild._interacted()
 
     async def handle_message_create(self, data: dict):
+        # Decided on the raw payload, almost every message stops here as far as commands go
+        route = self.bot.router.filter(data)
+        if self.bot.cache_policy.tracks_interactions:
+            self._interact(data)
         message = Message(data, self.bot)
-        self.bot.cached_messages[message.id] = message
-        if message.author.id not in self.bot.cached_users:
-            self.bot.cached_users[message.author.id] = message.author
-        await self.bot.process_commands(message)
+        channel = message.channel
+        guild = message.guild
+        policy = self.bot.cache_policy
+        if (
+            guild is not None and data.get("member") is not None and message.author is not None
+            and policy.option("members", guild.id) == policy.INTERACTED
+            and message.author.id not in guild.members
+        ):
+            # Under "interacted" this is usually how a member ends up cached
+            guild.members.merge({**data["member"], "user": data["author"]})
+        if channel is not None:
+            if self._cache_message(message):
+                self.bot.cached_messages.add(message.id, message, channel.last_message_id)
+            channel.last_message_id = message.id
+        elif self._cache_message(message):
+            self.bot.cached_messages[message.id] = message
+        if route is not None:
+            await self.bot.process_commands(message, route)
         await self.bot.emit("message", message)
 
     async def handle_message_update(self, data: dict):
-        message = Message(data, self.bot)
-        self.bot.cached_messages[message.id] = message
+        # Updates can be partial, a cached message is diffed instead of rebuilt from them
+        message = self.bot.cached_messages.get(data['id'])
+        if message is not None:
+            changes = message.partial_update(data)
+        else:
+            message = Message(data, self.bot)
+            changes = None
+            if self._cache_message(message):
+                self.bot.cached_messages[message.id] = message
+        await self.bot.emit("message_edit", message, changes)
+        # Edits have always been emitted as "message" too, listeners relying on that keep working
         await self.bot.emit("message", message)
 
+    async def handle_user_update(self, data: dict):
+        changes = self.bot.user.partial_update(data)
+        await self.bot.emit("user_update", self.bot.user, changes)
+
     async def handle_message_ack(self, data: dict):
         ack = MessageAck(data, self.bot)
         await self.bot.emit("message_ack", ack)
 
     async def handle_message_delete(self, data: dict):
-        # Was thinking of maybe removing it from cache
-        # But I think would be more useful to keep it
+        # Deleted messages move to their own capped store so they can still be fetched
         # This can return None if there is no valid message in cache
-        deleted_message = self.bot.fetch_message(data['id'])
+        deleted_message = self.bot.cached_messages.pop(data['id'])
+        if deleted_message is not None:
+            self.bot.deleted_messages[deleted_message.id] = deleted_message
+        else:
+            deleted_message = self.bot.deleted_messages.get(data['id'])
         await self.bot.emit("message_delete", deleted_message)
 
+    async def handle_message_delete_bulk(self, data: dict):
+        for message_id in data.get("ids", []):
+            await self.handle_message_delete({"id": message_id})
+
     async def handle_message_reaction_add(self, data: dict):
         await self.bot.emit("message_reaction_add", MessageReactionAdd(data, self.bot))
 
@@ -196,16 +312,29 @@ class Handler:
         channel = Convert(data, self.bot)
         self.bot.cached_channels[channel.id] = channel
 
-        if hasattr(channel, "guild_id"):
+        if getattr(channel, "guild_id", None) is not None:
             guild = self.bot.fetch_guild(channel.guild_id)
-            guild.channels.append(channel)
+            if guild is not None:
+                guild.channels.append(channel)
         else:
             self.bot.user.private_channels.append(channel)
 
         await self.bot.emit("channel_create", channel)
 
+    async def handle_channel_update(self, data: dict):
+        channel = self.bot.fetch_channel(data['id'])
+        if channel is not None:
+            channel.update(data)
+        else:
+            channel = Convert(data, self.bot)
+            self.bot.cached_channels[channel.id] = channel
+        self.bot.permissions.invalidate_channel(channel.guild_id, channel.id)
+        await self.bot.emit("channel_update", channel)
+
     async def handle_channel_delete(self, data: dict):
         deleted_channel = self.bot.fetch_channel(data['id'])
+        if deleted_channel is not None:
+            self.bot.permissions.invalidate_channel(deleted_channel.guild_id, deleted_channel.id)
         await self.bot.emit("channel_delete", deleted_channel)
         del deleted_channel
 
@@ -217,13 +346,101 @@ class Handler:
 
     async def handle_guild_create(self, data: dict):
         guild = Guild(data, self.bot)
-        self.bot.user.guilds.append(guild)
+        self.bot.cached_guilds[guild.id] = guild
         await self.bot.emit("guild_create")
 
-    async def handle_guild_delete(self, data: dict):
+    def _drop_guild(self, guild_id: str | int) -> Optional[Guild]:
+        guild = self.bot.cached_guilds.pop(int(guild_id), None)
+        self.bot.permissions.invalidate_guild(guild_id)
+        self._presences.pop(int(guild_id), None)
+        if guild is not None:
+            for channel in guild.channels:
+                self.bot.cached_channels.pop(channel.id, None)
+        return guild
+
+    async def handle_guild_update(self, data: dict):
         guild = self.bot.fetch_guild(data['id'])
+        if guild is None:
+            return
+        changes = guild.partial_update(data)
+        if changes:
+            self.bot.permissions.invalidate_guild(guild.id)
+        await self.bot.emit("guild_update", guild, changes)
+
+    async def handle_guild_delete(self, data: dict):
+        guild = self._drop_guild(data['id'])
         await self.bot.emit("guild_delete", guild)
-        del guild
+
+    async def handle_guild_role_create(self, data: dict):
+        guild = self.bot.fetch_guild(data['guild_id'])
+        role = Role(data['role'], self.bot)
+        if guild is not None:
+            if self.bot.should_cache("roles", guild.id, count=len(guild.roles)):
+                guild.roles.append(role)
+            guild._store_role(role.id, data['role'])
+            self.bot.permissions.invalidate_guild(guild.id)
+        await self.bot.emit("role_create", role)
+
+    async def handle_guild_role_update(self, data: dict):
+        guild = self.bot.fetch_guild(data['guild_id'])
+        role = Role(data['role'], self.bot)
+        if guild is not None:
+            for index, cached in enumerate(guild.roles):
+                if cached.id == role.id:
+                    guild.roles[index] = role
+                    break
+            else:
+                if self.bot.should_cache("roles", guild.id, count=len(guild.roles)):
+                    guild.roles.append(role)
+            guild._store_role(role.id, data['role'])
+            self.bot.permissions.invalidate_guild(guild.id)
+        await self.bot.emit("role_update", role)
+
+    async def handle_guild_role_delete(self, data: dict):
+        guild = self.bot.fetch_guild(data['guild_id'])
+        role = None
+        if guild is not None:
+            role_id = int(data['role_id'])
+            for index, cached in enumerate(guild.roles):
+                if cached.id == role_id:
+                    role = guild.roles.pop(index)
+                    break
+            guild._store_role(role_id, None)
+            self.bot.permissions.invalidate_guild(guild.id)
+        await self.bot.emit("role_delete", role)
+
+    async def handle_guild_member_add(self, data: dict):
+        guild = self.bot.fetch_guild(data['guild_id'])
+        if guild is not None:
+            self._confirm(guild.id, (data,))
+            member = guild.members.merge(data)
+            self.bot.permissions.invalidate_member(guild.id, member.id)
+            if guild.member_count is not None:
+                guild.member_count += 1
+        else:
+            member = Member(data, self.bot)
+        await self.bot.emit("member_join", member)
+
+    async def handle_guild_member_update(self, data: dict):
+        guild = self.bot.fetch_guild(data['guild_id'])
+        changes = None
+        if guild is not None:
+            self._confirm(guild.id, (data,))
+            member, changes = guild.members.diff(data)
+            self.bot.permissions.invalidate_member(guild.id, member.id)
+        else:
+            member = Member(data, self.bot)
+        await self.bot.emit("member_update", member, changes)
+
+    async def handle_guild_member_remove(self, data: dict):
+        guild = self.bot.fetch_guild(data['guild_id'])
+        member = None
+        if guild is not None:
+            member = guild.members.remove(data['user']['id'])
+            self.bot.permissions.invalidate_member(guild.id, data['user']['id'])
+            if guild.member_count is not None:
+                guild.member_count -= 1
+        await self.bot.emit("member_remove", member or self.bot.store_user(data['user']))
 
     async def handle_guild_member_list_update(self, data: dict):
         print(data)
@@ -232,12 +449,19 @@ class Handler:
     async def handle_presence_update(self, data: dict):
         pres = PresenceUpdate(data, self.bot)
         if isinstance(pres.user, User):
-            pres.user.partial_update(data)
+            guild_id = int(data["guild_id"]) if data.get("guild_id") else None
+            self._merge_presence({**data, "user_id": pres.user.id}, guild_id)
         await self.bot.emit("presence_update",pres)
 
 
     async def handle_thread_list_sync(self, data: dict):
         pass
 
-    async def handle_guild_member_chunk(self, data: dict):
-        pass
\ No newline at end of file
+    async def handle_guild_members_chunk(self, data: dict):
+        guild = self.bot.fetch_guild(data['guild_id'])
+        if guild is None:
+            return
+        self._confirm(guild.id, data.get("members", ()))
+        for member in data.get("members", []):
+            member = guild.members.merge(member)
+            self.bot.permissions.invalidate_member(guild.id, member.id)
\ No newline at end of file
@@ -130,7 +130,7 @@ class Gateway:
                     "guild_versions": {},
                     "api_code_version": 0,
                     "highest_last_message_id": "0",
-                    "initial_guild_id": None,
+                    "initial_guild_id": str(self.bot.initial_guild) if self.bot.initial_guild is not None else None,
                     "private_channels_version": "0",
                     "read_state_version": 0,
                     "user_guild_settings_version": -1,
@@ -171,13 +171,13 @@ class Gateway:
         }
         await self.send_json(payload)
 
-    async def gather_members(self, guild_id: str, channel_id: str):
+    async def gather_members(self, guild_id: str | int, channel_id: str | int):
         payload = {
             "op": 14,
             "d": {
-                "guild_id": guild_id,
+                "guild_id": str(guild_id),
                 "channels": {
-                    channel_id: [[0, 99]]
+                    str(channel_id): [[0, 99]]
                 }
             },
         }
@@ -207,17 +207,8 @@ class Gateway:
             yield lst[: i + 1]
 
     async def chunk_members(self, guild: Guild):
-        roles = guild.me.roles
-        print(roles)
-        channels = []
-        for channel in guild.channels:
-            print(channel.permission_overwrites)
-            if len(channel.permission_overwrites) > 0:
-                for overwrite in channel.permission_overwrites:
-                    if overwrite.id in [role.id for role in roles]:
-                        pass
-
-        
+        # The member list can only be subscribed through channels we can see
+        channels = self.bot.permissions.visible_channels(guild)
         ranges = []
 
         if guild.member_count is not None:
@@ -232,7 +223,7 @@ class Gateway:
             payload = {
                 "op": 14,
                 "d": {
-                    "guild_id": guild.id,
+                    "guild_id": str(guild.id),
                     "typing": True,
                 }
             }
@@ -240,21 +231,21 @@ class Gateway:
 
             # For now
             for channel in channels:
-                queries[channel.id] = item
+                queries[str(channel.id)] = item
 
-            data['channel'] = queries
+            data['channels'] = queries
             
             await self.send_json(payload)
 
             await asyncio.sleep(2.0)
         
 
-    async def call(self, channel: str, guild: Optional[str] = None):
+    async def call(self, channel: str | int, guild: Optional[str | int] = None):
         payload = {
             "op": 4,
             "d": {
-                "guild_id": guild,
-                "channel_id": channel,
+                "guild_id": str(guild) if guild is not None else None,
+                "channel_id": str(channel),
                 "preferred_region": "rotterdam",
                 "self_mute": False,
                 "self_deaf": False,
@@ -208,7 +208,7 @@ class Voice:
                 "server_id": self.server_id,
                 "token": self.token,
                 "session_id": self.session_id,
-                "user_id": self.bot.user.id,
+                "user_id": str(self.bot.user.id),
                 "streams": [
                     {"type": "video", "rid": "100", "quality": 100},
                     {"type": "video", "rid": "50", "quality": 50},
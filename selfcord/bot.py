@@ -3,7 +3,7 @@ from __future__ import annotations
 import ast
 from time import perf_counter
 import asyncio
-import contextlib
+import functools
 import importlib
 import inspect
 import io
@@ -14,7 +14,7 @@ import time
 import urllib
 from collections import defaultdict
 from traceback import format_exception
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Callable, Optional
 from urllib.parse import urlparse
 
 import aiofiles
@@ -30,10 +30,15 @@ from .models import (
     Capabilities, Convert, Messageable
 )
 from .utils import (
-    Command, CommandCollection, Context, Event, Extension,
-    ExtensionCollection, logging
+    CachePolicy, Command, CommandCollection, CommandRouter, Context, Event, ExecutorPool, Extension,
+    ExtensionCollection, MessageCache, MessageCachePolicy, PermissionResolver, Route, logging
 )
+from .utils.command import check_listener
+from .utils.executors import check_executor
 from .utils.logging import handler
+from .utils.sandbox import EvalSandbox, format_output
+from .utils.snapshot import collect_snapshot, load_snapshot, save_snapshot
+from .utils.stats import cache_growth, collect_cache_stats, format_cache_stats
 import sys
 
 if sys.platform == "linux":
@@ -46,6 +51,9 @@ if sys.platform.startswith("win"):
 
 log = logging.getLogger(__name__)
 
+# Bot._on_handlers entry before the lookup was done, None means there's no handler
+_MISSING = object()
+
 
 class Bot:
     """Bot instance as entry point to interact with the bot
@@ -55,7 +63,19 @@ class Bot:
         prefixes (list[str]): Prefixes for the bot, defaults to s!.
         inbuilt_help (bool): Whether the inbuilt help command should be enabled, defaults to True.
         userbot (bool): Whether the bot should be a userbot rather than selfbot, defaults to False.
-        eval (bool): Whether to have the eval command as default, defaults to False.
+        eval (bool | str): Whether to have the eval command as default, defaults to False. True runs the code in a sandboxed worker process, "trusted" runs it in the bot with access to bot.
+        eval_sandbox (EvalSandbox): CPU time, wall clock, memory and output limits of the sandboxed eval, defaults to EvalSandbox().
+        message_cache (MessageCachePolicy): Limits for cached messages, defaults to 1000 messages.
+        deleted_message_cache (MessageCachePolicy): Limits for deleted messages kept around after MESSAGE_DELETE, defaults to 1000 messages.
+        cache_policy (CachePolicy): Which members, presences, messages, emojis, stickers and roles get cached, defaults to caching everything.
+        columnar_members (int): Guilds with at least this many members store them in a ColumnarMemberCollection, defaults to None which never does.
+        snapshot (str): Path of a cache snapshot, loaded before connecting and written on shutdown, defaults to None for no snapshot.
+        snapshot_interval (float): Seconds between snapshots while running, defaults to None which only writes on shutdown.
+        initial_guild (str | int): Guild to ask discord for first and to hydrate first from READY, defaults to None.
+        ready_batch_size (int): Objects READY hydrates before yielding to the event loop and emitting ready_partial, defaults to 500.
+        cache_stats_interval (float): Seconds between cache reports written to the log, defaults to None for no reports.
+        thread_workers (int): Size of the thread pool for executor="thread" commands and listeners, defaults to None for the concurrent.futures default.
+        process_workers (int): Size of the process pool for executor="process" commands and listeners, defaults to None for the number of CPUs.
     """
 
     def __init__(
@@ -63,10 +83,23 @@ class Bot:
         prefixes: list[str] = ["s!"],
         inbuilt_help: bool = True,
         userbot: bool = False,
-        token_leader: Optional[str] = None,
-        eval: bool = False,
+        token_leader: Optional[str | int] = None,
+        eval: bool | str = False,
         decompress: bool = True,
-    	password: Optional[str] = None
+    	password: Optional[str] = None,
+        message_cache: Optional[MessageCachePolicy] = None,
+        deleted_message_cache: Optional[MessageCachePolicy] = None,
+        cache_policy: Optional[CachePolicy] = None,
+        columnar_members: Optional[int] = None,
+        snapshot: Optional[str] = None,
+        snapshot_interval: Optional[float] = None,
+        initial_guild: Optional[str | int] = None,
+        ready_batch_size: int = 500,
+        debug: bool = False,
+        cache_stats_interval: Optional[float] = None,
+        thread_workers: Optional[int] = None,
+        process_workers: Optional[int] = None,
+        eval_sandbox: Optional[EvalSandbox] = None,
     ) -> None:
         self.inbuilt_help: bool = inbuilt_help
         self.token: str
@@ -76,22 +109,39 @@ class Bot:
         self.resume_url: str
         self.capabilities: Capabilities = Capabilities.default()
         self._events = defaultdict(list)
+        self._on_handlers: dict[str, Optional[Callable]] = {}
         self.commands = CommandCollection()
         self.prefixes: list[str] = (
             prefixes if isinstance(prefixes, list) else [prefixes]
         )
         self.extensions = ExtensionCollection()
+        self.router: CommandRouter = CommandRouter(self)
         self.user: Client
-        self.eval: bool = eval
-        self.token_leader = token_leader
+        self.eval: bool | str = eval
+        self.eval_sandbox: EvalSandbox = eval_sandbox or EvalSandbox()
+        self.token_leader = int(token_leader) if token_leader is not None else None
         if self.token_leader is not None:
             self.userbot: bool = True
         else:
             self.userbot: bool = userbot
         self.password: str = password
-        self.cached_users: dict[str, User] = {}
-        self.cached_channels: dict[str, Messageable] = {}
-        self.cached_messages: dict[str, Message] = {}
+        # Keyed by int ids, the fetch_* helpers also take the string form
+        self.cached_users: dict[int, User] = {}
+        self.cached_guilds: dict[int, Guild] = {}
+        self.cached_channels: dict[int, Messageable] = {}
+        self.cached_messages: MessageCache = MessageCache(message_cache)
+        self.deleted_messages: MessageCache = MessageCache(deleted_message_cache)
+        self.cache_policy: CachePolicy = cache_policy or CachePolicy()
+        self.columnar_members: Optional[int] = columnar_members
+        self.permissions: PermissionResolver = PermissionResolver(self)
+        self.snapshot: Optional[str] = snapshot
+        self.snapshot_interval: Optional[float] = snapshot_interval
+        self.initial_guild: Optional[int] = int(initial_guild) if initial_guild is not None else None
+        self.ready_batch_size: int = ready_batch_size
+        self.debug: bool = debug
+        self.cache_stats_interval: Optional[float] = cache_stats_interval
+        self._last_cache_stats: Optional[dict] = None
+        self.executors: ExecutorPool = ExecutorPool(thread_workers, process_workers)
         self.gateway: Gateway = Gateway(self, decompress)
         self.startup = perf_counter()
     
@@ -105,10 +155,22 @@ class Bot:
         data = await self.http.static_login(token)
         if data is not None:
             self.user = Client(data, self)
-            
+            self.cached_users[self.user.id] = self.user
+            # Lookups work off the snapshot until READY comes in and gets applied over it
+            if self.snapshot is not None:
+                await load_snapshot(self, self.snapshot, self.ready_batch_size)
+                if self.snapshot_interval:
+                    asyncio.create_task(self.snapshot_timer())
+            if self.cache_stats_interval:
+                asyncio.create_task(self.cache_stats_timer())
+
             try:
                 if not multi_token:
-                    await self.gateway.start(token)
+                    try:
+                        await self.gateway.start(token)
+                    finally:
+                        self.executors.shutdown()
+                        await self.save_snapshot()
                 else:
                     asyncio.create_task(self.gateway.start(token))
                     await asyncio.sleep(wait)
@@ -129,6 +191,51 @@ class Bot:
         except Exception as e:
             raise e
 
+    async def save_snapshot(self):
+        """Write the cache to the snapshot file.
+
+        Payloads are collected on the loop in batches of ready_batch_size, encoding and writing happen in an executor.
+        """
+        if self.snapshot is None:
+            return
+        payloads = await collect_snapshot(self, self.ready_batch_size)
+        await asyncio.get_running_loop().run_in_executor(None, save_snapshot, self.snapshot, payloads)
+
+    async def snapshot_timer(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                await self.save_snapshot()
+            except Exception as e:
+                log.error(f"Could not write snapshot: {e}")
+
+    def cache_stats(self, top: int = 5) -> dict:
+        """Count and measure what the bot is caching, to find out what's eating memory.
+
+        Sizes are deep, so a user is counted with its status and assets, and anything shared
+        is only counted once, under the first section that reaches it. Big collections are
+        sampled, so the sizes are estimates. Every call also reports the growth since the last one.
+
+        Args:
+            top (int): How many of the biggest guilds to break down, defaults to 5
+
+        Returns:
+            dict: users, guilds, channels, messages and deleted_messages with a count and bytes each,
+            plus total_bytes, top_guilds with per guild members, channels, roles, emojis and stickers, and growth
+        """
+        stats = collect_cache_stats(self, top)
+        stats["growth"] = cache_growth(stats, self._last_cache_stats)
+        self._last_cache_stats = stats
+        return stats
+
+    async def cache_stats_timer(self):
+        while True:
+            await asyncio.sleep(self.cache_stats_interval)
+            try:
+                log.info(format_cache_stats(self.cache_stats()))
+            except Exception as e:
+                log.error(f"Could not collect cache stats: {e}")
+
     @property
     def latency(self):
         """Latency of heartbeat ack, gateway latency essentially"""
@@ -210,6 +317,12 @@ class Bot:
                                     msg += "```"
                                     return await ctx.reply(f"{msg}")
 
+        if self.debug:
+            @self.cmd(description="Shows what the cache is using", aliases=["cache"])
+            async def cachestats(ctx, top: int = 5):
+                """Counts and sizes of cached users, guilds, channels and messages, the biggest guilds and growth since the last report."""
+                await ctx.reply(f"```\n{format_cache_stats(self.cache_stats(int(top)))}\n```")
+
         if self.eval:
             # print("EVAL ACTIVATE???")
             def clean_code(content):
@@ -222,44 +335,72 @@ class Bot:
 
             @self.cmd(description="Executes and runs code", aliases=["exec"])
             async def eval(ctx, *, code):
-                """Runs python code via exec, intended for experienced usage. This can be DANGEROUS if you do not know what you are doing, use with caution."""
+                """Runs python code, intended for experienced usage. By default it runs in a sandboxed worker process with time and memory limits, with eval="trusted" it runs in the bot with access to bot and ctx. Use with caution."""
                 if code.startswith("```"):
                     code = clean_code(code)
-                # print("EVAL ACTIVATE???")
+                if self.eval == "trusted":
+                    return await ctx.reply(await trusted_eval(ctx, code))
+
+                reply = None
+
+                async def stream(output: str, status: str = "Running..."):
+                    nonlocal reply
+                    content = format_output(output, status)
+                    try:
+                        if reply is None:
+                            reply = await ctx.reply(content)
+                        else:
+                            await reply.edit(content)
+                    except Exception as e:
+                        log.error(f"Could not send eval output: {e}")
+
+                result = await self.eval_sandbox.run(code, stream)
+                await stream(result.output, result.summary)
+
+            async def trusted_eval(ctx, code) -> str:
+                # print goes to this eval only, redirecting sys.stdout would catch everything else running too
+                output = io.StringIO()
+
+                def print_output(*args, **kwargs):
+                    kwargs.setdefault("file", output)
+                    print(*args, **kwargs)
+
                 envs = {
                     "bot": self,
                     "ctx": ctx,
                     "selfcord": sys.modules[__name__],
-                    "__import__": __import__
+                    "__import__": __import__,
+                    "print": print_output,
                 }
-                
                 try:
-                    with contextlib.redirect_stdout(io.StringIO()) as f:
-                        await aexec(code, local=envs)
-                        result = f"```{f.getvalue()}\n```"
+                    await aexec(code, local=envs)
                 except Exception as e:
-                    error = "".join(format_exception(e, e, e.__traceback__))
-                    result = f"```\n{error}```"
-
-                await ctx.reply(result)
+                    output.write("".join(format_exception(e, e, e.__traceback__)))
+                return format_output(output.getvalue())
 
-    def on(self, event: str, mass_token: bool = False):
+    def on(self, event: str, mass_token: bool = False, executor: Optional[str] = None, inline: bool = False):
         """Decorator for events
 
         Args:
             event (str): The event to check for
+            executor (str, optional): "thread" or "process" to run a regular function in Bot.executors instead of on the event loop.
+                Process listeners get models as their payloads and have to be defined at module level. Defaults to None.
+            inline (bool, optional): Call a regular function right inside emit instead of scheduling a task, for listeners that
+                only do a little bookkeeping. It holds up the event, so keep it fast. Defaults to False.
         """
 
         def decorator(coro):
-            if not inspect.iscoroutinefunction(coro):
+            check_listener(coro, executor, inline)
+            if executor is None and not inline and not inspect.iscoroutinefunction(coro):
                 log.error("Not a coroutine")
                 raise Exception("Not a coroutine")
             else:
-                self._events[event].append(Event(name=event, coro=coro, ext=None, mass_token=mass_token))
+                self._events[event].append(Event(name=event, coro=coro, ext=None, mass_token=mass_token, executor=executor, inline=inline))
 
+                @functools.wraps(coro)
                 def wrapper(*args, **kwargs):
                     result = self._events[event].append(
-                        Event(name=event, coro=coro, ext=None, mass_token=mass_token)
+                        Event(name=event, coro=coro, ext=None, mass_token=mass_token, executor=executor, inline=inline)
                     )
 
                     return result
@@ -274,28 +415,38 @@ class Bot:
         Args:
             event (str): The event name
         """
-        on_event = f"on_{event}"
+        # on_<event> methods are looked up once per event name
+        handler = self._on_handlers.get(event, _MISSING)
+        if handler is _MISSING:
+            handler = self._on_handlers[event] = getattr(self, f"on_{event}", None)
+        if handler is not None:
+            await handler(*args, **kwargs)
 
-        # try:
-        if hasattr(self, on_event):
-            await getattr(self, on_event)(*args, **kwargs)
-        
-        if event in self._events.keys():
-            for Event in self._events[event]:
-                if len(Event.coro.__code__.co_varnames) == 0:
-                    asyncio.create_task(Event.coro())
-                elif Event.coro.__code__.co_varnames[0] == "self":
-                    asyncio.create_task(Event.coro(Event.ext, *args, **kwargs))
+        listeners = self._events.get(event)
+        if listeners:
+            for listener in listeners:
+                listener.fire(self, args, kwargs)
 
-                else:
-                    asyncio.create_task(Event.coro(*args, **kwargs))
+    def listener_stats(self) -> dict[str, list[dict]]:
+        """Timing and error counters of every listener, see Event.stats
+
+        Returns:
+            dict: Event name to a list with the listener's name and its counters
+        """
+        return {
+            event: [{"listener": listener.coro.__name__, **listener.stats()} for listener in listeners]
+            for event, listeners in self._events.items() if listeners
+        }
 
-    def cmd(self, description="", aliases=[], mass_token: bool = False):
+    def cmd(self, description="", aliases=[], mass_token: bool = False, executor: Optional[str] = None):
         """Decorator to add commands for the bot
 
         Args:
             description (str, optional): Description of command. Defaults to "".
             aliases (list, optional): Alternative names for command. Defaults to [].
+            executor (str, optional): "thread" or "process" to run a regular function in Bot.executors instead of on the event loop.
+                The function gets an ExecutorContext instead of Context and whatever it returns is replied from the loop.
+                Process commands get models as their payloads and have to be defined at module level. Defaults to None.
 
         Raises:
             RuntimeWarning: If you suck and don't use a coroutine
@@ -305,13 +456,14 @@ class Bot:
 
         def decorator(coro):
             name = coro.__name__
-            if not inspect.iscoroutinefunction(coro):
+            check_executor(executor, coro)
+            if executor is None and not inspect.iscoroutinefunction(coro):
                 log.error("Not a coroutine")
                 raise Exception("Not a coroutine")
                 return
             else:
                 cmd = Command(
-                    name=name, description=description, aliases=aliases, func=coro, mass_token=mass_token
+                    name=name, description=description, aliases=aliases, func=coro, mass_token=mass_token, executor=executor
                 )
                 self.commands.add(cmd)
             return cmd
@@ -320,12 +472,12 @@ class Bot:
     
         
 
-    async def load_tokens(self, tokens: list, prefixes: list[str] = ["!"], eval: bool = False):
+    async def load_tokens(self, tokens: list, prefixes: list[str] = ["!"], eval: bool | str = False):
         bots = []
         rmv = []
         for token in tokens:
 
-            mass_bot = self.__class__(prefixes=prefixes, token_leader=self.user.id, eval=eval, inbuilt_help=False, )
+            mass_bot = self.__class__(prefixes=prefixes, token_leader=self.user.id, eval=eval, eval_sandbox=self.eval_sandbox, inbuilt_help=False, )
 
             @mass_bot.cmd()
             async def help(ctx):
@@ -482,41 +634,83 @@ class Bot:
         try:
             for name, event in ext._events.items():
                 for ext_event in event:
-                    self._events[name].append(
-                        Event(name=name, coro=ext_event.coro, ext=ext.ext)
-                    )
+                    self._events[name].append(ext_event.bind(ext.ext))
         except Exception as e:
             raise e
 
     async def logout(self):
         await self.gateway.close()
 
-    async def process_commands(self, msg):
+    async def process_commands(self, msg, route: Optional[Route] = None):
         """
         What is called in order to actually get command input and run commands
 
         Args:
             msg (str): The message containing command
+            route (Route, optional): Route from router.filter, matched here when not given
         """
-        context = Context(msg, self)
+        # Most messages aren't commands, don't schedule anything for those
+        if route is None:
+            route = self.router.match(msg.content)
+        if route is None:
+            return
+        context = Context(msg, self, route)
 
         asyncio.create_task(context.invoke())
     
-    def fetch_message(self, message_id: str) -> Optional[Message]:
-        return self.cached_messages.get(message_id)
+    def fetch_message(self, message_id: str | int) -> Optional[Message]:
+        if not message_id:
+            return None
+        message = self.cached_messages.get(message_id)
+        if message is None:
+            message = self.deleted_messages.get(message_id)
+        return message
 
-    def fetch_user(self, user_id: str) -> Optional[User]:
-        return self.cached_users.get(user_id)
+    def fetch_user(self, user_id: str | int) -> Optional[User]:
+        return self.cached_users.get(int(user_id)) if user_id else None
 
-    def fetch_channel(self, channel_id: str) -> Optional[Messageable]:
-        return self.cached_channels.get(channel_id)
+    def store_user(self, payload: dict) -> User:
+        """Get the cached User for a user payload, updating it in place, or cache a new one.
 
-    # Cry it's O(N) - max 100 guilds so it's cool
-    def fetch_guild(self, guild_id: str) -> Optional[Guild]:
-        for guild in self.user.guilds:
-            if guild.id == guild_id:
-                return guild
-        return
+        Every model referencing a user goes through here so there is only ever one User per id.
+
+        Args:
+            payload (dict): User payload, or any payload with a user_id such as presences
+
+        Returns:
+            User: The cached User
+        """
+        user_id = payload.get("id") or payload.get("user_id")
+        user = self.cached_users.get(int(user_id)) if user_id else None
+        if user is None:
+            user = User(payload, self)
+            self.cached_users[user.id] = user
+        else:
+            user.partial_update(payload)
+        return user
+
+    def should_cache(self, entity: str, guild_id: Optional[int] = None, user_id: Optional[int] = None, count: int = 0) -> bool:
+        """Whether the cache policy lets an object in, the client's own member and presence always get in
+
+        Args:
+            entity (str): One of CachePolicy.ENTITIES
+            guild_id (int, optional): Guild the object belongs to
+            user_id (int, optional): User the object belongs to, for members and presences
+            count (int): How many of these the guild has cached already
+
+        Returns:
+            bool: True if it should be cached
+        """
+        client = getattr(self, "user", None)
+        if user_id is not None and client is not None and user_id == client.id:
+            return True
+        return self.cache_policy.allows(entity, guild_id, user_id, count)
+
+    def fetch_channel(self, channel_id: str | int) -> Optional[Messageable]:
+        return self.cached_channels.get(int(channel_id)) if channel_id else None
+
+    def fetch_guild(self, guild_id: str | int) -> Optional[Guild]:
+        return self.cached_guilds.get(int(guild_id)) if guild_id else None
 
 
     async def get_user(self, user_id: str) -> Optional[User]:
@@ -532,9 +726,7 @@ class Bot:
         """
         data = await self.http.request(method="get", endpoint=f"/users/{user_id}")
         if data is not None:
-            user = User(data, bot=self)
-            self.cached_users[user.id] = user
-            return user
+            return self.store_user(data)
         return
 
  
\ No newline at end of file
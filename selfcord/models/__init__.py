@@ -1,7 +1,9 @@
 from .users import User, Client, Member
 from .flags import Flags, Capabilities
-from .guild import Guild, Role, Sticker, Emoji
+from .guild import Guild, Role, Sticker, Emoji, MemberCollection
+from .columnar import ColumnarMemberCollection
 from .assets import Asset
+from .snowflake import Snowflake
 from .channels import (
     TextChannel,
     DMChannel,
@@ -19,6 +21,8 @@ from .channels import (
     Convert,
     Messageable
 )
-from .message import Message, MessageAck, MessageReactionAdd
+from .message import Message, MessageAck, MessageReactionAdd, Embed
 from .activity import Activity
-from .event_models import PresenceUpdate
\ No newline at end of file
+from .permissions import Permission
+from .event_models import PresenceUpdate
+from .base import Changes
\ No newline at end of file
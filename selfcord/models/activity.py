@@ -1,13 +1,15 @@
 from __future__ import annotations
 
 from typing import Optional
+from .base import Model
 
 
 
-class Activity:
+class Activity(Model):
+    __slots__ = ("application_id",)
+
     def __init__(self, payload: dict, bot) -> None:
         self.bot = bot
-        self.http = bot.http
 
         self.update(payload)
 
@@ -1,39 +1,92 @@
 from __future__ import annotations
-from typing import Self
+from functools import lru_cache
+from sys import intern
+from typing import Optional, Self
+
+CDN_URL = "https://cdn.discordapp.com"
+
+
+@lru_cache(maxsize=None)
+def _template(kind: str) -> str:
+    return f"{CDN_URL}/{kind}/{{}}/{{}}.{{}}?size={{}}"
 
 
 class Asset:
-    def __init__(self, id: str, hash: str) -> None:
-        self.url: str = ""
+    """An image on the CDN. Only the owner id and hash are kept, the url is formatted when it's read."""
+    __slots__ = ("id", "hash", "kind")
+
+    def __init__(self, id: str | int, hash: str, kind: str = "avatars") -> None:
+        self.kind: str = kind
         self.update(id, hash)
 
-    def update(self, id: str, hash: str):
-        self.id: str = id
+    def update(self, id: str | int, hash: str):
+        self.id: str | int = id
         self.hash: str = hash
 
     def __str__(self) -> str:
         return self.url
 
-    def from_avatar(self):
-        self.url = (
-            f"https://cdn.discordapp.com/avatars/{self.id}/{self.hash}.png?size=4096"
-        )
-        if self.hash.startswith("a_"):
-            self.url = f"https://cdn.discordapp.com/avatars/{self.id}/{self.hash}.gif?size=4096"
+    def __repr__(self) -> str:
+        return f"<Asset url={self.url}>"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Asset) and (self.kind, self.id, self.hash) == (other.kind, other.id, other.hash)
+
+    def __hash__(self) -> int:
+        return hash((self.kind, self.id, self.hash))
+
+    def from_avatar(self) -> Self:
+        self.kind = "avatars"
         return self
 
     def from_icon(self) -> Self:
-        self.url = (
-            f"https://cdn.discordapp.com/icons/{self.id}/{self.hash}.png?size=4096"
-        )
-        if self.hash.startswith("a_"):
-            self.url = (
-                f"https://cdn.discordapp.com/icons/{self.id}/{self.hash}.gif?size=4096"
-            )
+        self.kind = "icons"
         return self
 
     @property
-    def is_animated(self):
-        if self.hash.startswith("a_"):
-            return True
-        return False
+    def is_animated(self) -> bool:
+        return self.hash.startswith("a_")
+
+    @property
+    def url(self) -> str:
+        return self.url_for()
+
+    def url_for(self, size: int = 4096, format: Optional[str] = None) -> str:
+        """Format the CDN url of the asset
+
+        Args:
+            size (int): Requested size, a power of 2 between 16 and 4096, defaults to 4096
+            format (str): png, jpg, webp or gif, defaults to gif for animated assets and png otherwise
+
+        Returns:
+            str: The url
+        """
+        if format is None:
+            format = "gif" if self.is_animated else "png"
+        return _template(self.kind).format(self.id, self.hash, format, size)
+
+
+def asset_property(slot: str, kind: str) -> property:
+    """Expose a stored asset hash as an Asset, built only when it's read.
+
+    Setting it takes a hash, an Asset or None, hashes are interned since the same ones show up a lot.
+
+    Args:
+        slot (str): Attribute the hash is stored in
+        kind (str): CDN path of the asset, like "avatars" or "icons"
+
+    Returns:
+        property: The property
+    """
+    def getter(self) -> Optional[Asset]:
+        value = getattr(self, slot)
+        if value is None or self.id is None:
+            return None
+        return Asset(self.id, value, kind)
+
+    def setter(self, value: Optional[Asset | str]):
+        if isinstance(value, Asset):
+            value = value.hash
+        setattr(self, slot, intern(value) if value is not None else None)
+
+    return property(getter, setter)
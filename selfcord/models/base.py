@@ -0,0 +1,354 @@
+from __future__ import annotations
+from copy import copy
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+if TYPE_CHECKING:
+    from ..api import HttpClient
+    from ..bot import Bot
+
+
+class Field:
+    """One attribute of a model schema.
+
+    Args:
+        key (str, optional): Payload key to read, defaults to the attribute name
+        default (Any, optional): Value used when the key is missing or null
+        factory (Callable, optional): Called for a fresh default instead, for lists and such
+        convert (Callable, optional): Called as convert(model, value) on non null values
+        cast (Callable, optional): Called as cast(value) on non null values, for builtins like int
+        required (bool): Read with payload[key] so a missing key raises, defaults to False
+        dump (Callable, optional): Called as dump(value) to turn the stored value back into payload form, for snapshots
+    """
+    __slots__ = ("key", "default", "factory", "convert", "cast", "required", "dump")
+
+    def __init__(
+        self,
+        key: Optional[str] = None,
+        default: Any = None,
+        factory: Optional[Callable[[], Any]] = None,
+        convert: Optional[Callable[[Any, Any], Any]] = None,
+        cast: Optional[Callable[[Any], Any]] = None,
+        required: bool = False,
+        dump: Optional[Callable[[Any], Any]] = None,
+    ):
+        self.key = key
+        self.default = default
+        self.factory = factory
+        self.convert = convert
+        self.cast = cast
+        self.required = required
+        self.dump = dump
+
+
+def compile_parser(fields: dict[str, Field]) -> Callable[[Any, dict], None]:
+    """Build a parse function that sets every field of a schema from a payload.
+
+    The function body is generated once, so parsing is a straight run of
+    payload lookups and slot writes with no per field loop or branching on the schema.
+
+    Args:
+        fields (dict[str, Field]): Attribute names and their fields, set in this order
+
+    Returns:
+        Callable: parse(model, payload)
+    """
+    namespace: dict[str, Any] = {}
+    lines = ["def parse(self, payload):", "    get = payload.get"]
+    for index, (name, field) in enumerate(fields.items()):
+        key = field.key or name
+        if field.factory is not None:
+            namespace[f"factory_{index}"] = field.factory
+            fallback = f"factory_{index}()"
+        elif field.default is not None:
+            namespace[f"default_{index}"] = field.default
+            fallback = f"default_{index}"
+        else:
+            fallback = "None"
+
+        if field.convert is not None:
+            namespace[f"convert_{index}"] = field.convert
+            converted = f"convert_{index}(self, value)"
+        elif field.cast is not None:
+            namespace[f"cast_{index}"] = field.cast
+            converted = f"cast_{index}(value)"
+        else:
+            converted = None
+
+        if field.required:
+            value = f"payload[{key!r}]"
+        elif fallback == "None" and converted is None:
+            lines.append(f"    self.{name} = get({key!r})")
+            continue
+        else:
+            value = f"get({key!r})"
+
+        if converted is not None:
+            lines.append(f"    value = {value}")
+            if field.required:
+                lines.append(f"    self.{name} = {converted}")
+            else:
+                lines.append(f"    self.{name} = {converted} if value is not None else {fallback}")
+        elif field.required:
+            lines.append(f"    self.{name} = {value}")
+        else:
+            lines.append(f"    value = {value}")
+            lines.append(f"    self.{name} = value if value is not None else {fallback}")
+    exec("\n".join(lines), namespace)
+    return namespace["parse"]
+
+
+def key_map(fields: dict[str, Field]) -> dict[str, tuple[tuple[str, Field], ...]]:
+    """Group the fields of a schema by the payload key they're read from, a key can feed several fields
+
+    Args:
+        fields (dict[str, Field]): Attribute names and their fields
+
+    Returns:
+        dict: Payload key to (attribute name, field) pairs
+    """
+    keys: dict[str, list[tuple[str, Field]]] = {}
+    for name, field in fields.items():
+        keys.setdefault(field.key or name, []).append((name, field))
+    return {key: tuple(targets) for key, targets in keys.items()}
+
+
+class Changes(dict):
+    """What a partial update changed, attribute name to (before, after).
+
+    Changes of a nested model, like the user behind a member, are a Changes of their own.
+    Lazily decoded fields hold their raw payload values. ``before`` only copies the model
+    when it's read, so updates nobody looks at don't pay for a snapshot.
+    """
+    __slots__ = ("model",)
+
+    def __init__(self, model: Any):
+        super().__init__()
+        self.model = model
+
+    def __repr__(self) -> str:
+        return f"<Changes {type(self.model).__name__} {', '.join(self)}>"
+
+    @property
+    def after(self) -> Any:
+        return self.model
+
+    @property
+    def before(self) -> Any:
+        """A shallow copy of the model with the changed fields set back"""
+        model = copy(self.model)
+        lazy = getattr(model, "_lazy", {})
+        for name, value in self.items():
+            if isinstance(value, Changes):
+                setattr(model, name, value.before)
+            elif name in lazy:
+                # Put the old raw part back and let it decode from that
+                model._payload = {**(model._payload or {}), model._lazy_key(name): value[0]}
+                try:
+                    delattr(model, name)
+                except AttributeError:
+                    pass
+            else:
+                setattr(model, name, value[0])
+        return model
+
+
+class Model:
+    """Base of every model tied to a bot.
+
+    Models are slotted, subclasses list the fields they set in ``__slots__``.
+    Only the bot is stored per instance, http is read through it.
+
+    Models can declare their payload fields in ``_fields``. The fields of the class and
+    its bases are compiled into ``_parse(payload)`` when the class is created.
+    """
+    __slots__ = ("bot",)
+
+    bot: Bot
+    _fields: dict[str, Field] = {}
+    # Fields of the class and all its bases, filled in by __init_subclass__
+    _schema: dict[str, Field] = {}
+    # _schema grouped by payload key, for partial updates
+    _keys: dict[str, tuple[tuple[str, Field], ...]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields: dict[str, Field] = {}
+        for base in reversed(cls.__mro__):
+            fields.update(base.__dict__.get("_fields", {}))
+        if fields:
+            cls._schema = fields
+            cls._keys = key_map(fields)
+            cls._parse = compile_parser(fields)
+
+    def _parse(self, payload: dict):
+        pass
+
+    def _convert(self, name: str, value: Any) -> Any:
+        """Convert a single raw value the way _parse would, for partial updates"""
+        field = self._schema.get(name)
+        if field is None or value is None:
+            return value
+        if field.convert is not None:
+            return field.convert(self, value)
+        if field.cast is not None:
+            return field.cast(value)
+        return value
+
+    def _diff(self, payload: dict, keys: Optional[dict] = None, skip_null: bool = False, changes: Optional[Changes] = None) -> Changes:
+        """Apply the schema fields present in a payload, only writing the ones whose value changed
+
+        Args:
+            payload (dict): Partial payload
+            keys (dict, optional): Result of key_map for the fields to apply, defaults to the model's schema
+            skip_null (bool): Leave fields alone when the payload has them as null, defaults to False
+            changes (Changes, optional): Change set to add to, a new one is made by default
+
+        Returns:
+            Changes: The fields that changed
+        """
+        if changes is None:
+            changes = Changes(self)
+        if keys is None:
+            keys = self._keys
+        for key, value in payload.items():
+            targets = keys.get(key)
+            if targets is None or (value is None and skip_null):
+                continue
+            for name, field in targets:
+                if value is None:
+                    new = field.factory() if field.factory is not None else field.default
+                elif field.convert is not None:
+                    new = field.convert(self, value)
+                elif field.cast is not None:
+                    new = field.cast(value)
+                else:
+                    new = value
+                old = getattr(self, name, None)
+                if new != old or type(new) is not type(old):
+                    setattr(self, name, new)
+                    changes[name] = (old, new)
+        return changes
+
+    def partial_update(self, payload: dict) -> Changes:
+        """Apply a partial payload, like the ones update events carry
+
+        Args:
+            payload (dict): Partial payload, missing fields are left alone
+
+        Returns:
+            Changes: The fields that changed
+        """
+        return self._diff(payload)
+
+    def to_payload(self, fields: Optional[dict[str, Field]] = None) -> dict:
+        """Turn the model back into a payload it can be parsed from again, used for cache snapshots
+
+        Args:
+            fields (dict[str, Field], optional): Fields to dump, defaults to the model's schema
+
+        Returns:
+            dict: The payload, null fields are left out
+        """
+        payload = {}
+        for name, field in (fields or self._schema).items():
+            value = getattr(self, name, None)
+            if value is None:
+                continue
+            if field.dump is not None:
+                value = field.dump(value)
+            payload[field.key or name] = value
+        return payload
+
+    @property
+    def http(self) -> HttpClient:
+        return self.bot.http
+
+
+class LazyModel(Model):
+    """Model that keeps its raw payload around and decodes some fields on first access.
+
+    ``_lazy`` maps attribute names to decoders taking the model and the raw payload.
+    The decoded value is stored in the attribute's slot, so only the first read pays for it.
+    """
+    __slots__ = ("_payload",)
+
+    _lazy: dict[str, Callable[[Any, dict], Any]] = {}
+    # Payload keys of lazy fields that aren't stored under their own name
+    _lazy_keys: dict[str, str] = {}
+
+    def __new__(cls, *args, **kwargs):
+        self = super().__new__(cls)
+        # None until the first payload, so fresh models skip the reset below
+        self._payload = None
+        return self
+
+    def __getattr__(self, name: str):
+        # Only reached for slots that haven't been set yet
+        decoder = type(self)._lazy.get(name)
+        if decoder is None:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        value = decoder(self, self._payload)
+        setattr(self, name, value)
+        return value
+
+    def _set_payload(self, payload: dict):
+        if self._payload is not None:
+            # Anything decoded from the previous payload is stale now
+            for name in self._lazy:
+                try:
+                    delattr(self, name)
+                except AttributeError:
+                    pass
+        self._payload = payload
+
+    def _lazy_key(self, name: str) -> str:
+        return self._lazy_keys.get(name, name)
+
+    def _diff_lazy(self, payload: dict, changes: Changes) -> Changes:
+        # Lazy fields are compared raw and only decoded again when they're read
+        for name in self._lazy:
+            key = self._lazy_key(name)
+            if key not in payload:
+                continue
+            value = payload[key]
+            old = self._payload.get(key) if self._payload else None
+            if value == old:
+                continue
+            # A new dict, before copies may still point at the old one
+            self._payload = {**(self._payload or {}), key: value}
+            try:
+                delattr(self, name)
+            except AttributeError:
+                pass
+            changes[name] = (old, value)
+        return changes
+
+    def partial_update(self, payload: dict) -> Changes:
+        return self._diff_lazy(payload, self._diff(payload))
+
+    def materialize(self):
+        """Decode every lazy field now and drop the raw payload
+
+        Returns:
+            The model itself
+        """
+        for name in self._lazy:
+            getattr(self, name)
+        self._payload = {}
+        return self
+
+    def to_payload(self, fields: Optional[dict[str, Field]] = None) -> dict:
+        payload = super().to_payload(fields)
+        for name in self._lazy:
+            key = self._lazy_key(name)
+            try:
+                value = object.__getattribute__(self, name)
+            except AttributeError:
+                # Never decoded, the raw part is still there as it came in
+                if self._payload and key in self._payload:
+                    payload[key] = self._payload[key]
+                continue
+            if isinstance(value, list):
+                value = [item.to_payload() if isinstance(item, Model) else item for item in value]
+            payload[key] = value
+        return payload
@@ -1,12 +1,14 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING, Optional
 from .message import Message
-from .assets import Asset
+from sys import intern
+from .assets import asset_property
 import random
 import asyncio
 import datetime
 import time
 from .permissions import Permission
+from .base import Model, LazyModel, Field
 
 if TYPE_CHECKING:
     from .users import User
@@ -14,45 +16,58 @@ if TYPE_CHECKING:
     from ..api import HttpClient
 
 
-class PermissionOverwrite:
+class PermissionOverwrite(Model):
+    __slots__ = ("id", "type", "allow", "deny")
+
+    _fields = {
+        "id": Field(required=True, cast=int),
+        "type": Field(required=True),
+        "allow": Field(required=True, cast=Permission),
+        "deny": Field(required=True, cast=Permission),
+    }
+
     def __init__(self, payload: dict, bot: Bot):
         self.bot: Bot = bot
-        self.http = bot.http
         self.update(payload)
 
     def update(self, payload: dict):
-        self.id: str = payload["id"]
-        self.type: int = payload["type"]
-        self.allow: int = Permission(payload["allow"], self.bot)
-        self.deny: int = Permission(payload["deny"], self.bot)
+        self._parse(payload)
+
+class Channel(LazyModel):
+    __slots__ = ("id", "type", "flags", "last_message_id", "guild_id", "permission_overwrites")
+
+    # Subclasses only add their own fields, update parses the whole chain in one go
+    _fields = {
+        "id": Field(required=True, cast=int),
+        "type": Field(required=True, cast=int),
+        "flags": Field(),
+        "last_message_id": Field(cast=int),
+        "guild_id": Field(cast=int),
+    }
+
+    # Overwrites are only needed for permission checks, keep them raw until then
+    _lazy = {
+        "permission_overwrites": lambda self, payload: [
+            PermissionOverwrite(overwrite, self.bot) for overwrite in payload.get("permission_overwrites", [])
+        ],
+    }
 
-class Channel:
     def __init__(self, payload: dict, bot: Bot):
         self.bot: Bot = bot
-        self.http: HttpClient = bot.http
         self.update(payload)
 
     def update(self, payload):
-        self.id = payload["id"]
-        self.type = payload["type"]
-        self.flags = payload.get("flags")
-        self.last_message_id = payload.get("last_message_id")
-        self.guild_id = payload.get("guild_id")
+        self._parse(payload)
+        self._set_payload({"permission_overwrites": payload.get("permission_overwrites", [])})
 
     async def delete(self):
         await self.http.request(
-            "delete", "/channels/" + self.id, json={}
+            "delete", f"/channels/{self.id}", json={}
         )
 
 
 class Callable(Channel):
-    def __init__(self, payload: dict, bot: Bot):
-        self.bot: Bot = bot
-        self.http: HttpClient = bot.http
-        self.update(payload)
-
-    def update(self, payload):
-        pass
+    __slots__ = ()
 
     async def call(self):
         if self.type in (1,3):
@@ -73,10 +88,7 @@ class Callable(Channel):
 
 
 class Messageable(Channel):
-    def __init__(self, payload: dict, bot: Bot):
-        self.bot: Bot = bot
-        self.http: HttpClient = bot.http
-        self.update(payload)
+    __slots__ = ()
 
     def __repr__(self):
         return f"<{self.__class__.__name__} id={self.id}>"
@@ -84,12 +96,6 @@ class Messageable(Channel):
     def __str__(self):
         return self.name
 
-    def update(self, payload):
-        self.id: str = payload["id"]
-        self.type: int = int(payload["type"])
-        self.flags = payload.get("flags")
-        self.last_message_id: Optional[str] = payload.get("last_message_id")
-
     def calc_nonce(self, date="now"):
         if date == "now":
             unixts = time.time()
@@ -138,48 +144,90 @@ class Messageable(Channel):
                 headers = {"referer": f"https://canary.discord.com/channels/{self.guild_id}/{self.id}"}
             )
 
-    async def history(self, limit: int = 50, bot_user_only: bool = False):
-        n = 0
+    def cached_history(
+        self,
+        before: Optional[str | int | datetime.datetime] = None,
+        after: Optional[str | int | datetime.datetime] = None,
+        limit: Optional[int] = None,
+    ) -> list[Message]:
+        """Messages of this channel that are in the cache, newest first. Never touches the API.
+
+        Args:
+            before (str | int | datetime, optional): Only messages older than this message id or time
+            after (str | int | datetime, optional): Only messages newer than this message id or time, pass a datetime to get the messages of the last N minutes
+            limit (int, optional): Maximum amount of messages to return
+
+        Returns:
+            list[Message]: The cached messages
+        """
+        return self.bot.cached_messages.history(self.id, before=before, after=after, limit=limit)
+
+    async def history(self, limit: int = 50, bot_user_only: bool = False) -> list[Message]:
+        """Latest messages of the channel, newest first.
+
+        Runs of messages the cache holds without gaps are served from it, only the missing pages are requested.
+
+        Args:
+            limit (int): Amount of messages to look through, defaults to 50
+            bot_user_only (bool): Only return messages sent by the client, defaults to False
+
+        Returns:
+            list[Message]: The messages
+        """
         if self.type in (1, 3):
             headers = {"referer": f"https://canary.discord.com/channels/@me/{self.id}"}
         else:
             headers = {
                 "referer": f"https://canary.discord.com/channels/{self.guild_id}/{self.id}"
             }
-        json = await self.http.request(
-            "GET", f"/channels/{self.id}/messages?limit=50",
-            headers=headers
-        )
-        msgs = []
-
-        for message in json:
-            msg = Message(message, self.bot)
-            if bot_user_only:
-                if msg.author.id == self.bot.user.id:
-                    msgs.append(msg)
-            else:
-                msgs.append(msg)
-            self.bot.cached_messages[msg.id] = msg
-            n += 1
-
-        while n < limit:
-            last = msgs[-1]
-            json = await self.http.request(
-                "GET", f"/channels/{self.id}/messages?before={last.id}&limit=50",
-                headers=headers
-            )
-
-            for message in json:
-                msg = Message(message, self.bot)
-                if bot_user_only:
-                    if msg.author.id == self.bot.user.id:
-                        msgs.append(msg)
-                else:
-                    msgs.append(msg)
-                self.bot.cached_messages[msg.id] = msg
-                n += 1
-
-        return msgs[:limit]
+        cache = self.bot.cached_messages
+        msgs: list[Message] = []
+        # None means from the newest message onwards
+        before: Optional[int] = None
+
+        while len(msgs) < limit:
+            cursor = before
+            if cursor is None and self.last_message_id is not None:
+                cursor = int(self.last_message_id) + 1
+            if cursor is not None:
+                cached, low = cache.complete_below(self.id, cursor)
+                if low < cursor:
+                    msgs.extend(cached)
+                    before = low
+                    if low <= 0:
+                        break
+                    continue
+
+            amount = min(100, limit - len(msgs))
+            endpoint = f"/channels/{self.id}/messages?limit={amount}"
+            if before is not None:
+                endpoint += f"&before={before}"
+            json = await self.http.request("GET", endpoint, headers=headers)
+            if not json:
+                if json is not None and before is not None:
+                    # Nothing older than before, the start of the channel is cached
+                    cache.mark_complete(self.id, 0, before - 1)
+                break
+
+            page = [Message(message, self.bot) for message in json]
+            newest = int(page[0].id)
+            oldest = int(page[-1].id) if len(json) == amount else 0
+            # Marked before caching, evictions while caching the page split the range again
+            cache.mark_complete(self.id, oldest, before - 1 if before is not None else newest)
+            for msg in page:
+                cache[msg.id] = msg
+            if before is None:
+                self.last_message_id = page[0].id
+
+            msgs.extend(page)
+            before = int(page[-1].id)
+            if len(json) < amount:
+                break
+
+        msgs = msgs[:limit]
+        if bot_user_only:
+            return [msg for msg in msgs if msg.author is not None and msg.author.id == self.bot.user.id]
+        return msgs
 
     async def purge(self, amount: int):
         msgs = await self.history(amount, bot_user_only=True)
@@ -190,66 +238,49 @@ class Messageable(Channel):
 
 
 class DMChannel(Messageable, Callable):
-    def __init__(self, payload: dict, bot: Bot):
-        super().__init__(payload, bot)
-        super().update(payload)
-        self.bot = bot
-        self.http = bot.http
-        self.update(payload)
-
-    def update(self, payload: dict):
-        self.recipient: Optional[User] = self.bot.fetch_user(
-            payload["recipient_ids"][0] if payload.get("recipient_ids") is not None else ""
-        )
-        self.is_spam: Optional[bool] = payload.get("is_spam")
+    __slots__ = ("recipient", "is_spam")
 
+    _fields = {
+        "recipient": Field("recipient_ids", convert=lambda self, ids: self.bot.fetch_user(ids[0]) if ids else None, dump=lambda user: [user.id]),
+        "is_spam": Field(),
+    }
 
 
 class GroupChannel(Messageable, Callable):
-    def __init__(self, payload: dict, bot: Bot):
-        super().update(payload)
-        super().__init__(payload, bot)
-        self.bot = bot
-        self.http = bot.http
-        self.update(payload)
+    __slots__ = ("recipient", "is_spam", "icon_hash", "name", "last_pin_timestamp")
 
-    def update(self, payload: dict):
-        self.recipient: list[Optional[User]] = (
-            [self.bot.fetch_user(user) for user in payload["recipient_ids"]]
-            if payload.get("recipient_ids") is not None
-            else []
-        )
-        self.is_spam: Optional[bool] = payload.get("is_spam")
-        self.icon: Optional[Asset] = (
-            Asset(self.id, payload["icon"]).from_icon()
-            if payload.get("icon") is not None
-            else None
-        )
-        self.name: Optional[str] = payload.get("name")
-        self.last_pin_timestamp: Optional[int] = payload.get("last_pin_timestamp")
+    _fields = {
+        "recipient": Field(
+            "recipient_ids", factory=list,
+            convert=lambda self, ids: [self.bot.fetch_user(user) for user in ids],
+            dump=lambda users: [user.id for user in users if user is not None],
+        ),
+        "is_spam": Field(),
+        "icon_hash": Field("icon", cast=intern),
+        "name": Field(),
+        "last_pin_timestamp": Field(),
+    }
+
+    icon = asset_property("icon_hash", "channel-icons")
 
 
 class TextChannel(Messageable):
     """
     This class is used to represent a text channel in Discord.
     """
-    def __init__(self, payload: dict, bot: Bot):
-        self.bot = bot
-        self.http = bot.http
-        self.update(payload)
-        super().update(payload)
-        super().__init__(payload, bot)
-
-    def update(self, payload):
-        self.nsfw = payload.get("nsfw")
-        self.guild_id = payload.get("guild_id")
-        self.category_id = payload.get("parent_id")
-        self.position = payload.get("position")
-        self.rate_limit_per_user = payload.get("rate_limit_per_user")
-        self.name = payload.get("name")
-        self.last_pin_timestamp = payload.get("last_pin_timestamp")
-
-        self.permission_overwrites = [PermissionOverwrite(overwrite, self.bot) for overwrite in payload.get("permission_overwrites", [])] # type: ignore
+    __slots__ = (
+        "nsfw", "category_id", "position", "rate_limit_per_user", "name",
+        "last_pin_timestamp",
+    )
+
+    _fields = {
+        "nsfw": Field(),
+        "category_id": Field("parent_id", cast=int),
+        "position": Field(),
+        "rate_limit_per_user": Field(),
+        "name": Field(),
+        "last_pin_timestamp": Field(),
+    }
 
     async def edit(self, name: str="", topic: str="", nsfw: bool=False, timeout: int=0):
         self.name = name
@@ -257,7 +288,7 @@ class TextChannel(Messageable):
         self.rate_limit_per_user = timeout
 
         await self.http.request(
-            "patch", "/channels/" + self.id, json={
+            "patch", f"/channels/{self.id}", json={
                     "name": name,
                     "type": 0,
                     "topic": topic,
@@ -271,206 +302,140 @@ class TextChannel(Messageable):
 
 
 class VoiceChannel(Messageable, Callable):
-    def __init__(self, payload: dict, bot: Bot):
-        self.bot = bot
-        self.http = bot.http
-        self.update(payload)
-        super().update(payload)
-        super().__init__(payload, bot)
-
-    def update(self, payload):
-        self.guild_id = payload.get("guild_id")
-        self.category_id = payload.get("parent_id")
-        self.position = payload.get("position")
-        self.permission_overwrites = [PermissionOverwrite(overwrite, self.bot) for overwrite in payload.get("permission_overwrites", [])] # type: ignore
-        self.user_limit = payload.get("user_limit")
-        self.topic = payload.get("topic")
-        self.rtc_region = payload.get("rtc_region")
-        self.slowdown = payload.get("rate_limit_per_user")
-        self.nsfw = payload.get("nsfw")
-        self.name = payload.get("name")
-        self.icon_emoji = payload.get("icon_emoji")
-        self.bitrate = payload.get("bitrate")
+    __slots__ = (
+        "category_id", "position", "user_limit", "topic",
+        "rtc_region", "slowdown", "nsfw", "name", "icon_emoji", "bitrate",
+    )
+
+    _fields = {
+        "category_id": Field("parent_id", cast=int),
+        "position": Field(),
+        "user_limit": Field(),
+        "topic": Field(),
+        "rtc_region": Field(),
+        "slowdown": Field("rate_limit_per_user"),
+        "nsfw": Field(),
+        "name": Field(),
+        "icon_emoji": Field(),
+        "bitrate": Field(),
+    }
 
 
 class Category(Messageable):
-    def __init__(self, payload: dict, bot: Bot):
-        self.bot = bot
-        self.http = bot.http
-        self.update(payload)
-        super().update(payload)
-        super().__init__(payload, bot)
+    __slots__ = ("name", "position")
 
-    def update(self, payload):
-        self.name = payload.get("name")
-        self.guild_id = payload.get("guild_id")
-        self.position = payload.get("position")
-        self.permission_overwrites = [PermissionOverwrite(overwrite, self.bot) for overwrite in payload.get("permission_overwrites", [])] # type: ignore
+    _fields = {
+        "name": Field(),
+        "position": Field(),
+    }
 
 
 class Announcement(Messageable):
-    def __init__(self, payload: dict, bot: Bot):
-        self.bot = bot
-        self.http = bot.http
-        self.update(payload)
-        super().update(payload)
-        super().__init__(payload, bot)
+    __slots__ = ("name", "position")
 
-    def update(self, payload):
-        self.name = payload.get("name")
-        self.guild_id = payload.get("guild_id")
-        self.position = payload.get("position")
-        self.permission_overwrites = [PermissionOverwrite(overwrite, self.bot) for overwrite in payload.get("permission_overwrites", [])] # type: ignore
+    _fields = {
+        "name": Field(),
+        "position": Field(),
+    }
 
 
 class AnnouncementThread(Messageable):
-    def __init__(self, payload: dict, bot: Bot):
-        self.bot = bot
-        self.http = bot.http
-        self.update(payload)
-        super().update(payload)
-        super().__init__(payload, bot)
+    __slots__ = ("name", "position")
 
-    def update(self, payload):
-        self.name = payload.get("name")
-        self.guild_id = payload.get("guild_id")
-        self.position = payload.get("position")
-        self.permission_overwrites = [PermissionOverwrite(overwrite, self.bot) for overwrite in payload.get("permission_overwrites", [])] # type: ignore
+    _fields = {
+        "name": Field(),
+        "position": Field(),
+    }
 
 
 class PublicThread(Messageable):
-    def __init__(self, payload: dict, bot: Bot):
-        self.bot = bot
-        self.http = bot.http
-        self.update(payload)
-        super().update(payload)
-        super().__init__(payload, bot)
+    __slots__ = ("name", "position")
 
-    def update(self, payload):
-        self.name = payload.get("name")
-        self.guild_id = payload.get("guild_id")
-        self.position = payload.get("position")
-        self.permission_overwrites = [PermissionOverwrite(overwrite, self.bot) for overwrite in payload.get("permission_overwrites", [])] # type: ignore
+    _fields = {
+        "name": Field(),
+        "position": Field(),
+    }
 
 
 class PrivateThread(Messageable):
-    def __init__(self, payload: dict, bot: Bot):
-        self.bot = bot
-        self.http = bot.http
-        self.update(payload)
-        super().update(payload)
-        super().__init__(payload, bot)
+    __slots__ = ("name", "position")
 
-    def update(self, payload):
-        self.name = payload.get("name")
-        self.guild_id = payload.get("guild_id")
-        self.position = payload.get("position")
-        self.permission_overwrites = [PermissionOverwrite(overwrite, self.bot) for overwrite in payload.get("permission_overwrites", [])] # type: ignore
+    _fields = {
+        "name": Field(),
+        "position": Field(),
+    }
 
 
 class StageChannel(Messageable):
-    def __init__(self, payload: dict, bot: Bot):
-        self.bot = bot
-        self.http = bot.http
-        self.update(payload)
-        super().update(payload)
-        super().__init__(payload, bot)
+    __slots__ = ("name", "position")
 
-    def update(self, payload):
-        self.last_message_id: Optional[str] = payload.get("last_message_id")
-        self.name = payload.get("name")
-        self.guild_id = payload.get("guild_id")
-        self.position = payload.get("position")
-        self.permission_overwrites = [PermissionOverwrite(overwrite, self.bot) for overwrite in payload.get("permission_overwrites", [])] # type: ignore
+    _fields = {
+        "name": Field(),
+        "position": Field(),
+    }
 
 
 class Directory(Messageable):
-    def __init__(self, payload: dict, bot: Bot):
-        self.bot = bot
-        self.http = bot.http
-        self.update(payload)
-        super().update(payload)
-        super().__init__(payload, bot)
+    __slots__ = ("name", "position")
 
-    def update(self, payload):
-        self.name = payload.get("name")
-        self.guild_id = payload.get("guild_id")
-        self.position = payload.get("position")
-        self.permission_overwrites = [PermissionOverwrite(overwrite, self.bot) for overwrite in payload.get("permission_overwrites", [])] # type: ignore
+    _fields = {
+        "name": Field(),
+        "position": Field(),
+    }
 
 
 class ForumChannel(Messageable):
-    def __init__(self, payload: dict, bot: Bot):
-        self.bot = bot
-        self.http = bot.http
-        self.update(payload)
-        super().update(payload)
-        super().__init__(payload, bot)
-
-    def update(self, payload):
-        self.name = payload.get("name")
-        self.guild_id = payload.get("guild_id")
-        self.position = payload.get("position")
-        self.topic = payload.get("topic")
-        self.template = payload.get("template")
-        self.slowdown = payload.get("rate_limit_per_user")
-        self.category_id = payload.get("category_id")
-        self.nsfw = payload.get("nsfw")
-        self.default_thread_rate_limit_per_user = payload.get(
-            "default_thread_rate_limit_per_user"
-        )
-        self.default_sort_order = payload.get("default_sort_order")
-        self.default_reaction_emoji = payload.get("default_reaction_emoji")
-        self.default_forum_layout = payload.get("default_forum_layout")
-        self.available_tags = payload.get("available_tags")
-
-        self.permission_overwrites = [PermissionOverwrite(overwrite, self.bot) for overwrite in payload.get("permission_overwrites", [])] # type: ignore
+    __slots__ = (
+        "name", "position", "topic", "template", "slowdown", "category_id", "nsfw",
+        "default_thread_rate_limit_per_user", "default_sort_order",
+        "default_reaction_emoji", "default_forum_layout", "available_tags",
+    )
+
+    _fields = {
+        "name": Field(),
+        "position": Field(),
+        "topic": Field(),
+        "template": Field(),
+        "slowdown": Field("rate_limit_per_user"),
+        "category_id": Field("parent_id", cast=int),
+        "nsfw": Field(),
+        "default_thread_rate_limit_per_user": Field(),
+        "default_sort_order": Field(),
+        "default_reaction_emoji": Field(),
+        "default_forum_layout": Field(),
+        "available_tags": Field(),
+    }
 
 
 class MediaChannel(Messageable):
-    def __init__(self, payload: dict, bot: Bot):
-        self.bot = bot
-        self.http = bot.http
-        self.update(payload)
-        super().update(payload)
-        super().__init__(payload, bot)
-
-    def update(self, payload):
-        self.name = payload.get("name")
-        self.guild_id = payload.get("guild_id")
-        self.position = payload.get("position")
-        self.permission_overwrites = [PermissionOverwrite(overwrite, self.bot) for overwrite in payload.get("permission_overwrites", [])] # type: ignore
-
-
+    __slots__ = ("name", "position")
+
+    _fields = {
+        "name": Field(),
+        "position": Field(),
+    }
+
+
+# Channel class for every channel type, unknown types are treated as text channels
+CHANNEL_TYPES: dict[int, type[Messageable]] = {
+    0: TextChannel,
+    1: DMChannel,
+    2: VoiceChannel,
+    3: GroupChannel,
+    4: Category,
+    5: Announcement,
+    10: AnnouncementThread,
+    11: PublicThread,
+    12: PrivateThread,
+    13: StageChannel,
+    14: Directory,
+    15: ForumChannel,
+    16: MediaChannel,
+}
 
 
 class Convert(Messageable):
+    __slots__ = ()
+
     def __new__(cls, payload: dict, bot: Bot) -> Messageable:
-        tpe = payload["type"]
-        if tpe == 0:
-            return TextChannel(payload, bot)
-        if tpe == 1:
-            return DMChannel(payload, bot)
-        if tpe == 2:
-            return VoiceChannel(payload, bot)
-        if tpe == 3:
-            return GroupChannel(payload, bot)
-        if tpe == 4:
-            return Category(payload, bot)
-        if tpe == 5:
-            return Announcement(payload, bot)
-        if tpe == 10:
-            return AnnouncementThread(payload, bot)
-        if tpe == 11:
-            return PublicThread(payload, bot)
-        if tpe == 12:
-            return PrivateThread(payload, bot)
-        if tpe == 13:
-            return StageChannel(payload, bot)
-        if tpe == 14:
-            return Directory(payload, bot)
-        if tpe == 15:
-            return ForumChannel(payload, bot)
-        if tpe == 16:
-            return MediaChannel(payload, bot)
-        return TextChannel(payload, bot)
+        return CHANNEL_TYPES.get(payload["type"], TextChannel)(payload, bot)
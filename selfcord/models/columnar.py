@@ -0,0 +1,404 @@
+from __future__ import annotations
+from array import array
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Iterator, Optional
+from .base import Changes
+from .users import User, Member
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+if TYPE_CHECKING:
+    from ..bot import Bot
+
+
+def _to_ms(value: datetime | str | int) -> int:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    return value
+
+
+class ColumnarMemberCollection:
+    """Members of a very large guild, stored column by column instead of one Member per user.
+
+    Ids, join times and flags live in arrays, role ids in one packed array that every row
+    points into, nicknames and user names in an interned string table. Member objects are only
+    built as views when something asks for one, so changing a view doesn't change the store,
+    go through ``merge`` for that.
+
+    Queries run over whole columns, with NumPy when it's installed.
+    """
+    __slots__ = (
+        "bot", "guild_id", "_index", "_ids", "_joined_at", "_flags", "_nicks", "_usernames",
+        "_global_names", "_avatars", "_role_start", "_role_count", "_role_ids", "_role_rows",
+        "_strings", "_string_ids", "_extra", "_removed", "_stale_roles",
+    )
+
+    DEAF = 1
+    MUTE = 2
+    PENDING = 4
+
+    # Rarely set, kept per user id instead of a column
+    EXTRA_FIELDS = ("premium_since", "communication_disabled_until", "permissions")
+
+    def __init__(self, bot: Bot, guild_id: Optional[int] = None):
+        self.bot = bot
+        self.guild_id = guild_id
+        self.clear()
+
+    def __iter__(self) -> Iterator[Member]:
+        for row in list(self._index.values()):
+            yield self._view(row)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, member: Member | str | int) -> bool:
+        if isinstance(member, Member):
+            return member.id in self._index
+        return int(member) in self._index
+
+    def clear(self):
+        self._index: dict[int, int] = {}
+        self._ids = array("Q")
+        # -1 when unknown
+        self._joined_at = array("q")
+        self._flags = array("B")
+        # Indexes into _strings, 0 is None
+        self._nicks = array("I")
+        self._usernames = array("I")
+        self._global_names = array("I")
+        self._avatars = array("I")
+        # CSR style, a row's roles are _role_ids[start:start + count].
+        # _role_rows maps each packed entry back to its row, replaced entries are zeroed.
+        self._role_start = array("I")
+        self._role_count = array("H")
+        self._role_ids = array("Q")
+        self._role_rows = array("I")
+        self._strings: list[Optional[str]] = [None]
+        self._string_ids: dict[str, int] = {}
+        self._extra: dict[int, dict] = {}
+        self._removed = 0
+        self._stale_roles = 0
+
+    def add(self, member: Member):
+        """Add a member, replacing any member already stored under the same id
+
+        Args:
+            member (Member): Member to add
+        """
+        payload = {"user_id": member.id, "roles": member.roles}
+        for key in Member.MEMBER_FIELDS:
+            if key not in ("roles", "guild_id"):
+                payload[key] = getattr(member, key)
+        self.remove(member.id)
+        self._write(member.id, payload)
+        self._maybe_compact()
+
+    def ids(self) -> set[int]:
+        """IDs of the stored members, without building them"""
+        return set(self._index)
+
+    def get(self, user_id: str | int) -> Optional[Member]:
+        """Get a member by user id
+
+        Args:
+            user_id (str | int): ID of the user
+
+        Returns:
+            Member: A view of the member, None if not cached
+        """
+        row = self._index.get(int(user_id))
+        if row is not None:
+            return self._view(row)
+
+    def remove(self, user_id: str | int) -> Optional[Member]:
+        """Remove a member by user id
+
+        Args:
+            user_id (str | int): ID of the user
+
+        Returns:
+            Member: A view of the removed member, None if not cached
+        """
+        user_id = int(user_id)
+        row = self._index.get(user_id)
+        if row is None:
+            return None
+        member = self._view(row)
+        del self._index[user_id]
+        self._extra.pop(user_id, None)
+        self._ids[row] = 0
+        self._set_roles(row, [])
+        self._removed += 1
+        self._maybe_compact()
+        return member
+
+    def merge(self, payload: dict) -> Member:
+        """Add a member from a gateway payload or update the stored one
+
+        Args:
+            payload (dict): Member payload, either with a nested user or a user_id
+
+        Returns:
+            Member: A view of the stored member
+        """
+        return self._merge(payload)[0]
+
+    def _merge(self, payload: dict) -> tuple[Member, Optional[Changes]]:
+        # The only place the user gets updated, what changed on a cached one is handed back for diff
+        user = payload.get("user")
+        user_id = int(user["id"] if user is not None else payload["user_id"])
+        if user_id not in self._index and not self.bot.should_cache("members", self.guild_id, user_id, len(self._index)):
+            # Left out by the cache policy, build a member that isn't stored, its user isn't cached either
+            member = Member.detached(payload, self.bot)
+            member.guild_id = self.guild_id
+            return member, None
+        user_changes = None
+        if user is not None:
+            cached = self.bot.fetch_user(user_id)
+            if cached is not None:
+                user_changes = cached.partial_update(user)
+        self._write(user_id, payload)
+        # Compacting moves rows around, look it up again
+        self._maybe_compact()
+        return self._view(self._index[user_id]), user_changes
+
+    def diff(self, payload: dict) -> tuple[Member, Optional[Changes]]:
+        """Same as merge, but also returns what changed
+
+        Args:
+            payload (dict): Member payload, either with a nested user or a user_id
+
+        Returns:
+            tuple[Member, Changes]: A view of the stored member and its changes, None if it wasn't stored before
+        """
+        user = payload.get("user")
+        user_id = int(user["id"] if user is not None else payload["user_id"])
+        row = self._index.get(user_id)
+        if row is None:
+            return self.merge(payload), None
+        # The old view is already a snapshot, nothing else points at it
+        before = self._view(row)
+        member, user_changes = self._merge(payload)
+        if user is not None and user_changes is None:
+            # Not cached, the name columns are all there is of the user
+            user_changes = Changes(member.user)
+            for name in ("username", "global_name", "avatar_hash"):
+                old, new = getattr(before.user, name), getattr(member.user, name)
+                if old != new:
+                    user_changes[name] = (old, new)
+        changes = Changes(member)
+        if user_changes:
+            changes["user"] = user_changes
+        for name in Member.MEMBER_FIELDS:
+            old, new = getattr(before, name), getattr(member, name)
+            if old != new:
+                changes[name] = (old, new)
+        return member, changes
+
+    def query(
+        self,
+        role: Optional[str | int] = None,
+        joined_after: Optional[datetime | str | int] = None,
+        joined_before: Optional[datetime | str | int] = None,
+        flags: int = 0,
+    ) -> list[int]:
+        """Find members without building them
+
+        Args:
+            role (str | int): Only members with this role id
+            joined_after (datetime | str | int): Only members that joined after this, a datetime, ISO string or unix ms
+            joined_before (datetime | str | int): Only members that joined before this
+            flags (int): Only members with all of these flags set, see DEAF, MUTE and PENDING
+
+        Returns:
+            list[int]: IDs of the matching members, in the order they were stored
+        """
+        after = _to_ms(joined_after) if joined_after is not None else None
+        before = _to_ms(joined_before) if joined_before is not None else None
+        role = int(role) if role is not None else None
+        if numpy is not None:
+            return self._query_numpy(role, after, before, flags)
+
+        if role is not None:
+            rows = sorted({row for row, role_id in zip(self._role_rows, self._role_ids) if role_id == role})
+        else:
+            rows = range(len(self._ids))
+        ids, joined_at, row_flags = self._ids, self._joined_at, self._flags
+        result = []
+        for row in rows:
+            if not ids[row]:
+                continue
+            joined = joined_at[row]
+            if after is not None and joined <= after:
+                continue
+            if before is not None and not 0 <= joined < before:
+                continue
+            if row_flags[row] & flags != flags:
+                continue
+            result.append(ids[row])
+        return result
+
+    def _query_numpy(self, role: Optional[int], after: Optional[int], before: Optional[int], flags: int) -> list[int]:
+        # Zero-copy views over the arrays, they must not outlive this call or appends would fail
+        ids = numpy.frombuffer(self._ids, dtype=self._ids.typecode)
+        mask = ids != 0
+        if role is not None:
+            role_ids = numpy.frombuffer(self._role_ids, dtype=self._role_ids.typecode)
+            role_rows = numpy.frombuffer(self._role_rows, dtype=self._role_rows.typecode)
+            has_role = numpy.zeros(len(ids), dtype=bool)
+            has_role[role_rows[role_ids == role]] = True
+            mask &= has_role
+        if after is not None or before is not None:
+            joined_at = numpy.frombuffer(self._joined_at, dtype=self._joined_at.typecode)
+            if after is not None:
+                mask &= joined_at > after
+            if before is not None:
+                mask &= (joined_at >= 0) & (joined_at < before)
+        if flags:
+            row_flags = numpy.frombuffer(self._flags, dtype=self._flags.typecode)
+            mask &= (row_flags & flags) == flags
+        return ids[mask].tolist()
+
+    def with_role(self, role: str | int) -> list[int]:
+        """IDs of every member with a role
+
+        Args:
+            role (str | int): ID of the role
+
+        Returns:
+            list[int]: IDs of the members
+        """
+        return self.query(role=role)
+
+    def _intern(self, value: Optional[str]) -> int:
+        if value is None:
+            return 0
+        index = self._string_ids.get(value)
+        if index is None:
+            index = self._string_ids[value] = len(self._strings)
+            self._strings.append(value)
+        return index
+
+    def _write(self, user_id: int, payload: dict) -> int:
+        row = self._index.get(user_id)
+        if row is None:
+            row = self._index[user_id] = len(self._ids)
+            self._ids.append(user_id)
+            self._joined_at.append(-1)
+            self._flags.append(0)
+            self._nicks.append(0)
+            self._usernames.append(0)
+            self._global_names.append(0)
+            self._avatars.append(0)
+            self._role_start.append(len(self._role_ids))
+            self._role_count.append(0)
+
+        # Same as Member.partial_update, missing and null values leave the column alone
+        joined_at = payload.get("joined_at")
+        if joined_at is not None:
+            self._joined_at[row] = _to_ms(joined_at)
+        flags = self._flags[row]
+        for key, flag in (("deaf", self.DEAF), ("mute", self.MUTE), ("pending", self.PENDING)):
+            value = payload.get(key)
+            if value is not None:
+                flags = flags | flag if value else flags & ~flag
+        self._flags[row] = flags
+        nick = payload.get("nick")
+        if nick is not None:
+            self._nicks[row] = self._intern(nick)
+        roles = payload.get("roles")
+        if roles is not None:
+            self._set_roles(row, [int(getattr(role, "id", role)) for role in roles])
+        extra = {key: payload[key] for key in self.EXTRA_FIELDS if payload.get(key) is not None}
+        if extra:
+            self._extra.setdefault(user_id, {}).update(extra)
+
+        user = payload.get("user")
+        if user is not None:
+            for column, key in ((self._usernames, "username"), (self._global_names, "global_name"), (self._avatars, "avatar")):
+                if user.get(key) is not None:
+                    column[row] = self._intern(user[key])
+        return row
+
+    def _set_roles(self, row: int, roles: list[int]):
+        start, count = self._role_start[row], self._role_count[row]
+        role_ids = self._role_ids
+        if len(roles) <= count:
+            # Fits where the old roles were, leftover entries are zeroed so queries skip them
+            role_ids[start:start + count] = array("Q", roles + [0] * (count - len(roles)))
+            self._stale_roles += count - len(roles)
+        else:
+            for index in range(start, start + count):
+                role_ids[index] = 0
+            self._stale_roles += count
+            self._role_start[row] = len(role_ids)
+            role_ids.extend(roles)
+            self._role_rows.extend([row] * len(roles))
+        self._role_count[row] = len(roles)
+
+    def _maybe_compact(self):
+        # Rebuild once most rows or packed roles are dead
+        if (
+            (self._removed > 64 and self._removed > len(self._index))
+            or (self._stale_roles > 1024 and self._stale_roles * 2 > len(self._role_ids))
+        ):
+            self._compact()
+
+    def _compact(self):
+        columns = (self._ids, self._joined_at, self._flags)
+        names = (self._nicks, self._usernames, self._global_names, self._avatars)
+        role_start, role_count, role_ids = self._role_start, self._role_count, self._role_ids
+        strings, extra = self._strings, self._extra
+        rows = sorted(self._index.values())
+        self.clear()
+        self._extra = extra
+        # Re-interning drops strings nothing points at anymore
+        for row in rows:
+            new_row = self._index[columns[0][row]] = len(self._ids)
+            for old, new in zip(columns, (self._ids, self._joined_at, self._flags)):
+                new.append(old[row])
+            for old, new in zip(names, (self._nicks, self._usernames, self._global_names, self._avatars)):
+                new.append(self._intern(strings[old[row]]))
+            start = role_start[row]
+            roles = role_ids[start:start + role_count[row]]
+            self._role_start.append(len(self._role_ids))
+            self._role_count.append(len(roles))
+            self._role_ids.extend(roles)
+            self._role_rows.extend([new_row] * len(roles))
+
+    def _view(self, row: int) -> Member:
+        user_id = self._ids[row]
+        strings = self._strings
+        user = self.bot.fetch_user(user_id)
+        if user is None:
+            # Not cached, the view gets its own User that isn't stored anywhere
+            user = User({
+                "id": user_id,
+                "username": strings[self._usernames[row]],
+                "global_name": strings[self._global_names[row]],
+                "avatar": strings[self._avatars[row]],
+            }, self.bot)
+        joined_at = self._joined_at[row]
+        flags = self._flags[row]
+        member = Member.__new__(Member)
+        member.bot = self.bot
+        member.user = user
+        member.id = user_id
+        member._parse({
+            "guild_id": self.guild_id,
+            "joined_at": datetime.fromtimestamp(joined_at / 1000, timezone.utc).isoformat() if joined_at >= 0 else None,
+            "deaf": bool(flags & self.DEAF),
+            "mute": bool(flags & self.MUTE),
+            "pending": bool(flags & self.PENDING),
+            "nick": strings[self._nicks[row]],
+            **self._extra.get(user_id, {}),
+        })
+        start = self._role_start[row]
+        member.roles = self._role_ids[start:start + self._role_count[row]].tolist()
+        return member
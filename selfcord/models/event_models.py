@@ -2,18 +2,20 @@ from __future__ import annotations
 
 from typing import Optional
 from .users import User, Status
+from .base import Model
+
+class PresenceUpdate(Model):
+    __slots__ = ("user", "status", "client_status", "activities", "broadcast")
 
-class PresenceUpdate:
     def __init__(self, payload: dict, bot) -> None:
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
 
     def update(self, payload: dict):
         self.user = payload.get("user")
         if self.user is not None:
             if self.user.get("username") is not None:
-                self.user = User(self.user, self.bot)
+                self.user = self.bot.store_user(self.user)
             else:
                 self.user = self.bot.fetch_user(self.user['id']) if self.bot.fetch_user(self.user['id']) is not None else self.user['id']
         self.status = payload.get("status")
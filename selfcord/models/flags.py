@@ -3,6 +3,8 @@ from typing import Self, Type
 
 
 class Flags:
+    __slots__ = ("value",)
+
     def __init__(self, value: int):
         self.value: int = value
 
@@ -17,6 +19,7 @@ class Flags:
 
 
 class Capabilities(Flags):
+    __slots__ = ()
     
     @classmethod
     def default(cls):
@@ -1,192 +1,296 @@
 from __future__ import annotations
-import itertools
 from typing import TYPE_CHECKING, Optional
-from .assets import Asset
+from sys import intern
+from .assets import asset_property
 from .channels import Convert, Messageable
 from .users import Member
+from .columnar import ColumnarMemberCollection
 from .permissions import Permission
+from .base import Model, LazyModel, Field, Changes, compile_parser, key_map
 if TYPE_CHECKING:
     from ..bot import Bot
 
 
-class Guild:
+class MemberCollection:
+    """Members of a guild keyed by user id. Insertion order is kept, so iterating it behaves like the old list"""
+    __slots__ = ("bot", "guild_id", "members")
+
+    def __init__(self, bot: Bot, guild_id: Optional[int] = None):
+        self.bot = bot
+        self.guild_id = guild_id
+        self.members: dict[int, Member] = {}
+
+    def __iter__(self):
+        yield from self.members.values()
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, member: Member | str | int) -> bool:
+        if isinstance(member, Member):
+            return member.id in self.members
+        return int(member) in self.members
+
+    def ids(self) -> set[int]:
+        """IDs of the cached members"""
+        return set(self.members)
+
+    def add(self, member: Member):
+        """Add a member, replacing any member already stored under the same id
+
+        Args:
+            member (Member): Member to add
+        """
+        self.members[member.id] = member
+
+    def get(self, user_id: str | int) -> Optional[Member]:
+        """Get a member by user id
+
+        Args:
+            user_id (str | int): ID of the user
+
+        Returns:
+            Member: The member, None if not cached
+        """
+        return self.members.get(int(user_id))
+
+    def remove(self, user_id: str | int) -> Optional[Member]:
+        """Remove a member by user id
+
+        Args:
+            user_id (str | int): ID of the user
+
+        Returns:
+            Member: The removed member, None if not cached
+        """
+        return self.members.pop(int(user_id), None)
+
+    def merge(self, payload: dict) -> Member:
+        """Add a member from a gateway payload or update the cached one
+
+        Args:
+            payload (dict): Member payload, either with a nested user or a user_id
+
+        Returns:
+            Member: The cached member
+        """
+        user = payload.get("user")
+        user_id = int(user["id"] if user is not None else payload["user_id"])
+        member = self.members.get(user_id)
+        if member is not None:
+            member.partial_update(payload)
+            return member
+        if "members" in self.bot.cache_policy.unrestricted or self.bot.should_cache("members", self.guild_id, user_id, len(self.members)):
+            member = Member(payload, self.bot)
+            member.guild_id = self.guild_id
+            self.add(member)
+            return member
+        # Left out by the cache policy, the member is only handed to whoever asked and its user isn't cached either
+        member = Member.detached(payload, self.bot)
+        member.guild_id = self.guild_id
+        return member
+
+    def diff(self, payload: dict) -> tuple[Member, Optional[Changes]]:
+        """Same as merge, but also returns what changed
+
+        Args:
+            payload (dict): Member payload, either with a nested user or a user_id
+
+        Returns:
+            tuple[Member, Changes]: The member and its changes, None if it wasn't cached before
+        """
+        user = payload.get("user")
+        member = self.members.get(int(user["id"] if user is not None else payload["user_id"]))
+        if member is None:
+            return self.merge(payload), None
+        return member, member.partial_update(payload)
+
+    def clear(self):
+        self.members.clear()
+
+
+class Guild(LazyModel):
+    __slots__ = (
+        "members", "channels", "emojis", "stickers", "roles", "id", "member_count",
+        "embedded_activities", "voice_states", "lazy", "large", "joined_at", "owner_id",
+        "premium_tier", "splash_hash", "nsfw_level", "application_id", "system_channel_flags",
+        "inventory_settings", "default_message_notifications", "hub_type", "afk_channel",
+        "incidents_data", "discovery_splash_hash", "preferred_locale", "icon_hash",
+        "latest_onboarding_question_id", "explicit_content_filter", "description",
+        "afk_timeout", "max_video_channel_users", "nsfw", "system_channel_id",
+        "rules_channel_id", "max_stage_video_channel_users", "banner_hash",
+        "public_updates_channel_id", "mfa_level", "features", "max_members", "name",
+        "safety_alerts_channel_id", "premium_progress_bar_enabled", "verification_level",
+        "home_header", "vanity_url_code",
+    )
+
+    _fields = {
+        "id": Field(cast=int),
+        "member_count": Field(),
+        "embedded_activities": Field(factory=list),
+        "voice_states": Field(factory=list),
+        "lazy": Field(),
+        "large": Field(),
+        "joined_at": Field(),
+    }
+
+    # User accounts get most of the guild nested under properties
+    _properties = {
+        "owner_id": Field(cast=int),
+        "premium_tier": Field(),
+        "splash_hash": Field("splash", cast=intern),
+        "nsfw_level": Field(),
+        "application_id": Field(cast=int),
+        "system_channel_flags": Field(),
+        "inventory_settings": Field(),
+        "default_message_notifications": Field(),
+        "hub_type": Field(),
+        "afk_channel": Field(),
+        "incidents_data": Field(),
+        "discovery_splash_hash": Field("discovery_splash", cast=intern),
+        "preferred_locale": Field(),
+        "icon_hash": Field("icon", cast=intern),
+        "latest_onboarding_question_id": Field(),
+        "explicit_content_filter": Field(),
+        "description": Field(),
+        "afk_timeout": Field(),
+        "max_video_channel_users": Field(),
+        "nsfw": Field(),
+        "system_channel_id": Field(cast=int),
+        "rules_channel_id": Field(cast=int),
+        "max_stage_video_channel_users": Field(),
+        "banner_hash": Field("banner", cast=intern),
+        "public_updates_channel_id": Field(cast=int),
+        "mfa_level": Field(),
+        "features": Field(),
+        "max_members": Field(),
+        "name": Field(),
+        "safety_alerts_channel_id": Field(cast=int),
+        "premium_progress_bar_enabled": Field(),
+        "verification_level": Field(),
+        "home_header": Field(),
+        "vanity_url_code": Field(),
+    }
+    _parse_properties = compile_parser(_properties)
+    _property_keys = key_map(_properties)
+
+    # Decoded the first time they are read, only their part of the payload is kept around
+    _lazy = {
+        "emojis": lambda self, payload: [Emoji(emoji, self.bot) for emoji in self._cached_part("emojis", payload)],
+        "stickers": lambda self, payload: [Sticker(sticker, self.bot) for sticker in self._cached_part("stickers", payload)],
+        "roles": lambda self, payload: [Role(role, self.bot) for role in self._cached_part("roles", payload)],
+    }
+
+    # Only the hashes are stored, the Asset is built when one is read
+    icon = asset_property("icon_hash", "icons")
+    splash = asset_property("splash_hash", "splashes")
+    discovery_splash = asset_property("discovery_splash_hash", "discovery-splashes")
+    banner = asset_property("banner_hash", "banners")
+
     def __init__(self, payload: dict, bot: Bot):
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
 
     @property
-    def me(self) -> Member:
-        return self.members[0]
+    def me(self) -> Optional[Member]:
+        return self.members.get(self.bot.user.id)
+
+    def _cached_part(self, name: str, payload: dict) -> list:
+        # Kept for "interacted", but not built until the client has talked in the guild
+        if not self.bot.cache_policy.allows(name, self.id):
+            return []
+        return payload.get(name, [])
+
+    def _lazy_parts(self, payload: dict) -> dict:
+        # Parts the cache policy leaves out aren't even kept raw
+        policy = self.bot.cache_policy
+        return {
+            key: payload[key][:policy.limit(key, self.id)]
+            for key in self._lazy
+            if key in payload and policy.may_allow(key, self.id)
+        }
+
+    def _interacted(self):
+        # Parts held back for "interacted" are decoded on their next read, anything else is left as it is
+        policy = self.bot.cache_policy
+        for name in self._lazy:
+            if policy.option(name, self.id) == policy.INTERACTED:
+                try:
+                    delattr(self, name)
+                except AttributeError:
+                    pass
+
+    def _store_role(self, role_id: int, payload: Optional[dict]):
+        # Role events have to reach the raw part too, roles held back are decoded from it later
+        if not self._payload or "roles" not in self._payload:
+            return
+        roles = []
+        found = False
+        for role in self._payload["roles"]:
+            if int(role["id"]) != role_id:
+                roles.append(role)
+                continue
+            found = True
+            if payload is not None:
+                roles.append(payload)
+        if not found and payload is not None:
+            limit = self.bot.cache_policy.limit("roles", self.id)
+            if limit is None or len(roles) < limit:
+                roles.append(payload)
+        # A new dict, before copies may still point at the old one
+        self._payload = {**self._payload, "roles": roles}
 
     def update(self, payload: dict):
-        self.members: list[Member] = []
-        self.channels: list[Messageable] = []
-        self.emojis: list[Emoji] = []
-        self.stickers: list[Sticker] = []
-        self.roles: list[Role] = []
-        # MUH OPTIMISATIONS: Zip Longest very cool bro
-        self.id: Optional[str] = payload.get("id")
-        for emoji, sticker, role, channel, member in itertools.zip_longest(
-            payload.get("emojis", []),
-            payload.get("stickers", []),
-            payload.get("roles", []),
-            payload.get("channels", []),
-            payload.get("members", [])
-        ):
-            if emoji is not None:
-                self.emojis.append(Emoji(emoji, self.bot))
-
-            if sticker is not None:
-                self.stickers.append(Sticker(sticker, self.bot))
-
-            if role is not None:
-                self.roles.append(Role(role, self.bot))
-
-            if channel is not None:
-                chan = Convert(channel, self.bot)
+        self._parse(payload)
+        self._set_payload(self._lazy_parts(payload))
+        self._parse_properties(payload.get("properties") or {})
+        # A later full update (READY after a snapshot) keeps the collection, merged members update it
+        if getattr(self, "members", None) is None:
+            threshold = self.bot.columnar_members
+            if threshold is not None and (self.member_count or 0) >= threshold:
+                self.members: MemberCollection | ColumnarMemberCollection = ColumnarMemberCollection(self.bot, self.id)
+            else:
+                self.members = MemberCollection(self.bot, self.id)
+        if getattr(self, "channels", None) is None:
+            self.channels: list[Messageable] = []
+
+        # Channels and members are cached by id elsewhere, so those can't wait
+        if "channels" in payload:
+            previous = {channel.id: channel for channel in self.channels}
+            self.channels = []
+            for channel in payload["channels"]:
+                # Channels that already exist are updated in place, anything holding them stays valid
+                chan = previous.pop(int(channel["id"]), None)
+                if chan is not None and chan.type == channel["type"]:
+                    chan.update(channel)
+                else:
+                    chan = Convert(channel, self.bot)
+                # Channels nested in the guild don't carry a guild_id
+                if chan.guild_id is None:
+                    chan.guild_id = self.id
                 self.channels.append(chan)
-             
                 self.bot.cached_channels[chan.id] = chan
+            for channel_id in previous:
+                self.bot.cached_channels.pop(channel_id, None)
 
-            if member is not None:
-                member = Member(member, self.bot)
-                self.members.append(member)
-                
-
-        self.member_count = payload.get("member_count")
-        self.embedded_activities = payload.get("embedded_activities", [])
-        self.voice_states = payload.get("voice_state", [])
-        self.lazy = payload.get("lazy")
-        self.large = payload.get("large")
-        self.joined_at = payload.get("joined_at")
-        properties: Optional[dict] = payload.get("properties")
-        if properties:
-            self.id: Optional[str] = properties.get("id")
-            self.owner_id: Optional[str] = (
-                properties["owner_id"]
-                if properties.get("owner_id") is not None
-                else None
-            )
-            self.premium_tier: Optional[int] = properties.get("premium_tier")
-            self.splash: Optional[Asset] = (
-                Asset(self.id, properties["splash"])
-                if properties.get("splash") is not None
-                else None
-            )
-            self.nsfw_level: Optional[str] = (
-                properties["nsfw_level"]
-                if properties.get("nsfw_level") is not None
-                else None
-            )
-            self.application_id: Optional[str] = (
-                properties["application_id"]
-                if properties.get("application_id") is not None
-                else None
-            )
-            self.system_channel_flags: Optional[int] = properties.get(
-                "system_channel_flags"
-            )
-            self.inventory_settings: Optional[str] = properties.get(
-                "inventory_settings"
-            )
-            self.default_message_notifications: Optional[int] = properties.get(
-                "default_message_notifications"
-            )
-            self.hub_type: Optional[int] = properties.get("hub_type")
-            self.afk_channel: Optional[str] = properties.get("afk_channel")
-            self.incidents_data: Optional[int] = properties.get(
-                "incidents_data")
-            self.discovery_splash: Optional[Asset] = (
-                Asset(self.id, properties["discovery_splash"])
-                if properties.get("discovery_splash") is not None
-                else None
-            )
-            self.preferred_locale: Optional[str] = properties.get(
-                "preferred_locale")
-            self.icon: Optional[Asset] = (
-                Asset(self.id, properties["icon"]).from_icon()
-                if properties.get("discovery_splash") is not None
-                else None
-            )
-            self.latest_onboarding_question_id: Optional[str] = properties.get(
-                "latest_onboarding_question_id"
-            )
-            self.explicit_content_filter: Optional[int] = properties.get(
-                "explicit_content_filter"
-            )
-            self.description: Optional[str] = properties.get("description")
-            self.afk_timeout: Optional[int] = properties.get("afk_timeout")
-            self.max_video_channel_users: Optional[int] = properties.get(
-                "max_video_channel_users"
-            )
-            self.nsfw: Optional[bool] = properties.get("nsfw")
-            self.system_channel_id: Optional[str] = properties.get(
-                "system_channel_id")
-            self.rules_channel_id: Optional[str] = properties.get(
-                "rules_channel_id")
-            self.max_stage_video_channel_users: Optional[int] = properties.get(
-                "max_stage_video_channel_users"
-            )
-            self.banner: Optional[Asset] = (
-                Asset(self.id, properties["banner"])
-                if properties.get("banner") is not None
-                else None
-            )
-            self.public_updates_channel_id: Optional[int] = properties.get(
-                "public_updates_channel_id"
-            )
-            self.mfa_level: Optional[int] = properties.get("mfa_level")
-            self.features: Optional[list[str]] = properties.get("features")
-            self.max_members: Optional[int] = properties.get("max_members")
-            self.name: Optional[str] = properties.get("name")
-            self.safety_alerts_channel_id: Optional[int] = properties.get("safety_alerts_channel_id")
-            self.premium_progress_bar_enabled: Optional[bool] = properties.get("premium_progress_bar_enabled")
-            self.verification_level: Optional[int] = properties.get("verification_level")
-            self.home_header: Optional[str] = properties.get("home_header")
-            self.vanity_url_code: Optional[str] = properties.get("vanity_url_code")
-
-    def partial_update(self, payload: dict):
-        for key, value in payload.items():
-            if hasattr(self, key):
-                if key == "properties":
-                    for key, value in payload.items():
-                        if key == "banner":
-                            setattr(self, key, (
-                                Asset(self.id, payload["banner"]).from_avatar()
-                                if payload.get("banner") is not None and self.id is not None
-                                else None
-                            ))
-                        elif key == "icon":
-                            setattr(self, key, (
-                                Asset(self.id, payload["banner"]).from_avatar()
-                                if payload.get("banner") is not None and self.id is not None
-                                else None
-                            ))
-                        elif key == "bot":
-                            setattr(self, "is_bot", value)
-
-                if key == "banner":
-                    setattr(self, key, (
-                        Asset(self.id, payload["banner"]).from_avatar()
-                        if payload.get("banner") is not None and self.id is not None
-                        else None
-                    ))
-                elif key == "icon":
-                    setattr(self, key, (
-                        Asset(self.id, payload["banner"]).from_avatar()
-                        if payload.get("banner") is not None and self.id is not None
-                        else None
-                    ))
-                elif key == "bot":
-                    setattr(self, "is_bot", value)
+        for member in payload.get("members", []):
+            self.members.merge(member)
 
-                else:
-                    setattr(self, key, value)
-    def fetch_member(self, user_id: str):
-        for member in self.members:
-            if member.id == user_id:
-                return member
+    def to_payload(self, fields=None) -> dict:
+        payload = super().to_payload(fields)
+        payload["properties"] = Model.to_payload(self, self._properties)
+        payload["channels"] = [channel.to_payload() for channel in self.channels]
+        payload["members"] = [member.to_payload() for member in self.members]
+        return payload
+
+    def partial_update(self, payload: dict) -> Changes:
+        changes = self._diff(payload)
+        # GUILD_UPDATE has the properties at the top level, READY nests them
+        self._diff(payload.get("properties") or payload, self._property_keys, changes=changes)
+        return self._diff_lazy(self._lazy_parts(payload), changes)
+
+    def fetch_member(self, user_id: str | int) -> Optional[Member]:
+        return self.members.get(user_id)
 
     async def get_members(self):
         # Doesn't work yet I'm gonna fix
@@ -234,55 +338,76 @@ class Guild:
         return Convert(json, self.bot) or None
 
 
-class Emoji:
+class Emoji(Model):
+    __slots__ = ("roles", "name", "require_colons", "managed", "id", "available", "animated")
+
+    _fields = {
+        "roles": Field(),
+        "name": Field(),
+        "require_colons": Field(),
+        "managed": Field(),
+        "id": Field(required=True, cast=int),
+        "available": Field(),
+        "animated": Field(),
+    }
+
     def __init__(self, payload: dict, bot: Bot):
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
 
     def update(self, payload: dict):
-        self.roles = payload.get("roles")
-        self.name = payload.get("name")
-        self.require_colons = payload.get("require_colons")
-        self.managed = payload.get("managed")
-        self.id = payload["id"]
-        self.available = payload.get("available")
-        self.animated = payload.get("animated")
+        self._parse(payload)
+
 
+class Role(Model):
+    __slots__ = (
+        "unicode_emoji", "position", "permissions", "name", "mentionable", "managed", "id",
+        "icon", "hoist", "flags", "color",
+    )
+
+    _fields = {
+        "unicode_emoji": Field(),
+        "position": Field(),
+        "permissions": Field(cast=Permission),
+        "name": Field(),
+        "mentionable": Field(),
+        "managed": Field(),
+        "id": Field(required=True, cast=int),
+        "icon": Field(),
+        "hoist": Field(),
+        "flags": Field(),
+        "color": Field(),
+    }
 
-class Role:
     def __init__(self, payload: dict, bot: Bot):
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
 
     def update(self, payload: dict):
-        self.unicode_emoji = payload.get("unicode_emoji")
-        self.position = payload.get("position")
-        self.permissions = Permission(payload['permissions'], self.bot) if payload.get("permissions") is not None else None
-        self.name = payload.get("name")
-        self.mentionable = payload.get("mentionable")
-        self.managed = payload.get("managed")
-        self.id = payload["id"]
-        self.icon = payload.get("icon")
-        self.hoist = payload.get("hoist")
-        self.flags = payload.get("flags")
-        self.color = payload.get("color")
-
-
-class Sticker:
+        self._parse(payload)
+
+
+class Sticker(Model):
+    __slots__ = (
+        "type", "tags", "name", "id", "guild_id", "format_type", "description", "available",
+        "asset",
+    )
+
+    _fields = {
+        "type": Field(),
+        "tags": Field(),
+        "name": Field(),
+        "id": Field(cast=int),
+        "guild_id": Field(cast=int),
+        "format_type": Field(),
+        "description": Field(),
+        "available": Field(),
+        "asset": Field(),
+    }
+
     def __init__(self, payload: dict, bot: Bot):
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
 
     def update(self, payload: dict):
-        self.type = payload.get("type")
-        self.tags = payload.get("tags")
-        self.name = payload.get("name")
-        self.id = payload.get("id")
-        self.guild_id = payload.get("guild_id")
-        self.format_type = payload.get("format_type")
-        self.description = payload.get("description")
-        self.available = payload.get("available")
-        self.asset = payload.get("asset")
+        self._parse(payload)
@@ -1,44 +1,71 @@
 from __future__ import annotations
 from typing import Optional, TYPE_CHECKING
 from .users import User, Member
+from .base import Model, LazyModel, Field, Changes
 
 if TYPE_CHECKING:
     from ..bot import Bot
     from .channels import Messageable
     from .guild import Guild
 
-class Message:
+class Message(LazyModel):
+    __slots__ = (
+        "id", "content", "type", "tts", "timestamp", "replied_message", "pinned", "nonce",
+        "mentions", "channel_id", "channel", "guild_id", "guild", "author", "flags",
+        "embeds", "components", "attachments", "edited_timestamp",
+    )
+
+    _fields = {
+        "id": Field(cast=int),
+        "content": Field(),
+        "type": Field(default=0),
+        "tts": Field(default=False),
+        "timestamp": Field(),
+        "pinned": Field(),
+        "nonce": Field(),
+        "channel_id": Field(cast=int),
+        "guild_id": Field(cast=int),
+        "flags": Field(default=0),
+        "edited_timestamp": Field(),
+    }
+
+    # Decoded from the raw payload the first time they are read, most handlers never touch these
+    _lazy = {
+        "replied_message": lambda self, payload: (
+            Message(payload["referenced_message"], self.bot)
+            if payload.get("referenced_message") is not None
+            else None
+        ),
+        "mentions": lambda self, payload: [self.bot.store_user(user) for user in payload.get("mentions", [])],
+        "embeds": lambda self, payload: [Embed(embed, self.bot) for embed in payload.get("embeds", [])],
+        "components": lambda self, payload: payload.get("components"),
+        "attachments": lambda self, payload: payload.get("attachments"),
+    }
+    _lazy_keys = {"replied_message": "referenced_message"}
+
     def __init__(self, data: dict, bot: Bot):
         self.bot = bot
-        self.http = bot.http
         self.update(data)
 
     def update(self, payload: dict):
-        self.id: Optional[str] = payload.get("id")
-        self.content: Optional[str] = payload.get("content")
-        self.type: int = payload.get("type", 0)
-        self.tts: bool = payload.get("tts", False)
-        self.timestamp: Optional[int] = payload.get("timestamp")
-        self.replied_message: Optional[Message] = payload.get("referenced_message")
-        self.pinned: Optional[bool] = payload.get("pinned")
-        self.nonce: Optional[int] = payload.get("nonce")
-        self.mentions: Optional[dict] = payload.get("mentions")
-        self.channel_id: str = payload.get("channel_id", "")
+        self._set_payload(payload)
+        self._parse(payload)
         self.channel: Optional[Messageable] = self.bot.fetch_channel(self.channel_id)
-        self.guild_id: str = payload.get("guild_id", "")
         self.guild: Optional[Guild] = self.bot.fetch_guild(self.guild_id)
         self.author: Optional[User] = (
-            User(payload['author'], self.bot)
+            self.bot.store_user(payload['author'])
             if payload.get("author") is not None
             else None
         )
         # we will fix later 
         # self.member = Member(payload.get("member"), self.bot)
-        self.flags: int = payload.get("flags", 0)
-        # Create associated classes with these
-        self.embeds = payload.get("embeds")
-        self.components = payload.get("components")
-        self.attachments = payload.get("attachments")
+
+    def partial_update(self, payload: dict) -> Changes:
+        # MESSAGE_UPDATE can be partial, anything it leaves out stays as cached
+        changes = super().partial_update(payload)
+        if payload.get("author") is not None:
+            self.bot.store_user(payload["author"])
+        return changes
 
     async def delete(self):
         await self.http.request(
@@ -53,8 +80,8 @@ class Message:
                 "content":content,
                 "tts":tts,
                 "message_reference":{
-                    "channel_id":self.channel_id,
-                    "message_id":self.id
+                    "channel_id":str(self.channel_id),
+                    "message_id":str(self.id)
                 },
                 "allowed_mentions":{"parse":["users","roles","everyone"],"replied_user":True},"flags":0}
         )
@@ -69,139 +96,193 @@ class Message:
         if json is not None:
             return Message(json, self.bot)
         
-class MessageAck:
+class MessageAck(Model):
+    __slots__ = (
+        "channel_id", "channel", "flags", "last_viewed", "message_id", "message", "version",
+    )
+
     def __init__(self, payload: dict, bot) -> None:
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
 
     def update(self, payload: dict):
-        self.channel_id: str = payload['channel_id']
+        self.channel_id: int = int(payload['channel_id'])
         self.channel = self.bot.fetch_channel(self.channel_id)
         self.flags: Optional[int] = payload.get("flags")
         self.last_viewed = payload['last_viewed']
-        self.message_id = payload['message_id']
+        self.message_id = int(payload['message_id'])
         self.message = self.bot.fetch_message(self.message_id)
         self.version = payload['version']
 
-class EmbedField:
+class EmbedField(Model):
+    __slots__ = ("name", "value", "inline")
+
+    _fields = {
+        "name": Field(),
+        "value": Field(),
+        "inline": Field(),
+    }
+
     def __init__(self, payload: dict, bot):
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
 
     def update(self, payload: dict):
-        self.name = payload.get("name")
-        self.value = payload.get("value")
-        self.inline = payload.get("inline")
+        self._parse(payload)
+
+class EmbedThumbnail(Model):
+    __slots__ = ("url", "proxy_url", "height", "width")
+
+    _fields = {
+        "url": Field(required=True),
+        "proxy_url": Field(),
+        "height": Field(),
+        "width": Field(),
+    }
 
-class EmbedThumbnail:
     def __init__(self, payload: dict, bot):
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
 
     def update(self, payload: dict):
-        self.url = payload['url']
-        self.proxy_url = payload.get("proxy_url")
-        self.height = payload.get("height")
-        self.width = payload.get("width")
+        self._parse(payload)
+
+class EmbedVideo(Model):
+    __slots__ = ("url", "proxy_url", "height", "width")
+
+    _fields = {
+        "url": Field(required=True),
+        "proxy_url": Field(),
+        "height": Field(),
+        "width": Field(),
+    }
 
-class EmbedVideo:
     def __init__(self, payload: dict, bot):
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
 
     def update(self, payload: dict):
-        self.url = payload['url']
-        self.proxy_url = payload.get("proxy_url")
-        self.height = payload.get("height")
-        self.width = payload.get("width")
+        self._parse(payload)
+
+class EmbedImage(Model):
+    __slots__ = ("url", "proxy_url", "height", "width")
+
+    _fields = {
+        "url": Field(required=True),
+        "proxy_url": Field(),
+        "height": Field(),
+        "width": Field(),
+    }
 
-class EmbedImage:
     def __init__(self, payload: dict, bot):
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
 
     def update(self, payload: dict):
-        self.url = payload['url']
-        self.proxy_url = payload.get("proxy_url")
-        self.height = payload.get("height")
-        self.width = payload.get("width")
+        self._parse(payload)
+
+class EmbedProvider(Model):
+    __slots__ = ("name", "url")
+
+    _fields = {
+        "name": Field(),
+        "url": Field(),
+    }
 
-class EmbedProvider:
     def __init__(self, payload: dict, bot):
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
 
     def update(self, payload: dict):
-        self.name = payload.get("name")
-        self.url = payload.get("url")
+        self._parse(payload)
+
+class EmbedAuthor(Model):
+    __slots__ = ("name", "url", "icon_url", "proxy_icon_url")
+
+    _fields = {
+        "name": Field(),
+        "url": Field(),
+        "icon_url": Field(),
+        "proxy_icon_url": Field(),
+    }
 
-class EmbedAuthor:
     def __init__(self, payload: dict, bot) -> None:
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
-    
+
     def update(self, payload: dict):
-        self.name = payload.get("name")
-        self.url = payload.get("url")
-        self.icon_url = payload.get("icon_url")
-        self.proxy_icon_url = payload.get("proxy_icon_url")
+        self._parse(payload)
+
+class EmbedFooter(Model):
+    __slots__ = ("text", "icon_url", "proxy_icon_url")
+
+    _fields = {
+        "text": Field(),
+        "icon_url": Field(),
+        "proxy_icon_url": Field(),
+    }
 
-class EmbedFooter:
     def __init__(self, payload: dict, bot) -> None:
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
 
     def update(self, payload: dict):
-        self.text = payload.get("text")
-        self.icon_url = payload.get("icon_url")
-        self.proxy_icon_url = payload.get("proxy_icon_url")
+        self._parse(payload)
 
 
-class Embed:
+class Embed(Model):
+    __slots__ = (
+        "fields", "title", "description", "type", "url", "timestamp", "color", "footer",
+        "image", "thumbnail", "video", "provider", "author",
+    )
+
+    _fields = {
+        "fields": Field(factory=list, convert=lambda self, value: [EmbedField(field, self.bot) for field in value]),
+        "title": Field(),
+        "description": Field(),
+        "type": Field(),
+        "url": Field(),
+        "timestamp": Field(),
+        "color": Field(),
+        "footer": Field(),
+        "image": Field(),
+        "thumbnail": Field(),
+        "video": Field(),
+        "provider": Field(),
+        "author": Field(),
+    }
+
     def __init__(self, payload: dict, bot):
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
 
     def update(self, payload: dict):
-        self.fields: list[EmbedField] = [EmbedField(field, self.bot) for field in payload.get("fields", [])]
-        self.title: Optional[str] = payload.get("title")
-        self.description: Optional[str] = payload.get("description")
-        self.type: Optional[str] = payload.get("type")
-        self.url: Optional[str] = payload.get("url")
-        self.timestamp: Optional[int] = payload.get("timestamp")
-        self.color: Optional[int] = payload.get("color")
-        self.footer: Optional[str] = payload.get("footer")
-        self.image: Optional[dict] = payload.get("image")
-        self.thumbnail: Optional[dict] = payload.get("thumbnail")
-        self.video: Optional[dict] = payload.get("video")
-        self.provider: Optional[dict] = payload.get("provider")
-        self.author: Optional[str] = payload.get("author")
-
-
-class MessageReactionAdd:
+        self._parse(payload)
+
+
+class MessageReactionAdd(Model):
+    __slots__ = (
+        "burst", "channel_id", "emoji", "guild_id", "type", "user_id", "message_id",
+        "message", "author_id", "author", "user",
+    )
+
+    _fields = {
+        "burst": Field(default=False),
+        "channel_id": Field(cast=int),
+        "emoji": Field(),
+        "guild_id": Field(cast=int),
+        "type": Field(default=0),
+        "user_id": Field(cast=int),
+        "message_id": Field(cast=int),
+        "author_id": Field("message_author_id", cast=int),
+    }
+
     def __init__(self, payload: dict, bot) -> None:
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
 
     def update(self, payload: dict):
-        self.burst: bool = payload.get("burst", False)
-        self.channel_id: Optional[str] = payload.get("channel_id")
-        self.emoji: Optional[str] = payload.get("emoji")
-        self.guild_id: Optional[str] = payload.get("guild_id")
-        self.type: int = payload.get("type", 0)
-        self.user_id: Optional[str] = payload.get("user_id")
-        self.message_id: str = payload.get("message_id", "")
+        self._parse(payload)
         self.message: Message = self.bot.fetch_message(self.message_id)
-        self.author_id: Optional[str] = payload.get("message_author_id")
         self.author = self.bot.fetch_user(self.author_id)
         self.user = self.bot.fetch_user(self.user_id) 
@@ -1,8 +1,18 @@
 from __future__ import annotations
 
-from typing import Optional
+from typing import Iterator
+
+
+class Permission(int):
+    """Permission bitfield, a plain int with the flags as class constants.
+
+    Flags can be checked with ``has`` or ``in`` by value or by name, iterating gives the names
+    of the flags that are set. Combining permissions with | & ^ - ~ gives a Permission back,
+    bits this library has no name for yet are kept through all of them.
+    Equal values share one instance, so building these for every role and overwrite is cheap.
+    """
+    __slots__ = ()
 
-class Permission:
     CREATE_INSTANT_INVITE = 1 << 0
     KICK_MEMBERS = 1 << 1
     BAN_MEMBERS = 1 << 2
@@ -51,20 +61,111 @@ class Permission:
     USE_EXTERNAL_SOUNDS = 1 << 45
     SEND_VOICE_MESSAGES = 1 << 46
 
-    def __init__(self, value: int, bot):
-        self.bot = bot
-        self.http = bot.http
-        self.permissions = []
-        self.raw_value = value
-        # print(value, bot)
-        self.calculate_permissions(value)
-
-    def calculate_permissions(self, perm_value: int):
-        for key, value in vars(self).items():
-            if key.startswith("__"):
-                continue
-            if type(value) != int:
-                continue
-            # print(perm_value, type(value))
-            if (perm_value & value) == value:
-                self.permissions.append({key: value})
+    # Filled in below the class, name -> flag and flag -> name
+    VALID_FLAGS: dict[str, int] = {}
+    FLAG_NAMES: dict[int, str] = {}
+    ALL: int = 0
+
+    # Discord sends permissions as 64 bit values, ~ flips all of them so unknown flags survive
+    BITS: int = (1 << 64) - 1
+
+    _cache: dict[int, Permission] = {}
+
+    def __new__(cls, value: int | str = 0) -> Permission:
+        value = int(value)
+        if cls is not Permission:
+            return int.__new__(cls, value)
+        permission = cls._cache.get(value)
+        if permission is None:
+            permission = int.__new__(cls, value)
+            # Only a handful of distinct values show up in practice, don't let odd ones pile up
+            if len(cls._cache) < 4096:
+                cls._cache[value] = permission
+        return permission
+
+    # int's str() would go through the repr below
+    __str__ = int.__repr__
+
+    def __repr__(self):
+        return f"<Permission value={int(self)} flags={list(self)}>"
+
+    def __iter__(self) -> Iterator[str]:
+        # Walk the set bits only, lowest first
+        value = int(self)
+        while value:
+            bit = value & -value
+            name = self.FLAG_NAMES.get(bit)
+            if name is not None:
+                yield name
+            value ^= bit
+
+    def __contains__(self, permission: int | str) -> bool:
+        return self.has(permission)
+
+    def __or__(self, other: int) -> Permission:
+        return Permission(int(self) | int(other))
+
+    def __and__(self, other: int) -> Permission:
+        return Permission(int(self) & int(other))
+
+    def __xor__(self, other: int) -> Permission:
+        return Permission(int(self) ^ int(other))
+
+    def __sub__(self, other: int) -> Permission:
+        return Permission(int(self) & ~int(other))
+
+    def __invert__(self) -> Permission:
+        return Permission(self.BITS & ~int(self))
+
+    __ror__ = __or__
+    __rand__ = __and__
+    __rxor__ = __xor__
+
+    @classmethod
+    def all(cls) -> Permission:
+        return cls(cls.ALL)
+
+    @classmethod
+    def from_names(cls, *names: str) -> Permission:
+        """Build a permission from flag names
+
+        Args:
+            names (str): Names of the flags, like "SEND_MESSAGES"
+
+        Returns:
+            Permission: The permission
+        """
+        return cls(cls._mask(names))
+
+    @classmethod
+    def _mask(cls, permissions) -> int:
+        mask = 0
+        for permission in permissions:
+            mask |= cls.VALID_FLAGS[permission] if isinstance(permission, str) else int(permission)
+        return mask
+
+    def has(self, *permissions: int | str) -> bool:
+        """Check whether every given flag is set
+
+        Args:
+            permissions (int | str): Flags or flag names, like Permission.SEND_MESSAGES or "SEND_MESSAGES"
+
+        Returns:
+            bool: True if all of them are set
+        """
+        mask = self._mask(permissions)
+        return int(self) & mask == mask
+
+    @property
+    def raw_value(self) -> str:
+        """The value as discord sends it"""
+        return str(int(self))
+
+    @property
+    def permissions(self) -> list[dict[str, int]]:
+        return [{name: self.VALID_FLAGS[name]} for name in self]
+
+
+Permission.VALID_FLAGS = {name: value for name, value in vars(Permission).items() if name.isupper() and type(value) is int and name not in ("ALL", "BITS")}
+Permission.FLAG_NAMES = {value: name for name, value in Permission.VALID_FLAGS.items()}
+Permission.ALL = sum(Permission.VALID_FLAGS.values())
@@ -1,14 +1,17 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING, Optional
+from .base import Model
 
 if TYPE_CHECKING:
     from ..api.http import HttpClient
     from ..bot import Bot
 
-class Event_Session:
-    def __init__(self, data: dict, bot: Bot, http: HttpClient):
+class Event_Session(Model):
+    __slots__ = ("id", "status", "os", "platform", "version", "type")
+
+    def __init__(self, data: dict, bot: Bot, http: Optional[HttpClient] = None):
+        # http is still accepted for old callers, it's read through the bot now
         self.bot = bot
-        self.http = http
         self._update(data)
 
     def _update(self, data):
@@ -26,10 +29,12 @@ class Event_Session:
             self.type = "user"
 
 
-class Session:
-    def __init__(self, data: dict, bot: Bot, http: HttpClient):
+class Session(Model):
+    __slots__ = ("last_used", "hash", "location", "os", "platform")
+
+    def __init__(self, data: dict, bot: Bot, http: Optional[HttpClient] = None):
+        # http is still accepted for old callers, it's read through the bot now
         self.bot: Bot = bot
-        self.http: HttpClient = http
         self._update(data)
 
     def _update(self, data):
@@ -0,0 +1,52 @@
+from __future__ import annotations
+from datetime import datetime, timezone
+
+DISCORD_EPOCH = 1420070400000
+
+
+class Snowflake(int):
+    """A Discord id.
+
+    Models store ids as plain ints, wrap one in this to read what's packed into it.
+    str() gives the usual digits, which is what the API expects.
+    """
+    __slots__ = ()
+
+    # int's str() would go through the repr below
+    __str__ = int.__repr__
+
+    def __repr__(self):
+        return f"<Snowflake id={int(self)} created_at={self.created_at.isoformat()}>"
+
+    @classmethod
+    def from_datetime(cls, time: datetime) -> Snowflake:
+        """Lowest snowflake that could have been made at a given time, handy for before/after ranges
+
+        Args:
+            time (datetime): The time
+
+        Returns:
+            Snowflake: The snowflake
+        """
+        return cls((int(time.timestamp() * 1000) - DISCORD_EPOCH) << 22)
+
+    @property
+    def timestamp(self) -> int:
+        """Unix time in milliseconds the id was made at"""
+        return (self >> 22) + DISCORD_EPOCH
+
+    @property
+    def created_at(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp / 1000, tz=timezone.utc)
+
+    @property
+    def worker_id(self) -> int:
+        return (self >> 17) & 0x1F
+
+    @property
+    def process_id(self) -> int:
+        return (self >> 12) & 0x1F
+
+    @property
+    def increment(self) -> int:
+        return self & 0xFFF
@@ -1,11 +1,13 @@
 from __future__ import annotations
 from typing import Optional, TYPE_CHECKING
-from .assets import Asset
+from sys import intern
+from .assets import Asset, asset_property
+from .base import Model, Field, Changes
 from.permissions import Permission
 
 if TYPE_CHECKING:
     from ..bot import Bot
-    from .guild import Guild, Role
+    from .guild import Guild
     from .channels import DMChannel, Messageable
 
 
@@ -14,18 +16,28 @@ if TYPE_CHECKING:
 # Time to copy and paste everything! Actually methods should be fine, attrs for some reason don't wanna work
 
 class Status:
+    __slots__ = ("platforms", "status")
+
     def __init__(self, payload: dict):
         self.update(payload)
 
     def __str__(self):
         return f"{self.platforms} // {self.status}"
 
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Status) and (self.platforms, self.status) == (other.platforms, other.status)
+
     def update(self, payload: dict):
         self.platforms = [k for k in payload.keys()]
         self.status = [v for v in payload.values()]
 
 
 class Profile():
+    __slots__ = (
+        "id", "bio", "accent_color", "pronouns", "profile_effect", "banner", "theme_colors",
+        "popout_animation_particle_type", "emoji",
+    )
+
     def __init__(self, id: str, payload: dict):
         self.id = id
         self.update(payload)
@@ -45,10 +57,38 @@ class Profile():
         self.emoji: Optional[str] = payload.get("emoji")
 
 
-class User:
+class User(Model):
+    __slots__ = (
+        "username", "status", "client_status", "broadcast", "activities", "id",
+        "discriminator", "global_name", "avatar_hash", "banner_hash", "banner_color", "accent_color",
+        "display_name", "flags", "avatar_decoration", "is_bot", "premium_since",
+    )
+
+    _fields = {
+        "username": Field(),
+        "status": Field(),
+        "client_status": Field(convert=lambda self, value: Status(value), dump=lambda status: dict(zip(status.platforms, status.status))),
+        "broadcast": Field(),
+        "activities": Field(),
+        "discriminator": Field(),
+        "global_name": Field(),
+        "avatar_hash": Field("avatar", cast=intern),
+        "banner_hash": Field("banner", cast=intern),
+        "banner_color": Field(),
+        "accent_color": Field(),
+        "display_name": Field("global_name"),
+        "flags": Field(default=0),
+        "avatar_decoration": Field(),
+        "is_bot": Field("bot", default=False),
+        "premium_since": Field(),
+    }
+
+    # Only the hashes are stored, most avatars and banners are never looked at
+    avatar = asset_property("avatar_hash", "avatars")
+    banner = asset_property("banner_hash", "banners")
+
     def __init__(self, payload: dict, bot: Bot):
         self.bot = bot
-        self.http = bot.http
         self.update(payload)
 
 
@@ -59,127 +99,79 @@ class User:
         return f"<User id={self.id} name={self.display_name} discriminator={self.discriminator}>"
 
 
-    def _remove_null(self, payload: dict):
-        return {key: value for key, value in payload.items() if value is not None}
-    
+    def to_payload(self, fields=None) -> dict:
+        return {"id": self.id, **super().to_payload(fields)}
+
     @property
     def profile(self):
         return Profile()
 
     def update(self, payload: dict):
-        self.username: Optional[str] = payload.get("username")
-        self.status: Optional[str] = payload.get("status")
-        self.client_status: Optional[Status] = (
-            Status(payload['client_status']) 
-            if payload.get("client_status") is not None
-            else None
-        )
-        self.broadcast = payload.get("broadcast")
-        self.activities = payload.get("activities")
-        self.id: Optional[str] = payload.get("id") or payload.get("user_id")
-
-        self.discriminator: Optional[str] = payload.get("discriminator")
-        self.global_name: Optional[str] = payload.get("global_name")
-        self.avatar: Optional[Asset] = (
-            Asset(self.id, payload["avatar"]).from_avatar()
-            if payload.get("avatar") is not None and self.id is not None
-            else None
-        )
-        self.banner: Optional[Asset] = (
-            Asset(self.id, payload["banner"]).from_avatar()
-            if payload.get("banner") is not None and self.id is not None
-            else None
-        )
-        self.banner_color: Optional[str] = payload.get("banner_color")
-        self.accent_color: Optional[str] = payload.get("accent_color")
-        self.display_name: Optional[str] = payload.get("global_name")
-        self.flags: int = payload.get("flags", 0)
-        self.avatar_decoration: Optional[str] = payload.get("avatar_decoration")
-        self.is_bot = payload.get("bot", False)
-        self.premium_since = payload.get("premium_since")
-
-    def partial_update(self, payload: dict):
-        for key, value in payload.items():
-            if hasattr(self, key):
-                if key == "banner":
-                    setattr(self, key, (
-                        Asset(self.id, payload["banner"]).from_avatar()
-                        if payload.get("banner") is not None and self.id is not None
-                        else None
-                    ))
-                elif key == "avatar":
-                    setattr(self, key, (
-                        Asset(self.id, payload["banner"]).from_avatar()
-                        if payload.get("banner") is not None and self.id is not None
-                        else None
-                    ))
-                elif key == "client_status":
-                    setattr(self, key, (
-                        Status(payload['client_status']) 
-                        if payload.get("client_status") is not None
-                        else None
-                    ))
-                elif key == "bot":
-                    setattr(self, "is_bot", value)
-
-                else:
-                    setattr(self, key, value)
+        # Set before the rest, assets are built from it
+        user_id = payload.get("id") or payload.get("user_id")
+        self.id: Optional[int] = int(user_id) if user_id is not None else None
+        self._parse(payload)
+
+    def partial_update(self, payload: dict) -> Changes:
+        # The id isn't part of the schema, it never changes
+        return self._diff(payload)
 
 
     async def friend(self):
         json = await self.http.request(
-            "put", "/users/@me/relationships/" + self.id if self.id is not None else "", json={}
+            "put", f"/users/@me/relationships/{self.id}", json={}
         )
         return User(json, self.bot)
     
     async def block(self):
         await self.http.request(
-            "put", "/users/@me/relationships/" + self.id if self.id is not None else "", json={"type": 2}
+            "put", f"/users/@me/relationships/{self.id}", json={"type": 2}
         )
 
     async def reset_relationship(self):
         await self.http.request(
-            "delete", "/users/@me/relationships/" + self.id if self.id is not None else "", json={}
+            "delete", f"/users/@me/relationships/{self.id}", json={}
         )
 
     async def create_dm(self) -> Optional[DMChannel]:
         json = await self.http.request(
-            "post", "/channels", json={"recipients": [self.id if self.id is not None else ""]}
+            "post", "/channels", json={"recipients": [str(self.id)]}
         )
 
         return DMChannel(json, self.bot) or None
 
 
 class Client(User):
+    __slots__ = (
+        "friends", "blocked", "private_channels", "verified", "purchased_flags", "pronouns",
+        "premium_type", "phone", "nsfw", "mobile", "desktop", "mfa",
+    )
+
+    _fields = {
+        "verified": Field(),
+        "purchased_flags": Field(),
+        "pronouns": Field(),
+        "premium_type": Field(),
+        "phone": Field(),
+        "nsfw": Field("nsfw_allowed"),
+        "mobile": Field(),
+        "desktop": Field(),
+        "mfa": Field("mfa_enabled"),
+    }
+
     def __init__(self, payload: dict, bot: Bot):
-        self.bot = bot
-        self.http = bot.http
-        self.guilds: list[Guild] = []
         self.friends: list[User] = []
         self.blocked: list[User] = []
         self.private_channels: list[Messageable] = []
+        super().__init__(payload, bot)
 
-        super().__init__(payload, bot) 
-        super().update(payload)
-        self.update(payload) 
+    @property
+    def guilds(self) -> list[Guild]:
+        """Guilds the client is in, in the order they were received. Lookups by id should go through Bot.fetch_guild"""
+        return list(self.bot.cached_guilds.values())
 
-    def update(self, payload: dict):
-        self.verified = payload.get("verified")
-        self.purchased_flags = payload.get("purchased_flags")
-        self.pronouns = payload.get("pronouns")
-        self.premium_type = payload.get("premium_type")
-        self.phone = payload.get("phone")
-        self.nsfw = payload.get("nsfw_allowed")
-        self.mobile = payload.get("mobile")
-        self.desktop = payload.get("desktop")
-        self.mfa = payload.get("mfa_enabled")
-
-    def partial_update(self, payload: dict):
-        payload = self._remove_null(payload)
-        super().partial_update(payload)
-        for key, value in payload.items():
-            if hasattr(self, key):
-                setattr(self, key, value)
+    def partial_update(self, payload: dict) -> Changes:
+        return self._diff(payload, skip_null=True)
 
     async def change_display_name(self, global_name: str):
         await self.http.request(
@@ -199,37 +191,107 @@ class Client(User):
             json={"avatar": self.http.encode_image(banner_url, animated)}
         )
 
-class Member(User):
+class Member(Model):
+    # Not a User subclass on purpose, that would drag every User slot into each member.
+    # User fields and methods are read from the shared User instead.
+    __slots__ = (
+        "user", "id", "roles", "guild_id", "joined_at", "premium_since", "deaf", "mute",
+        "pending", "nick", "communication_disabled_until", "permissions",
+    )
+
+    _fields = {
+        "roles": Field(factory=list, convert=lambda self, value: [int(role) for role in value]),
+        "guild_id": Field(cast=int),
+        "joined_at": Field(),
+        "premium_since": Field(),
+        "deaf": Field(),
+        "mute": Field(),
+        "pending": Field(),
+        "nick": Field(),
+        "communication_disabled_until": Field(),
+        "permissions": Field(cast=Permission),
+    }
+
+    # Fields that belong to the membership, everything else is read from the shared User
+    MEMBER_FIELDS = tuple(_fields)
+
     def __init__(self, payload: dict, bot: Bot):
         self.bot = bot
-        self.http = bot.http
-        super().__init__(payload, bot)
-        super().update(payload)
+        # Gateway member events nest the user, merged members only carry a user_id
+        user = payload.get("user")
+        self.user: User = bot.store_user(user if user is not None else {"id": payload["user_id"]})
+        self.id: Optional[str] = self.user.id
         self.update(payload)
 
+    @classmethod
+    def detached(cls, payload: dict, bot: Bot) -> Member:
+        """Build a member without caching its user, for members the cache policy leaves out
+
+        Args:
+            payload (dict): Member payload, either with a nested user or a user_id
+            bot (Bot): The bot
+
+        Returns:
+            Member: The member, its user is the cached one if there already is one
+        """
+        user = payload.get("user")
+        user_id = int(user["id"] if user is not None else payload["user_id"])
+        cached = bot.fetch_user(user_id)
+        if cached is None:
+            cached = User(user if user is not None else {"id": user_id}, bot)
+        elif user is not None:
+            cached.partial_update(user)
+        member = cls.__new__(cls)
+        member.bot = bot
+        member.user = cached
+        member.id = cached.id
+        member.update(payload)
+        return member
+
+    def __getattr__(self, name: str):
+        # Only reached for attributes the member doesn't have itself
+        return getattr(object.__getattribute__(self, "user"), name)
+
+    def __str__(self):
+        return str(self.user)
+
+    def __repr__(self):
+        return f"<Member id={self.id} name={self.display_name} guild_id={self.guild_id}>"
+
     @property
     def guild(self):
         return self.bot.fetch_guild(self.guild_id)
 
+    def permissions_in(self, channel: Messageable) -> Permission:
+        """What the member can do in a channel, after role and channel overwrites
+
+        Args:
+            channel (Messageable): A channel of the member's guild
+
+        Returns:
+            Permission: The permissions
+        """
+        return self.bot.permissions.resolve(self, channel)
+
 
     def update(self, payload: dict):
-        self.roles: list[Role] = []
-        self.guild_id: str = payload.get("guild_id")
-        self.joined_at: str = payload.get("joined_at")
-        self.premium_since: str = payload.get("premium_since")
-        self.deaf: bool = payload.get("deaf")
-        self.mute: bool = payload.get("mute")
-        self.pending: bool = payload.get("pending")
-        self.nick: str = payload.get("nick")
-        self.communication_disabled_until: str = payload.get("communication_disabled_until")
-        self.permissions = Permission(payload['permissions'], self.bot) if payload.get("permissions") is not None else None
-        
-    def partial_update(self, payload: dict):
-        payload = self._remove_null(payload)
-        super().partial_update(payload)
-        for key, value in payload.items():
-            if hasattr(self, key):
-                setattr(self, key, value)
+        self._parse(payload)
+
+    def to_payload(self, fields=None) -> dict:
+        payload = {"user_id": self.id, **super().to_payload(fields)}
+        # Columnar views can carry a user that isn't cached, keep its names with the member
+        if self.bot.fetch_user(self.id) is None:
+            payload["user"] = self.user.to_payload()
+        return payload
+
+    def partial_update(self, payload: dict) -> Changes:
+        changes = self._diff(payload, skip_null=True)
+        user = payload.get("user")
+        if user is not None:
+            user_changes = self.user.partial_update(user)
+            if user_changes:
+                changes["user"] = user_changes
+        return changes
 
 
     async def kick(self, user_id: str, reason: str = ""):
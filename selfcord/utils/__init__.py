@@ -1,4 +1,10 @@
 """Where command handling and logging reside. This also is where I wrote extensions in commands.py"""
 from .command import (Command, CommandCollection, Context, Event, Extender,
                       Extension, ExtensionCollection)
+from .converters import ArgumentPlan, converter, tokenize
+from .executors import ExecutorContext, ExecutorPool
+from .sandbox import EvalResult, EvalSandbox
+from .cache import CachePolicy, MessageCache, MessageCachePolicy
+from .permissions import PermissionResolver
+from .router import CommandRouter, Route
 from .logging import logging
\ No newline at end of file
@@ -0,0 +1,555 @@
+from __future__ import annotations
+
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import TYPE_CHECKING, Iterator, Optional, Union
+
+from ..models.snowflake import Snowflake
+
+if TYPE_CHECKING:
+    from ..models import Message
+
+SnowflakeLike = Union[str, int, datetime]
+
+
+def to_snowflake(value: SnowflakeLike) -> int:
+    """Turn an id or a datetime into an integer snowflake, datetimes become the lowest snowflake at that time
+
+    Args:
+        value (str | int | datetime): The id or time
+
+    Returns:
+        int: The snowflake
+    """
+    if isinstance(value, datetime):
+        return int(Snowflake.from_datetime(value))
+    return int(value)
+
+
+def estimate_size(message: Message) -> int:
+    """Rough size of a cached message in bytes, used for the byte budget.
+
+    This is deliberately cheap, it is called for every message that gets cached.
+
+    Args:
+        message (Message): The message to size
+
+    Returns:
+        int: Approximate size in bytes
+    """
+    # The object itself plus the handful of small fields every message carries
+    size = 1024
+    content = message.content
+    if content:
+        size += sys.getsizeof(content)
+    # Read from the raw payload when it's still there, sizing shouldn't decode anything
+    payload = message._payload
+    for key in ("embeds", "attachments", "components"):
+        field = payload.get(key) if payload else getattr(message, key)
+        if field:
+            size += 512 * len(field)
+    return size
+
+
+class ChannelBuffer:
+    """Snowflake-ordered message ids of a single channel.
+
+    Alongside the ids it tracks which id ranges are complete, meaning every message
+    of the channel in that range is cached. History can be served from those ranges
+    without asking the API.
+    """
+
+    def __init__(self) -> None:
+        self.ids: list[int] = []
+        self.complete: list[list[int]] = []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, message_id: int):
+        ids = self.ids
+        if not ids or message_id > ids[-1]:
+            # Gateway messages almost always arrive in order
+            ids.append(message_id)
+            return
+        index = bisect_left(ids, message_id)
+        if index == len(ids) or ids[index] != message_id:
+            ids.insert(index, message_id)
+
+    def remove(self, message_id: int):
+        ids = self.ids
+        index = bisect_left(ids, message_id)
+        if index < len(ids) and ids[index] == message_id:
+            del ids[index]
+        for span in self.complete:
+            low, high = span
+            if low <= message_id <= high:
+                self.complete.remove(span)
+                # Everything around the removed message is still complete
+                if low < message_id:
+                    self.mark_complete(low, message_id - 1)
+                if message_id < high:
+                    self.mark_complete(message_id + 1, high)
+                break
+
+    def oldest(self) -> Optional[int]:
+        return self.ids[0] if self.ids else None
+
+    def mark_complete(self, low: int, high: int):
+        """Record that every message with an id in [low, high] is cached"""
+        if low > high:
+            return
+        merged = []
+        for span in self.complete:
+            if span[1] + 1 < low or high + 1 < span[0]:
+                merged.append(span)
+            else:
+                low = min(low, span[0])
+                high = max(high, span[1])
+        merged.append([low, high])
+        merged.sort()
+        self.complete = merged
+
+    def span_below(self, cursor: int) -> Optional[list[int]]:
+        """The complete span that contains the position right below cursor"""
+        for span in self.complete:
+            if span[0] < cursor <= span[1] + 1:
+                return span
+        return None
+
+    def range(
+        self, before: Optional[int] = None, after: Optional[int] = None, limit: Optional[int] = None
+    ) -> list[int]:
+        """Cached ids strictly between after and before, newest first"""
+        ids = self.ids
+        start = bisect_right(ids, after) if after is not None else 0
+        end = bisect_left(ids, before) if before is not None else len(ids)
+        if limit is not None:
+            start = max(start, end - limit)
+        return ids[start:end][::-1]
+
+
+class MessageCachePolicy:
+    """Limits for a message cache. Any limit set to None is not enforced.
+
+    Args:
+        max_messages (int, optional): Maximum amount of messages kept, defaults to 1000.
+        max_age (float, optional): Seconds a message is kept after being cached, defaults to None.
+        per_channel (int, optional): Maximum amount of messages kept per channel, defaults to None.
+        max_bytes (int, optional): Approximate memory budget in bytes, defaults to None.
+    """
+
+    def __init__(
+        self,
+        max_messages: Optional[int] = 1000,
+        max_age: Optional[float] = None,
+        per_channel: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ) -> None:
+        self.max_messages: Optional[int] = max_messages
+        self.max_age: Optional[float] = max_age
+        self.per_channel: Optional[int] = per_channel
+        self.max_bytes: Optional[int] = max_bytes
+
+    def __repr__(self) -> str:
+        return (
+            f"<MessageCachePolicy max_messages={self.max_messages} max_age={self.max_age} "
+            f"per_channel={self.per_channel} max_bytes={self.max_bytes}>"
+        )
+
+
+class CachePolicy:
+    """What the bot caches, per kind of object and optionally per guild. Anything left out is never built.
+
+    Every option takes one of:
+
+    - True or "always": cache it, the default
+    - False or "never": don't cache it
+    - a list, set or tuple of guild ids: only cache it in those guilds
+    - "interacted": only once the client has sent a message in the guild. For members and
+      presences, only once that user has sent a message the bot saw
+    - an int: cache at most that many per guild
+
+    Messages and presences outside of guilds (DMs, friends) are only left out by False.
+    The client's own member and presence are always cached. Messages also go through the
+    MessageCachePolicy limits, an int here stops caching a guild's messages once it has that many.
+
+    Args:
+        members: Guild members, defaults to True.
+        presences: Statuses and activities of users, defaults to True.
+        messages: Messages, defaults to True.
+        emojis: Guild emojis, defaults to True.
+        stickers: Guild stickers, defaults to True.
+        roles: Guild roles, permission checks treat missing roles as granting nothing, defaults to True.
+        guilds (dict, optional): Guild id to a dict of options, overriding the ones above in that guild.
+    """
+
+    ENTITIES = ("members", "presences", "messages", "emojis", "stickers", "roles")
+    INTERACTED = "interacted"
+
+    def __init__(
+        self,
+        members=True,
+        presences=True,
+        messages=True,
+        emojis=True,
+        stickers=True,
+        roles=True,
+        guilds: Optional[dict] = None,
+    ) -> None:
+        self.options: dict = {
+            entity: self._normalize(option)
+            for entity, option in zip(self.ENTITIES, (members, presences, messages, emojis, stickers, roles))
+        }
+        self.guilds: dict[int, dict] = {}
+        for guild_id, options in (guilds or {}).items():
+            unknown = set(options) - set(self.ENTITIES)
+            if unknown:
+                raise ValueError(f"Unknown cache policy entities: {', '.join(sorted(unknown))}")
+            self.guilds[int(guild_id)] = {entity: self._normalize(option) for entity, option in options.items()}
+        # Entities cached everywhere, hot paths check this before asking allows
+        self.unrestricted: frozenset[str] = frozenset(
+            entity for entity, option in self.options.items()
+            if option is True and not any(entity in options for options in self.guilds.values())
+        )
+        # Only tracked when an option needs it
+        self.tracks_interactions: bool = any(
+            option == self.INTERACTED
+            for options in (self.options, *self.guilds.values())
+            for option in options.values()
+        )
+        self.interacted_guilds: set[int] = set()
+        self.interacted_users: set[int] = set()
+
+    def __repr__(self) -> str:
+        options = " ".join(f"{entity}={option!r}" for entity, option in self.options.items())
+        return f"<CachePolicy {options}>"
+
+    @classmethod
+    def _normalize(cls, option):
+        if option is True or option == "always":
+            return True
+        if option is False or option == "never":
+            return False
+        if option == cls.INTERACTED:
+            return cls.INTERACTED
+        if isinstance(option, int):
+            return max(option, 0)
+        if isinstance(option, (list, set, frozenset, tuple)):
+            return frozenset(int(guild_id) for guild_id in option)
+        raise ValueError(f"Invalid cache policy option: {option!r}")
+
+    def option(self, entity: str, guild_id: Optional[int] = None):
+        """The option that applies to an entity in a guild, after per guild overrides"""
+        if guild_id is not None:
+            overrides = self.guilds.get(guild_id)
+            if overrides is not None and entity in overrides:
+                return overrides[entity]
+        return self.options[entity]
+
+    def allows(self, entity: str, guild_id: Optional[int] = None, user_id: Optional[int] = None, count: int = 0) -> bool:
+        """Whether an object may be cached right now
+
+        Args:
+            entity (str): One of ENTITIES
+            guild_id (int, optional): Guild the object belongs to, None outside of guilds
+            user_id (int, optional): User the object belongs to, for members and presences
+            count (int): How many of these the guild has cached already
+
+        Returns:
+            bool: True if it should be cached
+        """
+        option = self.option(entity, guild_id)
+        if option is True or option is False:
+            return option
+        if guild_id is None:
+            return True
+        if option == self.INTERACTED:
+            if entity in ("members", "presences"):
+                return user_id in self.interacted_users
+            return guild_id in self.interacted_guilds
+        if isinstance(option, int):
+            return count < option
+        return guild_id in option
+
+    def may_allow(self, entity: str, guild_id: Optional[int] = None) -> bool:
+        """Whether an object could ever be cached in a guild, so its raw payload is worth keeping"""
+        option = self.option(entity, guild_id)
+        return option == self.INTERACTED or self.allows(entity, guild_id)
+
+    def limit(self, entity: str, guild_id: Optional[int] = None) -> Optional[int]:
+        """Maximum count of an entity in a guild, None when it isn't capped"""
+        option = self.option(entity, guild_id)
+        if isinstance(option, int) and not isinstance(option, bool) and guild_id is not None:
+            return option
+        return None
+
+    def interact(self, guild_id: Optional[int], user_id: int, own: bool = False) -> bool:
+        """Record that a user sent a message
+
+        Args:
+            guild_id (int, optional): Guild the message was sent in
+            user_id (int): Author of the message
+            own (bool): Whether the author is the client
+
+        Returns:
+            bool: True if this is the client's first message in the guild
+        """
+        self.interacted_users.add(user_id)
+        if own and guild_id is not None and guild_id not in self.interacted_guilds:
+            self.interacted_guilds.add(guild_id)
+            return True
+        return False
+
+
+class MessageCache:
+    """Bounded LRU cache of messages keyed by message id, behaves like the dict it replaces.
+
+    Args:
+        policy (MessageCachePolicy, optional): Limits to enforce, defaults to MessageCachePolicy().
+    """
+
+    def __init__(self, policy: Optional[MessageCachePolicy] = None) -> None:
+        self.policy: MessageCachePolicy = policy or MessageCachePolicy()
+        # Keyed by int ids, every public method also takes the string form
+        self.messages: OrderedDict[int, Message] = OrderedDict()
+        self.channels: dict[int, ChannelBuffer] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.bytes: int = 0
+        self._sizes: dict[int, int] = {}
+        # Insertion times for max_age, LRU order is kept by self.messages
+        self._added: dict[int, float] = {}
+        self._expiry: deque[tuple[float, int]] = deque()
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __iter__(self) -> Iterator[int]:
+        yield from self.messages.keys()
+
+    def __contains__(self, message_id: str | int) -> bool:
+        return int(message_id) in self.messages
+
+    def __getitem__(self, message_id: str | int) -> Message:
+        message = self.get(message_id)
+        if message is None:
+            raise KeyError(message_id)
+        return message
+
+    def __setitem__(self, message_id: str | int, message: Message) -> None:
+        self.add(message_id, message)
+
+    def __repr__(self) -> str:
+        return f"<MessageCache size={len(self)} bytes={self.bytes} hits={self.hits} misses={self.misses} evictions={self.evictions}>"
+
+    def values(self):
+        return self.messages.values()
+
+    def items(self):
+        return self.messages.items()
+
+    def add(self, message_id: str | int, message: Message, previous_id: Optional[str | int] = None):
+        """Cache a message, evicting older ones if a limit is hit
+
+        Args:
+            message_id (str | int): ID of the message
+            message (Message): The message to cache
+            previous_id (str | int, optional): ID of the message directly before this one in the channel, if known. Lets history be served from cache across gateway messages.
+        """
+        message_id = int(message_id)
+        if message_id in self.messages:
+            self._discard(message_id)
+        policy = self.policy
+        self.messages[message_id] = message
+
+        if policy.max_age is not None:
+            now = time.monotonic()
+            self._added[message_id] = now
+            self._expiry.append((now, message_id))
+
+        channel_id = message.channel_id
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = ChannelBuffer()
+        channel.add(message_id)
+        if previous_id is not None:
+            previous = int(previous_id)
+            # Only extend a span we already trust, a stale previous_id could hide a gap otherwise
+            if channel.span_below(previous + 1) is not None:
+                channel.mark_complete(previous + 1, message_id)
+
+        if policy.max_bytes is not None:
+            size = estimate_size(message)
+            self._sizes[message_id] = size
+            self.bytes += size
+
+        self._enforce(channel_id)
+
+    def get(self, message_id: str | int, default=None) -> Optional[Message]:
+        """Get a message, marking it as recently used
+
+        Args:
+            message_id (str | int): ID of the message
+
+        Returns:
+            Message: The message, default if not cached
+        """
+        message_id = int(message_id)
+        message = self.messages.get(message_id)
+        if message is None:
+            self.misses += 1
+            return default
+        max_age = self.policy.max_age
+        if max_age is not None and time.monotonic() - self._added[message_id] > max_age:
+            self._discard(message_id)
+            self.evictions += 1
+            self.misses += 1
+            return default
+        self.messages.move_to_end(message_id)
+        self.hits += 1
+        return message
+
+    def pop(self, message_id: str | int, default=None) -> Optional[Message]:
+        """Remove a message from the cache without counting it as an eviction
+
+        Args:
+            message_id (str | int): ID of the message
+
+        Returns:
+            Message: The removed message, default if not cached
+        """
+        message_id = int(message_id)
+        if message_id not in self.messages:
+            return default
+        return self._discard(message_id)
+
+    def history(
+        self,
+        channel_id: str | int,
+        before: Optional[SnowflakeLike] = None,
+        after: Optional[SnowflakeLike] = None,
+        limit: Optional[int] = None,
+    ) -> list[Message]:
+        """Cached messages of a channel, newest first
+
+        Args:
+            channel_id (str | int): ID of the channel
+            before (str | int | datetime, optional): Only messages older than this id or time
+            after (str | int | datetime, optional): Only messages newer than this id or time
+            limit (int, optional): Maximum amount of messages to return
+
+        Returns:
+            list[Message]: The messages
+        """
+        channel = self.channels.get(int(channel_id))
+        if channel is None:
+            return []
+        ids = channel.range(
+            to_snowflake(before) if before is not None else None,
+            to_snowflake(after) if after is not None else None,
+            limit,
+        )
+        messages = self.messages
+        return [messages[message_id] for message_id in ids]
+
+    def mark_complete(self, channel_id: str | int, low: SnowflakeLike, high: SnowflakeLike):
+        """Record that every message of a channel between low and high (inclusive) is cached
+
+        Args:
+            channel_id (str | int): ID of the channel
+            low (str | int | datetime): Lowest id of the range
+            high (str | int | datetime): Highest id of the range
+        """
+        channel_id = int(channel_id)
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = ChannelBuffer()
+        channel.mark_complete(to_snowflake(low), to_snowflake(high))
+
+    def complete_below(self, channel_id: str | int, cursor: SnowflakeLike) -> tuple[list[Message], int]:
+        """Cached messages directly below cursor that are known to have no gaps between them
+
+        Args:
+            channel_id (str | int): ID of the channel
+            cursor (str | int | datetime): Messages older than this are returned
+
+        Returns:
+            tuple[list[Message], int]: The messages newest first, and the lowest id the run is known to cover. Messages older than that have to come from the API.
+        """
+        cursor = to_snowflake(cursor)
+        channel = self.channels.get(int(channel_id))
+        span = channel.span_below(cursor) if channel is not None else None
+        if span is None:
+            return [], cursor
+        ids = channel.range(before=cursor, after=span[0] - 1)
+        messages = self.messages
+        return [messages[message_id] for message_id in ids], span[0]
+
+    def clear(self):
+        self.messages.clear()
+        self.channels.clear()
+        self._sizes.clear()
+        self._added.clear()
+        self._expiry.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        """Counters and current size of the cache
+
+        Returns:
+            dict: hits, misses, evictions, size and bytes
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.messages),
+            "bytes": self.bytes,
+        }
+
+    def _discard(self, message_id: int) -> Message:
+        message = self.messages.pop(message_id)
+        self._added.pop(message_id, None)
+        channel = self.channels.get(message.channel_id)
+        if channel is not None:
+            channel.remove(message_id)
+            if not channel and not channel.complete:
+                del self.channels[message.channel_id]
+        size = self._sizes.pop(message_id, None)
+        if size is not None:
+            self.bytes -= size
+        return message
+
+    def _evict(self, message_id: int):
+        self._discard(message_id)
+        self.evictions += 1
+
+    def _enforce(self, channel_id: int):
+        policy = self.policy
+
+        if policy.max_age is not None:
+            deadline = time.monotonic() - policy.max_age
+            expiry = self._expiry
+            while expiry and expiry[0][0] < deadline:
+                added, message_id = expiry.popleft()
+                # Stale entry if the message was removed or cached again since
+                if self._added.get(message_id) == added:
+                    self._evict(message_id)
+
+        if policy.per_channel is not None:
+            channel = self.channels.get(channel_id)
+            while channel is not None and len(channel) > policy.per_channel:
+                self._evict(channel.oldest())
+
+        if policy.max_messages is not None:
+            while len(self.messages) > policy.max_messages:
+                self._evict(next(iter(self.messages)))
+
+        if policy.max_bytes is not None:
+            while self.bytes > policy.max_bytes and self.messages:
+                self._evict(next(iter(self.messages)))
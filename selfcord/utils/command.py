@@ -1,13 +1,17 @@
 from __future__ import annotations
 
+import asyncio
+import functools
 import inspect
-import re
-import shlex
 from collections import defaultdict
+from time import perf_counter
 from traceback import format_exception
 from typing import TYPE_CHECKING, Any, Optional
 from ..models import Message
+from .converters import ArgumentPlan, find_converter
+from .executors import ExecutorContext, check_executor
 from .logging import logging
+from .router import Route
 
 if TYPE_CHECKING:
     from ..api import *
@@ -43,6 +47,8 @@ class ExtensionCollection:
 
     def __init__(self):
         self.extensions = {}
+        # Bumped on every change, the command router rebuilds when it moves
+        self.version: int = 0
 
     def __iter__(self):
         yield from self.extensions.values()
@@ -80,6 +86,7 @@ class ExtensionCollection:
             log.error("Name or Alias is already registered")
         # Add extension to the collection
         self.extensions[ext.name] = ext
+        self.version += 1
 
     def get(self, alias: str) -> Extension | None:
         """Get an extension
@@ -108,8 +115,12 @@ class Command:
         self.description: str | None = kwargs.get("description")
         self.mass_token: bool = kwargs.get("mass_token", False)
         self.func: function | None = kwargs.get("func")
+        # "thread" or "process" to run the body off the event loop, see Bot.executors
+        self.executor: str | None = kwargs.get("executor")
         self.check: Any = inspect.signature(self.func).return_annotation
         self.signature = inspect.signature(self.func).parameters.items()
+        # Worked out once here instead of on every invocation
+        self.plan = ArgumentPlan(self.func)
 
 
 class CommandCollection:
@@ -118,6 +129,8 @@ class CommandCollection:
     def __init__(self, **kwargs):
         self.commands: dict[CommandCollection, function] = {}
         self.recent_commands: dict[CommandCollection, function] = {}
+        # Bumped on every change, the command router rebuilds when it moves
+        self.version: int = 0
 
     def __len__(self):
         return len(self.commands)
@@ -156,6 +169,7 @@ class CommandCollection:
         for item in collection:
             self.commands[item.name] = item
             self.recent_commands[item.name] = item
+        self.version += 1
 
     def add(self, cmd: Command):
         """Add a Command to the collection
@@ -173,11 +187,13 @@ class CommandCollection:
             log.error("Command Name or Alias is already registered")
         self.commands[cmd.name] = cmd
         self.recent_commands[cmd.name] = cmd
+        self.version += 1
 
     def remove(self, cmd: Command):
         if not isinstance(cmd, Command):
             log.error("cmd must be a subclass of Command")
         self.commands.pop(cmd.name)
+        self.version += 1
 
     def recents(self):
         """View commands recently acquired
@@ -190,6 +206,7 @@ class CommandCollection:
     def copy(self):
         """Copy commands from recents to main collection"""
         self.commands.update(self.recent_commands)
+        self.version += 1
         self.clear()
 
     def clear(self):
@@ -205,23 +222,136 @@ class CommandCollection:
         Returns:
             Command: Command obtained
         """
-        try:
-            return self.commands[alias]
-        except KeyError as e:
-            log.error(f"{e}")
-        for command in self.commands:
+        command = self.commands.get(alias)
+        if command is not None:
+            return command
+        for command in self.commands.values():
             if alias in command.aliases:
                 return command
+        log.error(f"No command named {alias!r}")
 
 
 class Event:
-    """Event object"""
+    """Event object, a listener compiled into what Bot.emit calls.
+
+    How the listener is called (inline, as a task or in an executor, with the extension
+    or not) is worked out here once, emit only calls fire.
+    """
 
-    def __init__(self, name: str, coro, ext: Extension, mass_token: bool = False) -> None:
+    def __init__(self, name: str, coro, ext: Extension, mass_token: bool = False, executor: str | None = None, inline: bool = False) -> None:
         self.name: str = name
         self.coro = coro
         self.ext: Extension = ext
         self.mass_token = mass_token
+        self.executor = executor
+        self.inline = inline
+        # Per listener counters, see stats
+        self.calls: int = 0
+        self.errors: int = 0
+        self.total_time: float = 0.0
+        self.max_time: float = 0.0
+
+        code = coro.__code__
+        self.takes_args: bool = bool(
+            code.co_argcount or code.co_kwonlyargcount or code.co_flags & (inspect.CO_VARARGS | inspect.CO_VARKEYWORDS)
+        )
+        # Passed before the event's arguments, the extension for methods of an Extender
+        self.bound: tuple = (ext,) if code.co_argcount and code.co_varnames[0] == "self" else ()
+        if inline:
+            self.fire = self._fire_inline
+        elif executor is not None:
+            self.fire = self._fire_executor
+        else:
+            self.fire = self._fire_task
+
+    def bind(self, ext) -> Event:
+        """Same listener compiled for an extension instance, used when the extension is loaded
+
+        Args:
+            ext (Extender): The extension instance
+
+        Returns:
+            Event: The bound listener
+        """
+        return Event(self.name, self.coro, ext, self.mass_token, self.executor, self.inline)
+
+    def _record(self, started: float, failed: bool):
+        elapsed = perf_counter() - started
+        self.calls += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        if failed:
+            self.errors += 1
+
+    def _failed(self, e: Exception):
+        error = "".join(format_exception(e, e, e.__traceback__))
+        log.error(f"Could not run {self.name} listener {self.coro.__name__}\n{error}")
+
+    def _fire_inline(self, bot: Bot, args: tuple, kwargs: dict):
+        started = perf_counter()
+        try:
+            if self.takes_args:
+                self.coro(*self.bound, *args, **kwargs)
+            else:
+                self.coro()
+        except Exception as e:
+            self._record(started, True)
+            self._failed(e)
+        else:
+            self._record(started, False)
+
+    def _fire_task(self, bot: Bot, args: tuple, kwargs: dict):
+        asyncio.create_task(self._run(args, kwargs))
+
+    def _fire_executor(self, bot: Bot, args: tuple, kwargs: dict):
+        asyncio.create_task(self._run(args, kwargs, bot))
+
+    async def _run(self, args: tuple, kwargs: dict, bot: Optional[Bot] = None):
+        started = perf_counter()
+        try:
+            if not self.takes_args:
+                args, kwargs = (), {}
+            if bot is None:
+                await self.coro(*self.bound, *args, **kwargs)
+            else:
+                # Extensions hold the bot, they can't go to another process
+                bound = (None,) * len(self.bound) if self.executor == "process" else self.bound
+                await bot.executors.run(self.executor, self.coro, *bound, *args, **kwargs)
+        except Exception as e:
+            self._record(started, True)
+            self._failed(e)
+        else:
+            self._record(started, False)
+
+    def stats(self) -> dict:
+        """Timing and error counters of the listener
+
+        Returns:
+            dict: calls, errors, and the total, average and max run time in seconds. Task and executor listeners are timed until they finish.
+        """
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_time": self.total_time,
+            "avg_time": self.total_time / (self.calls or 1),
+            "max_time": self.max_time,
+        }
+
+
+def check_listener(func, executor: str | None, inline: bool):
+    """Validate the executor= and inline= options of an event decorator
+
+    Raises:
+        ValueError: Both are given
+        Exception: Inline listeners have to be regular functions
+    """
+    check_executor(executor, func)
+    if inline:
+        if executor is not None:
+            raise ValueError("A listener can't be both inline and in an executor")
+        if inspect.iscoroutinefunction(func):
+            raise Exception("Inline listeners have to be regular functions, not coroutines")
 
 
 class Extender:
@@ -236,12 +366,13 @@ class Extender:
         cls.description = description
 
     @classmethod
-    def cmd(cls, description: str = "", aliases: list[str] = []):
+    def cmd(cls, description: str = "", aliases: list[str] = [], executor: str | None = None):
         """Decorator to add commands for the bot
 
         Args:
             description (str, optional): Description of command. Defaults to "".
             aliases (list[str], optional): Alternative names for command. Defaults to [].
+            executor (str, optional): "thread" or "process" to run a regular function off the event loop, see Bot.cmd. Defaults to None.
 
         Raises:
             RuntimeWarning: If you suck and don't use a coroutine
@@ -251,12 +382,13 @@ class Extender:
 
         def decorator(coro):
             name = coro.__name__
-            if not inspect.iscoroutinefunction(coro):
+            check_executor(executor, coro)
+            if executor is None and not inspect.iscoroutinefunction(coro):
                 log.error("Not a coroutine")
                 raise Exception("Not a coroutine")
             else:
                 cmd = Command(
-                    name=name, description=description, aliases=aliases, func=coro
+                    name=name, description=description, aliases=aliases, func=coro, executor=executor
                 )
                 cls.commands.add(cmd)
 
@@ -265,21 +397,25 @@ class Extender:
         return decorator
 
     @classmethod
-    def on(cls, event: str, mass_token: bool = False):
+    def on(cls, event: str, mass_token: bool = False, executor: str | None = None, inline: bool = False):
         """Decorator for events
 
         Args:
             event (str): The event to check for
+            executor (str, optional): "thread" or "process" to run a regular function off the event loop, see Bot.on. Defaults to None.
+            inline (bool, optional): Call a regular function right inside emit instead of in a task, see Bot.on. Defaults to False.
         """
 
         def decorator(coro):
-            if not inspect.iscoroutinefunction(coro):
+            check_listener(coro, executor, inline)
+            if executor is None and not inline and not inspect.iscoroutinefunction(coro):
                 log.error("Not a coroutine")
                 raise Exception("Not a coroutine")
             else:
-                eve = Event(name=event, coro=coro, ext=cls, mass_token=mass_token)
+                eve = Event(name=event, coro=coro, ext=cls, mass_token=mass_token, executor=executor, inline=inline)
                 cls._events[event].append(eve)
 
+                @functools.wraps(coro)
                 def wrapper(*args, **kwargs):
                     result = cls._events[event].append(eve)
                     return result
@@ -313,13 +449,19 @@ class Extender:
             cls.commands.add(cmd)
 
 
+# Context.route before the message has been parsed, None already means "not a command"
+_UNPARSED = object()
+
+
 class Context:
     """Context related for commands, and invocation"""
 
-    def __init__(self, message: Message, bot: Bot) -> None:
+    def __init__(self, message: Message, bot: Bot, route: Optional[Route] = _UNPARSED) -> None:
         self.bot: Bot = bot
         self.message = message
         self.http = bot.http
+        # Parsed on first use unless the caller already did it
+        self._route = route
 
     @property
     def author(self) -> User:
@@ -338,40 +480,36 @@ class Context:
         return self.message.content
 
     @property
-    def command(self) -> function | None:
-        if self.prefix is None:
-            return None
-        for command in self.bot.commands:
-            for alias in command.aliases:
-                if self.content.lower().startswith(self.prefix + alias):
-                    return command
-        for extension in self.bot.extensions:
-            for command in extension.commands:
-                for alias in command.aliases:
-                    if self.content.lower().split(" ")[0] == self.prefix + alias:
-                        self.extension = extension.ext
-                        return command
-        return None
+    def route(self) -> Optional[Route]:
+        """Prefix, command and arguments of the message, parsed once by the bot's router"""
+        if self._route is _UNPARSED:
+            self._route = self.bot.router.match(self.content)
+        return self._route
+
+    @property
+    def extension(self):
+        """The extension the command belongs to, None for the bot's own commands"""
+        route = self.route
+        return route.extension if route is not None else None
+
+    @property
+    def command(self) -> Command | None:
+        route = self.route
+        return route.command if route is not None else None
 
     @property
     def alias(self) -> str | None:
-        for command in self.bot.commands:
-            for alias in command.aliases:
-                if self.content.lower().startswith(self.prefix + alias.lower()):
-                    return alias
-        for extension in self.bot.extensions:
-            for command in extension.commands:
-                for alias in command.aliases:
-                    if self.content.lower().startswith(self.prefix + alias.lower()):
-                        self.extension = extension.ext
-                        return alias
-        return None
+        route = self.route
+        return route.alias if route is not None else None
 
     @property
     def prefix(self) -> str | None:
-        for prefix in self.bot.prefixes:
-            if self.content.startswith(prefix):
-                return prefix
+        route = self.route
+        if route is not None:
+            return route.prefix
+        # Not a command, still tell which prefix it starts with
+        lengths = self.bot.router.prefix_lengths(self.content or "")
+        return self.content[:lengths[-1]] if lengths else None
 
     @property
     def command_content(self) -> str | None:
@@ -380,13 +518,8 @@ class Context:
         Returns:
             str: String of content
         """
-        if self.alias is None:
-            return
-        try:
-            cut = len(self.prefix + self.alias)
-            return self.content[cut:]
-        except:
-            return None
+        route = self.route
+        return route.arguments if route is not None else None
 
     def get_converter(self, param) -> type[str] | Any | None:
         if param.annotation is param.empty:
@@ -397,7 +530,7 @@ class Context:
             log.error("Parameter annotation must be callable")
 
     async def convert(self, param, value) -> str | Any:
-        """Attempts to turn x value in y value, using get_converter func for the values
+        """Attempts to turn x value in y value, using the registered converters for the parameter's annotation
 
         Args:
             param (_type_): function parameter
@@ -406,65 +539,24 @@ class Context:
         Returns:
             Type[str]: The type of parameter
         """
-        from ..models import User
-        converter = self.get_converter(param)
-        if converter is User:
-            id = re.findall(r"[0-9]{18,19}", value)
-            if len(id) > 0:
-                user = await self.bot.get_user(id[0])
-                return user
-            log.error("You failed to pass valid mention or ID")
-        return converter(value)
+        converter = find_converter(param.annotation)
+        if converter is None:
+            return value
+        result = converter(self, value, param.annotation)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
 
     async def get_arguments(self) -> tuple[list, dict]:
-        """Get arguments by checking function arguments and comparing to arguments in message.
+        """Get arguments by binding the arguments in the message to the command's argument plan.
+
+        Raises:
+            ValueError: An argument couldn't be converted
 
         Returns:
-            _type_: _description_
+            tuple[list, dict]: args and kwargs
         """
-        args: list[Any] = []
-        kwargs: dict[Any, Any] = {}
-
-        if self.command.signature is not None:
-            signature = self.command.signature
-        if self.command_content == "":
-            return args, kwargs
-        if self.command_content is None:
-            return args, kwargs
-        sh = shlex.shlex(self.command_content[1:], posix=False)
-        sh.whitespace = " "
-        sh.whitespace_split = True
-        splitted = list(sh)
-
-        
-        for index, (name, param) in enumerate(signature):
-            if name in ["ctx", "self"]:
-                continue
-
-            if param.kind is param.POSITIONAL_OR_KEYWORD:
-                try:
-                    arg: str | Any = await self.convert(param, splitted.pop(0))
-                    args.append(arg)
-                except Exception as e:
-                    log.error(e)
-            if param.kind is param.VAR_KEYWORD:
-                for arg in splitted:
-                    arg = await self.convert(param, arg)
-                    args.append(arg)
-            if param.kind is param.VAR_POSITIONAL:
-                for arg in splitted:
-                    arg = await self.convert(param, arg)
-                    args.append(arg)
-
-            if param.kind is param.KEYWORD_ONLY:
-                arg = await self.convert(param, " ".join(splitted))
-                kwargs[name] = arg
-
-        for key in kwargs.copy():
-            if not kwargs[key]:
-                kwargs.pop(key)
-
-        return args, kwargs
+        return await self.command.plan.bind(self, self.command_content)
 
     async def invoke(self):
         """Used to actually run the command"""
@@ -480,16 +572,29 @@ class Context:
                 return
         
         if self.command_content != None:
-            args, kwargs = await self.get_arguments()
+            try:
+                args, kwargs = await self.get_arguments()
+            except Exception as e:
+                log.error(f"Could not convert arguments for {self.command.name}: {e}")
+                return
             func = self.command.func
+            executor = self.command.executor
+            # Bodies in a pool get a plain copy of the context, extensions hold the bot so processes get None
+            ctx = ExecutorContext(self) if executor is not None else self
             if func.__code__.co_varnames[0] == "self":
-                args.insert(0, self.extension)
-                args.insert(1, self)
+                args.insert(0, self.extension if executor != "process" else None)
+                args.insert(1, ctx)
             else:
-                args.insert(0, self)
+                args.insert(0, ctx)
 
         try:
-            await func(*args, **kwargs)
+            if executor is None:
+                await func(*args, **kwargs)
+            else:
+                # The result comes back to the loop and gets replied from here
+                result = await self.bot.executors.run(executor, func, *args, **kwargs)
+                if result is not None:
+                    await self.reply(result)
         except Exception as e:
             error = "".join(format_exception(e, e, e.__traceback__))
             log.error(f"Could not run command \n{error}")
@@ -0,0 +1,368 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import re
+import typing
+from datetime import timedelta
+from types import UnionType
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from ..models import Convert, Member, Messageable, Role, Snowflake, User
+
+if TYPE_CHECKING:
+    from .command import Context
+
+# A converter takes the context, the raw argument and the annotation it's converting to.
+# It returns the value, or an awaitable of it when it has to wait for the API.
+Converter = Callable[["Context", str, Any], Any]
+
+CONVERTERS: dict[Any, Converter] = {}
+
+_ID = re.compile(r"<(?:@[!&]?|#)(\d{15,20})>|(\d{15,20})")
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)\s*(w|d|h|m|s)", re.IGNORECASE)
+_UNITS = {"w": 604800, "d": 86400, "h": 3600, "m": 60, "s": 1}
+_QUOTES = ("'", '"')
+_TRUE = frozenset(("true", "yes", "y", "on", "1", "enable", "enabled"))
+_FALSE = frozenset(("false", "no", "n", "off", "0", "disable", "disabled"))
+
+
+def converter(*types) -> Callable[[Converter], Converter]:
+    """Decorator to register a converter for annotations, later registrations replace earlier ones
+
+    Subclasses of a registered type use its converter too, unless they have their own.
+
+    Args:
+        *types: Annotations the converter handles
+    """
+    def decorator(func: Converter) -> Converter:
+        for annotation in types:
+            CONVERTERS[annotation] = func
+        return func
+
+    return decorator
+
+
+def find_converter(annotation) -> Optional[Converter]:
+    """Converter for an annotation, None when the raw string is passed as is
+
+    Args:
+        annotation: Parameter annotation, already resolved if it was a string
+
+    Returns:
+        Converter: The converter
+    """
+    if annotation is inspect.Parameter.empty or annotation is str or annotation is Any:
+        return None
+    # Optional[X] and X | None convert to X
+    if typing.get_origin(annotation) in (typing.Union, UnionType):
+        options = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        return find_converter(options[0]) if options else None
+    for klass in getattr(annotation, "__mro__", (annotation,)):
+        func = CONVERTERS.get(klass)
+        if func is not None:
+            return func
+    if callable(annotation):
+        return lambda ctx, value, annotation: annotation(value)
+    raise TypeError(f"Parameter annotation {annotation!r} must be callable")
+
+
+def tokenize(text: str) -> list[tuple[str, int]]:
+    """Split arguments on whitespace, keeping double or single quoted parts together
+
+    A quote only opens at the start of a word, so don't and it's stay as they are.
+    Inside quotes a backslash escapes the quote. Unterminated quotes are taken literally.
+
+    Args:
+        text (str): The arguments
+
+    Returns:
+        list[tuple[str, int]]: Each token and where the text after it starts
+    """
+    tokens = []
+    index, length = 0, len(text)
+    while index < length:
+        char = text[index]
+        if char.isspace():
+            index += 1
+            continue
+        if char in _QUOTES:
+            quoted = _quoted(text, index)
+            if quoted is not None:
+                tokens.append(quoted)
+                index = quoted[1]
+                continue
+        end = index
+        while end < length and not text[end].isspace():
+            end += 1
+        tokens.append((text[index:end], end))
+        index = end
+    return tokens
+
+
+def _quoted(text: str, start: int) -> Optional[tuple[str, int]]:
+    # The quoted token starting at start, None if the quote isn't closed at the end of a word
+    quote = text[start]
+    parts = []
+    index = start + 1
+    while True:
+        found = text.find(quote, index)
+        if found == -1:
+            return None
+        if text[found - 1] == "\\":
+            parts.append(text[index:found - 1] + quote)
+            index = found + 1
+            continue
+        parts.append(text[index:found])
+        end = found + 1
+        if end < len(text) and not text[end].isspace():
+            return None
+        return "".join(parts), end
+
+
+def parse_id(value: str) -> Optional[int]:
+    """ID out of a raw id or a user, role or channel mention
+
+    Args:
+        value (str): The argument
+
+    Returns:
+        int: The id, None if there isn't one
+    """
+    match = _ID.fullmatch(value.strip())
+    if match is None:
+        return None
+    return int(match.group(1) or match.group(2))
+
+
+def parse_duration(value: str) -> timedelta:
+    """Duration like 90, 1h30m or 2d 4h, plain numbers are seconds
+
+    Args:
+        value (str): The argument
+
+    Raises:
+        ValueError: Not a duration
+
+    Returns:
+        timedelta: The duration
+    """
+    value = value.strip()
+    try:
+        return timedelta(seconds=float(value))
+    except ValueError:
+        pass
+    matches = list(_DURATION.finditer(value))
+    if not matches or "".join(match.group(0) for match in matches).replace(" ", "") != value.replace(" ", ""):
+        raise ValueError(f"{value!r} is not a duration")
+    return timedelta(seconds=sum(float(amount) * _UNITS[unit.lower()] for amount, unit in (match.groups() for match in matches)))
+
+
+def _require_id(value: str, kind: str) -> int:
+    id = parse_id(value)
+    if id is None:
+        raise ValueError(f"{value!r} is not a valid {kind} mention or ID")
+    return id
+
+
+@converter(int)
+def _convert_int(ctx: Context, value: str, annotation) -> int:
+    return int(value)
+
+
+@converter(Snowflake)
+def _convert_snowflake(ctx: Context, value: str, annotation) -> Snowflake:
+    return Snowflake(_require_id(value, "snowflake"))
+
+
+@converter(bool)
+def _convert_bool(ctx: Context, value: str, annotation) -> bool:
+    lowered = value.lower()
+    if lowered in _TRUE:
+        return True
+    if lowered in _FALSE:
+        return False
+    raise ValueError(f"{value!r} is not a yes or no")
+
+
+@converter(timedelta)
+def _convert_duration(ctx: Context, value: str, annotation) -> timedelta:
+    return parse_duration(value)
+
+
+@converter(User)
+def _convert_user(ctx: Context, value: str, annotation):
+    user_id = _require_id(value, "user")
+    user = ctx.bot.fetch_user(user_id)
+    if user is not None:
+        return user
+    return _get_user(ctx, user_id)
+
+
+async def _get_user(ctx: Context, user_id: int) -> User:
+    user = await ctx.bot.get_user(str(user_id))
+    if user is None:
+        raise ValueError(f"No user with ID {user_id}")
+    return user
+
+
+@converter(Member)
+def _convert_member(ctx: Context, value: str, annotation):
+    user_id = _require_id(value, "member")
+    guild = ctx.guild
+    if guild is None:
+        raise ValueError("Members can only be converted in guilds")
+    member = guild.fetch_member(user_id)
+    if member is not None:
+        return member
+    return _get_member(ctx, guild, user_id)
+
+
+async def _get_member(ctx: Context, guild, user_id: int) -> Member:
+    data = await ctx.http.request("get", f"/guilds/{guild.id}/members/{user_id}")
+    if data is None:
+        raise ValueError(f"No member with ID {user_id}")
+    return guild.members.merge(data)
+
+
+@converter(Messageable)
+def _convert_channel(ctx: Context, value: str, annotation):
+    channel_id = _require_id(value, "channel")
+    channel = ctx.bot.fetch_channel(channel_id)
+    if channel is not None:
+        return _check_channel(channel, annotation)
+    return _get_channel(ctx, channel_id, annotation)
+
+
+async def _get_channel(ctx: Context, channel_id: int, annotation) -> Messageable:
+    data = await ctx.http.request("get", f"/channels/{channel_id}")
+    if data is None:
+        raise ValueError(f"No channel with ID {channel_id}")
+    return _check_channel(Convert(data, ctx.bot), annotation)
+
+
+def _check_channel(channel: Messageable, annotation) -> Messageable:
+    if not isinstance(channel, annotation):
+        raise ValueError(f"Channel {channel.id} is not a {annotation.__name__}")
+    return channel
+
+
+@converter(Role)
+def _convert_role(ctx: Context, value: str, annotation) -> Role:
+    guild = ctx.guild
+    if guild is None:
+        raise ValueError("Roles can only be converted in guilds")
+    # Roles come with the guild, so there's no API call, names work too
+    role_id = parse_id(value)
+    for role in guild.roles:
+        if role.id == role_id or (role_id is None and role.name == value):
+            return role
+    raise ValueError(f"No role {value!r} in {guild.name}")
+
+
+class Argument:
+    """One parameter of a command and how to fill it"""
+    __slots__ = ("name", "kind", "converter", "annotation")
+
+    def __init__(self, param: inspect.Parameter):
+        self.name = param.name
+        self.kind = param.kind
+        self.annotation = param.annotation
+        self.converter: Optional[Converter] = find_converter(param.annotation)
+
+
+class ArgumentPlan:
+    """How a command's arguments are bound, worked out once from its signature when the command is made
+
+    Binding tokenizes the arguments, converts what it can straight away (ints, cached users and
+    channels...) and runs every lookup that needs the API at the same time. The same argument
+    given twice is only looked up once.
+    """
+    __slots__ = ("arguments",)
+
+    def __init__(self, func: Callable):
+        try:
+            # Annotations are strings under from __future__ import annotations
+            signature = inspect.signature(func, eval_str=True)
+        except (NameError, TypeError):
+            signature = inspect.signature(func)
+        self.arguments: list[Argument] = [
+            Argument(param) for name, param in signature.parameters.items() if name not in ("ctx", "self")
+        ]
+
+    async def bind(self, ctx: Context, text: Optional[str]) -> tuple[list, dict]:
+        """Turn the arguments of a message into what the command is called with
+
+        Positional parameters take a token each, *args the remaining tokens and a keyword only
+        parameter the rest of the text as it was typed. Parameters without a token keep their default.
+
+        Args:
+            ctx (Context): The context
+            text (str): Everything after the command name
+
+        Raises:
+            ValueError: An argument couldn't be converted
+
+        Returns:
+            tuple[list, dict]: args and kwargs
+        """
+        args: list[Any] = []
+        kwargs: dict[str, Any] = {}
+        if not text:
+            return args, kwargs
+        tokens = tokenize(text)
+        position = 0
+        # Where each awaitable result goes, so the lookups can be gathered
+        pending: dict[tuple, Any] = {}
+        slots: list[tuple[Any, Any, tuple]] = []
+
+        def add(argument: Argument, value: str, target, key):
+            if argument.converter is not None:
+                cache_key = (argument.converter, argument.annotation, value)
+                if cache_key in pending:
+                    slots.append((target, key, cache_key))
+                    value = None
+                else:
+                    value = argument.converter(ctx, value, argument.annotation)
+                    if inspect.isawaitable(value):
+                        pending[cache_key] = value
+                        slots.append((target, key, cache_key))
+                        value = None
+            if isinstance(target, list):
+                target.append(value)
+            else:
+                target[key] = value
+
+        try:
+            for argument in self.arguments:
+                kind = argument.kind
+                if kind is inspect.Parameter.POSITIONAL_OR_KEYWORD or kind is inspect.Parameter.POSITIONAL_ONLY:
+                    if position >= len(tokens):
+                        break
+                    add(argument, tokens[position][0], args, len(args))
+                    position += 1
+                elif kind is inspect.Parameter.VAR_POSITIONAL:
+                    for token, _ in tokens[position:]:
+                        add(argument, token, args, len(args))
+                    position = len(tokens)
+                elif kind is inspect.Parameter.KEYWORD_ONLY:
+                    start = tokens[position - 1][1] if position else 0
+                    rest = text[start:].strip()
+                    if rest:
+                        add(argument, rest, kwargs, argument.name)
+                    position = len(tokens)
+        except BaseException:
+            # A later argument failed, lookups that were set up for earlier ones never get awaited
+            for value in pending.values():
+                close = getattr(value, "close", None)
+                if close is not None:
+                    close()
+                elif isinstance(value, asyncio.Future):
+                    value.cancel()
+            raise
+
+        if pending:
+            results = dict(zip(pending, await asyncio.gather(*pending.values())))
+            for target, key, cache_key in slots:
+                target[key] = results[cache_key]
+        return args, kwargs
@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import asyncio
+import importlib
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from ..models.base import Model
+
+if TYPE_CHECKING:
+    from .command import Context
+
+# Values for the executor= option of the command and event decorators
+EXECUTORS = ("thread", "process")
+
+
+def check_executor(executor: Optional[str], func: Callable):
+    """Validate the executor= option of a decorator
+
+    Args:
+        executor (str): None, "thread" or "process"
+        func (Callable): The decorated function
+
+    Raises:
+        ValueError: Unknown executor
+        Exception: Coroutines can't run in a pool
+    """
+    if executor is None:
+        return
+    if executor not in EXECUTORS:
+        raise ValueError(f"executor must be one of {', '.join(EXECUTORS)}, not {executor!r}")
+    if asyncio.iscoroutinefunction(func):
+        raise Exception("Functions run in an executor have to be regular functions, not coroutines")
+
+
+class ExecutorContext:
+    """What a command running in an executor gets instead of Context.
+
+    Plain values only, so it pickles into a process pool. Nothing in it can talk to discord,
+    return what should be replied instead and it's sent from the event loop.
+    """
+    __slots__ = (
+        "content", "command_content", "prefix", "alias", "command",
+        "message_id", "channel_id", "guild_id", "author_id",
+    )
+
+    def __init__(self, ctx: Context):
+        message = ctx.message
+        self.content: Optional[str] = ctx.content
+        self.command_content: Optional[str] = ctx.command_content
+        self.prefix: Optional[str] = ctx.prefix
+        self.alias: Optional[str] = ctx.alias
+        self.command: Optional[str] = ctx.command.name if ctx.command is not None else None
+        self.message_id: int = message.id
+        self.channel_id: Optional[int] = message.channel_id
+        self.guild_id: Optional[int] = getattr(message, "guild_id", None)
+        self.author_id: Optional[int] = message.author.id if message.author is not None else None
+
+
+def portable(value: Any) -> Any:
+    """Version of a value that can cross into a process, models become their payloads
+
+    Args:
+        value (Any): An argument
+
+    Returns:
+        Any: The value, with models (also inside lists, tuples and dicts) turned into dicts
+    """
+    if isinstance(value, Model):
+        return value.to_payload()
+    if isinstance(value, (list, tuple)):
+        items = [portable(item) for item in value]
+        return items if isinstance(value, list) else tuple(items)
+    if isinstance(value, dict):
+        return {key: portable(item) for key, item in value.items()}
+    return value
+
+
+# Functions resolved by processes, keyed by module and qualified name
+_resolved: dict[tuple[str, str], Callable] = {}
+
+
+def _resolve(module: str, qualname: str) -> Callable:
+    # Decorators leave a Command or a wrapper under the function's name, unwrap back to the function
+    func = _resolved.get((module, qualname))
+    if func is None:
+        func = importlib.import_module(module)
+        for part in qualname.split("."):
+            func = getattr(func, part)
+        func = getattr(func, "func", func)
+        func = getattr(func, "__wrapped__", func)
+        _resolved[(module, qualname)] = func
+    return func
+
+
+def _call(func: Callable | tuple[str, str], args: tuple, kwargs: dict) -> tuple[float, float, Any]:
+    # Runs in the pool, times are wall clock so they compare across processes
+    started = time.time()
+    if isinstance(func, tuple):
+        func = _resolve(*func)
+    result = func(*args, **kwargs)
+    return started, time.time(), result
+
+
+class PoolStats:
+    """Counters of one pool"""
+    __slots__ = ("submitted", "completed", "failed", "waited", "ran")
+
+    def __init__(self):
+        self.submitted: int = 0
+        self.completed: int = 0
+        self.failed: int = 0
+        # Total seconds spent queued and running, of the calls that finished
+        self.waited: float = 0.0
+        self.ran: float = 0.0
+
+
+class ExecutorPool:
+    """Thread and process pools for commands and listeners that would block the event loop.
+
+    Pools are only started the first time something runs in them. Functions sent to the process
+    pool have to be defined at module level, they're looked up by name on the other side.
+
+    Args:
+        thread_workers (int): Size of the thread pool, defaults to None for the concurrent.futures default
+        process_workers (int): Size of the process pool, defaults to None for the number of CPUs
+    """
+
+    def __init__(self, thread_workers: Optional[int] = None, process_workers: Optional[int] = None):
+        self.workers: dict[str, Optional[int]] = {"thread": thread_workers, "process": process_workers}
+        self._pools: dict[str, Executor] = {}
+        self._stats: dict[str, PoolStats] = {kind: PoolStats() for kind in EXECUTORS}
+
+    def pool(self, kind: str) -> Executor:
+        """The pool for an executor kind, started if it isn't yet
+
+        Args:
+            kind (str): "thread" or "process"
+
+        Returns:
+            Executor: The pool
+        """
+        pool = self._pools.get(kind)
+        if pool is None:
+            if kind == "thread":
+                pool = ThreadPoolExecutor(self.workers["thread"], thread_name_prefix="selfcord")
+            else:
+                pool = ProcessPoolExecutor(self.workers["process"])
+            self._pools[kind] = pool
+        return pool
+
+    async def run(self, kind: str, func: Callable, *args, **kwargs) -> Any:
+        """Run a function in a pool and wait for it without blocking the loop
+
+        Threads get the arguments as they are. For processes models are swapped for their
+        payloads and the function is sent by name.
+
+        Args:
+            kind (str): "thread" or "process"
+            func (Callable): The function
+
+        Returns:
+            Any: What the function returned
+        """
+        if kind == "process":
+            target = (func.__module__, func.__qualname__)
+            args, kwargs = portable(args), portable(kwargs)
+        else:
+            target = func
+        stats = self._stats[kind]
+        stats.submitted += 1
+        submitted = time.time()
+        loop = asyncio.get_running_loop()
+        try:
+            started, finished, result = await loop.run_in_executor(self.pool(kind), _call, target, args, kwargs)
+        except BaseException:
+            stats.failed += 1
+            raise
+        stats.completed += 1
+        stats.waited += max(started - submitted, 0.0)
+        stats.ran += finished - started
+        return result
+
+    def stats(self) -> dict[str, dict]:
+        """Queue metrics of both pools
+
+        Queued and running are worked out from the pool size, a pool runs its oldest calls first.
+
+        Returns:
+            dict: Per pool workers, submitted, completed, failed, pending, running, queued, and the average wait and run time in seconds
+        """
+        report = {}
+        for kind, stats in self._stats.items():
+            pool = self._pools.get(kind)
+            workers = pool._max_workers if pool is not None else self.workers[kind]
+            pending = stats.submitted - stats.completed - stats.failed
+            done = stats.completed or 1
+            report[kind] = {
+                "workers": workers,
+                "submitted": stats.submitted,
+                "completed": stats.completed,
+                "failed": stats.failed,
+                "pending": pending,
+                "running": min(pending, workers) if workers else pending,
+                "queued": max(pending - workers, 0) if workers else 0,
+                "wait_avg": stats.waited / done,
+                "run_avg": stats.ran / done,
+            }
+        return report
+
+    def shutdown(self, wait: bool = False):
+        """Stop the pools, calls that haven't started are cancelled
+
+        Args:
+            wait (bool): Whether to wait for running calls to finish
+        """
+        for pool in self._pools.values():
+            pool.shutdown(wait=wait, cancel_futures=True)
+        self._pools.clear()
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Optional
+
+from ..models.permissions import Permission
+
+if TYPE_CHECKING:
+    from ..bot import Bot
+    from ..models import Guild, Member, Messageable
+
+
+class PermissionResolver:
+    """Works out what a member can do in a guild channel.
+
+    Applies the role permissions, then the @everyone overwrite, role overwrites and the member's own
+    overwrite, same order discord does. Results are kept until a role, channel or member event
+    invalidates them, the gateway handlers take care of that.
+    """
+    __slots__ = ("bot", "_roles", "_base", "_channels")
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        # guild id -> role id -> permissions of that role
+        self._roles: dict[int, dict[int, int]] = {}
+        # guild id -> member id -> base permissions
+        self._base: dict[int, dict[int, Permission]] = {}
+        # guild id -> channel id -> member id -> resolved permissions
+        self._channels: dict[int, dict[int, dict[int, Permission]]] = {}
+
+    def _guild(self, guild_id: Optional[int]) -> Optional[Guild]:
+        return self.bot.fetch_guild(guild_id)
+
+    def _role_table(self, guild: Guild) -> dict[int, int]:
+        roles = self._roles.get(guild.id)
+        if roles is None:
+            roles = self._roles[guild.id] = {role.id: int(role.permissions or 0) for role in guild.roles}
+        return roles
+
+    def base(self, member: Member, guild: Guild) -> Permission:
+        """Guild wide permissions of a member, before channel overwrites
+
+        Args:
+            member (Member): The member
+            guild (Guild): Guild the member is in
+
+        Returns:
+            Permission: The permissions
+        """
+        cache = self._base.setdefault(guild.id, {})
+        permission = cache.get(member.id)
+        if permission is None:
+            permission = cache[member.id] = self._compute_base(member, guild)
+        return permission
+
+    def _compute_base(self, member: Member, guild: Guild) -> Permission:
+        if guild.owner_id == member.id:
+            return Permission.all()
+        roles = self._role_table(guild)
+        value = roles.get(guild.id, 0)
+        for role_id in member.roles:
+            value |= roles.get(role_id, 0)
+        if value & Permission.ADMINISTRATOR:
+            return Permission.all()
+        return Permission(value)
+
+    def resolve(self, member: Member, channel: Messageable) -> Permission:
+        """Permissions of a member in a channel
+
+        Args:
+            member (Member): The member
+            channel (Messageable): A channel of the member's guild
+
+        Returns:
+            Permission: The permissions, everything for channels outside guilds
+        """
+        guild = self._guild(channel.guild_id)
+        if guild is None:
+            return Permission.all()
+        cache = self._channels.setdefault(guild.id, {}).setdefault(channel.id, {})
+        permission = cache.get(member.id)
+        if permission is None:
+            permission = cache[member.id] = self._compute(member, channel, guild, self.base(member, guild))
+        return permission
+
+    def _compute(self, member: Member, channel: Messageable, guild: Guild, base: Permission) -> Permission:
+        if base.has(Permission.ADMINISTRATOR):
+            return base
+        value = int(base)
+        roles = set(member.roles)
+        everyone = None
+        member_overwrite = None
+        allow = deny = 0
+        # Role and user ids never collide, so the overwrite type doesn't need checking
+        for overwrite in channel.permission_overwrites:
+            if overwrite.id == guild.id:
+                everyone = overwrite
+            elif overwrite.id in roles:
+                allow |= overwrite.allow
+                deny |= overwrite.deny
+            elif overwrite.id == member.id:
+                member_overwrite = overwrite
+        # Plain ints here, so flags this library doesn't know about go through untouched
+        if everyone is not None:
+            value = (value & ~int(everyone.deny)) | int(everyone.allow)
+        value = (value & ~int(deny)) | int(allow)
+        if member_overwrite is not None:
+            value = (value & ~int(member_overwrite.deny)) | int(member_overwrite.allow)
+        # Can't do anything in a channel you can't see
+        if not value & Permission.VIEW_CHANNEL:
+            return Permission(0)
+        return Permission(value)
+
+    def has(self, member: Member, channel: Messageable, *permissions: int | str) -> bool:
+        """Check a member has every given permission in a channel
+
+        Args:
+            member (Member): The member
+            channel (Messageable): The channel
+            permissions (int | str): Flags or flag names
+
+        Returns:
+            bool: True if all of them are granted
+        """
+        return self.resolve(member, channel).has(*permissions)
+
+    def visible_channels(self, guild: Guild, member: Optional[Member] = None, permission: int | str = Permission.VIEW_CHANNEL) -> list[Messageable]:
+        """Channels of a guild a member has a permission in
+
+        Args:
+            guild (Guild): The guild
+            member (Member): The member, defaults to the client
+            permission (int | str): Permission to check, defaults to VIEW_CHANNEL
+
+        Returns:
+            list[Messageable]: The channels
+        """
+        member = member or guild.me
+        if member is None:
+            return []
+        return [channel for channel in guild.channels if self.resolve(member, channel).has(permission)]
+
+    def members_with(self, channel: Messageable, permission: int | str = Permission.VIEW_CHANNEL) -> list[Member]:
+        """Members of a channel's guild that have a permission in it
+
+        Args:
+            channel (Messageable): The channel
+            permission (int | str): Permission to check, defaults to VIEW_CHANNEL
+
+        Returns:
+            list[Member]: The members
+        """
+        guild = self._guild(channel.guild_id)
+        if guild is None:
+            return []
+        # Members with the same roles end up with the same permissions, unless they
+        # own the guild or the channel has an overwrite just for them
+        special = {overwrite.id for overwrite in channel.permission_overwrites}
+        special.add(guild.owner_id)
+        by_roles: dict[frozenset, bool] = {}
+        members = []
+        for member in guild.members:
+            if member.id in special:
+                allowed = self.resolve(member, channel).has(permission)
+            else:
+                key = frozenset(member.roles)
+                allowed = by_roles.get(key)
+                if allowed is None:
+                    base = self._compute_base(member, guild)
+                    allowed = by_roles[key] = self._compute(member, channel, guild, base).has(permission)
+            if allowed:
+                members.append(member)
+        return members
+
+    def invalidate_guild(self, guild_id: str | int):
+        """Forget everything resolved for a guild, for role and guild changes"""
+        guild_id = int(guild_id)
+        self._roles.pop(guild_id, None)
+        self._base.pop(guild_id, None)
+        self._channels.pop(guild_id, None)
+
+    def invalidate_channel(self, guild_id: Optional[str | int], channel_id: str | int):
+        """Forget what was resolved for a channel, for overwrite changes"""
+        if guild_id is not None:
+            self._channels.get(int(guild_id), {}).pop(int(channel_id), None)
+
+    def invalidate_member(self, guild_id: str | int, member_id: str | int):
+        """Forget what was resolved for a member, for role changes on the member"""
+        guild_id, member_id = int(guild_id), int(member_id)
+        self._base.get(guild_id, {}).pop(member_id, None)
+        for channel in self._channels.get(guild_id, {}).values():
+            channel.pop(member_id, None)
+
+    def clear(self):
+        self._roles.clear()
+        self._base.clear()
+        self._channels.clear()
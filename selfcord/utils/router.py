@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import re
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from ..bot import Bot
+    from .command import Command
+
+# Command names end at the first whitespace, "!eval\n```py" is still eval
+_WHITESPACE = re.compile(r"\s")
+# Marks the end of a prefix in the trie, no character can be None
+_END = None
+
+
+class Route:
+    """Where a message goes: the prefix and alias it used, the command and everything after the alias"""
+    __slots__ = ("prefix", "alias", "command", "extension", "arguments")
+
+    def __init__(self, prefix: str, alias: str, command: Command, extension, arguments: str):
+        self.prefix = prefix
+        self.alias = alias
+        self.command = command
+        # The Ext instance for extension commands, None for the bot's own
+        self.extension = extension
+        self.arguments = arguments
+
+    def __repr__(self) -> str:
+        return f"<Route prefix={self.prefix!r} alias={self.alias!r} command={self.command.name}>"
+
+
+class CommandRouter:
+    """Finds the command a message invokes in one pass over its start.
+
+    Prefixes are kept in a trie and every alias of the bot's and the extensions' commands in one
+    dict, both rebuilt only when commands, extensions or prefixes change. Aliases are matched
+    case insensitively against the word right after the prefix, prefixes are case sensitive.
+    """
+    __slots__ = ("bot", "_trie", "_aliases", "_stamp", "_prefixes", "_author", "accepted", "rejected_author", "rejected_prefix", "rejected_command")
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._trie: dict = {}
+        self._aliases: dict[str, tuple[str, Command, object]] = {}
+        self._stamp: Optional[tuple[int, int]] = None
+        self._prefixes: list[str] = []
+        # The one author allowed to run commands and its id as the payload has it
+        self._author: tuple[Optional[int], Optional[str]] = (None, None)
+        # Counters for filter, messages that may run a command and why the rest didn't
+        self.accepted: int = 0
+        self.rejected_author: int = 0
+        self.rejected_prefix: int = 0
+        self.rejected_command: int = 0
+
+    def _refresh(self):
+        bot = self.bot
+        stamp = (bot.commands.version, bot.extensions.version)
+        if stamp == self._stamp and bot.prefixes == self._prefixes:
+            return
+        trie: dict = {}
+        for prefix in bot.prefixes:
+            node = trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[_END] = prefix
+        # Same priority as before, the bot's commands win over extension commands and earlier ones over later ones
+        aliases: dict[str, tuple[str, Command, object]] = {}
+        for command in bot.commands:
+            for alias in command.aliases:
+                aliases.setdefault(alias.lower(), (alias, command, None))
+        for extension in bot.extensions:
+            for command in extension.commands:
+                for alias in command.aliases:
+                    aliases.setdefault(alias.lower(), (alias, command, extension.ext))
+        self._trie, self._aliases = trie, aliases
+        self._stamp, self._prefixes = stamp, list(bot.prefixes)
+
+    def prefix_lengths(self, content: str) -> list[int]:
+        """Lengths of every prefix the content starts with, shortest first
+
+        Args:
+            content (str): Message content
+
+        Returns:
+            list[int]: The lengths, empty if it doesn't start with a prefix
+        """
+        self._refresh()
+        node = self._trie
+        ends = []
+        for index, char in enumerate(content):
+            node = node.get(char)
+            if node is None:
+                break
+            if _END in node:
+                ends.append(index + 1)
+        return ends
+
+    def match(self, content: Optional[str]) -> Optional[Route]:
+        """Parse a message into its prefix, command and arguments
+
+        Args:
+            content (str): Message content
+
+        Returns:
+            Route: Where it goes, None if it doesn't invoke a command
+        """
+        if not content:
+            return None
+        # Longest prefix first, so "!!" isn't read as "!" followed by a command named "!..."
+        for end in reversed(self.prefix_lengths(content)):
+            space = _WHITESPACE.search(content, end)
+            stop = space.start() if space is not None else len(content)
+            entry = self._aliases.get(content[end:stop].lower())
+            if entry is not None:
+                alias, command, extension = entry
+                return Route(content[:end], alias, command, extension, content[stop:])
+        return None
+
+    def _allowed_author(self) -> Optional[str]:
+        # Same rules as Context.invoke, None lets anyone through
+        bot = self.bot
+        if bot.token_leader is not None:
+            author = bot.token_leader
+        elif not bot.userbot:
+            author = bot.user.id
+        else:
+            return None
+        if self._author[0] != author:
+            self._author = (author, str(author))
+        return self._author[1]
+
+    def filter(self, payload: dict) -> Optional[Route]:
+        """Route a raw MESSAGE_CREATE payload, rejecting it as early and cheaply as possible
+
+        Runs before any Message or Context exists. Authors that may not run commands are turned
+        away by id first, then anything that doesn't start with a prefix by a single lookup.
+
+        Args:
+            payload (dict): MESSAGE_CREATE payload
+
+        Returns:
+            Route: Where it goes, None if it can't run a command
+        """
+        author = self._allowed_author()
+        if author is not None:
+            sender = payload.get("author")
+            if sender is None or sender["id"] != author:
+                self.rejected_author += 1
+                return None
+        content = payload.get("content")
+        self._refresh()
+        if not content or content[0] not in self._trie:
+            self.rejected_prefix += 1
+            return None
+        route = self.match(content)
+        if route is None:
+            self.rejected_command += 1
+            return None
+        self.accepted += 1
+        return route
+
+    def stats(self) -> dict[str, int]:
+        """Counters of filter
+
+        Returns:
+            dict: accepted, rejected and the rejections by reason
+        """
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected_author + self.rejected_prefix + self.rejected_command,
+            "rejected_author": self.rejected_author,
+            "rejected_prefix": self.rejected_prefix,
+            "rejected_command": self.rejected_command,
+        }
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import signal
+import sys
+import time
+from typing import Awaitable, Callable, Optional
+
+# Runs in the worker process. Limits are set before the code is even read, the code comes in on stdin.
+# stderr is kept for reporting how the code ended, anything the code writes there goes to stdout.
+_WORKER = """
+import ast, asyncio, inspect, os, sys, traceback
+cpu, memory = float(sys.argv[1]), int(sys.argv[2])
+status = os.fdopen(os.dup(2), "w")
+os.dup2(1, 2)
+try:
+    import resource
+except ImportError:
+    resource = None
+if resource is not None:
+    if cpu > 0:
+        # SIGXCPU at the soft limit, SIGKILL a second later if it's caught
+        resource.setrlimit(resource.RLIMIT_CPU, (int(cpu + 0.999), int(cpu + 0.999) + 1))
+    if memory > 0:
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+source = sys.stdin.read()
+try:
+    code = compile(source, "<eval>", "exec", flags=ast.PyCF_ALLOW_TOP_LEVEL_AWAIT)
+    result = eval(code, {"__name__": "__eval__"})
+    if inspect.iscoroutine(result):
+        asyncio.run(result)
+except SystemExit:
+    raise
+except MemoryError:
+    sys.stdout.flush()
+    status.write("memory")
+    status.flush()
+    sys.exit(1)
+except BaseException:
+    traceback.print_exc()
+    sys.exit(1)
+"""
+
+# What the worker reports on stderr when it runs out of memory
+_OUT_OF_MEMORY = b"memory"
+# What the CPU rlimit kills with
+_CPU_SIGNALS = frozenset(getattr(signal, name) for name in ("SIGXCPU", "SIGKILL") if hasattr(signal, name))
+
+
+def _worker_env() -> dict[str, str]:
+    # Nothing from the bot's environment, tokens are often kept there
+    return {name: os.environ[name] for name in ("PATH", "SYSTEMROOT") if name in os.environ}
+
+
+class EvalResult:
+    """How a sandboxed eval went"""
+    __slots__ = ("output", "returncode", "reason", "elapsed", "truncated")
+
+    def __init__(self, output: str, returncode: Optional[int], reason: Optional[str], elapsed: float, truncated: bool):
+        self.output = output
+        self.returncode = returncode
+        # None when it exited by itself, otherwise "timeout", "cpu" or "memory"
+        self.reason = reason
+        self.elapsed = elapsed
+        # Whether the start of the output was dropped to stay under EvalSandbox.max_output
+        self.truncated = truncated
+
+    @property
+    def summary(self) -> str:
+        if self.reason == "timeout":
+            return f"Killed after the {self.elapsed:.1f}s wall clock limit"
+        if self.reason == "cpu":
+            return "Killed for going over the CPU time limit"
+        if self.reason == "memory":
+            return "Ran out of memory"
+        return f"Exited with {self.returncode} after {self.elapsed:.2f}s"
+
+
+class EvalSandbox:
+    """Runs eval code in a separate Python process with limits.
+
+    The worker gets none of the bot's state or environment, the code only has the standard library.
+    CPU time and memory are rlimits, so they're only enforced where the resource module exists (not Windows),
+    the wall clock limit is enforced everywhere, time spent streaming output doesn't count against it.
+    Output is stdout and stderr together.
+
+    Args:
+        cpu_time (float): Seconds of CPU time the code may use, defaults to 5
+        wall_time (float): Seconds before the worker is killed, defaults to 10
+        memory (int): Bytes of address space the worker may use, defaults to 256 MiB
+        max_output (int): Characters of output kept, older output is dropped first, defaults to 64 KiB
+        stream_interval (float): Minimum seconds between output updates, defaults to 1
+    """
+    __slots__ = ("cpu_time", "wall_time", "memory", "max_output", "stream_interval")
+
+    def __init__(
+        self,
+        cpu_time: float = 5.0,
+        wall_time: float = 10.0,
+        memory: int = 256 * 2**20,
+        max_output: int = 64 * 2**10,
+        stream_interval: float = 1.0,
+    ):
+        self.cpu_time = cpu_time
+        self.wall_time = wall_time
+        self.memory = memory
+        self.max_output = max_output
+        self.stream_interval = stream_interval
+
+    async def run(self, code: str, stream: Optional[Callable[[str], Awaitable]] = None) -> EvalResult:
+        """Run code in a worker and wait for it, the bot's loop keeps running meanwhile
+
+        Args:
+            code (str): The code, top level await works
+            stream (Callable, optional): Awaited with the output so far as it comes in, at most every stream_interval
+
+        Returns:
+            EvalResult: Output, exit code and why it stopped
+        """
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-I", "-u", "-c", _WORKER, str(self.cpu_time), str(self.memory),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=_worker_env(),
+        )
+        output = ""
+        truncated = False
+        status = b""
+        updated = asyncio.Event()
+
+        async def pump():
+            nonlocal output, truncated, status
+            process.stdin.write(code.encode())
+            await process.stdin.drain()
+            process.stdin.close()
+            while True:
+                data = await process.stdout.read(4096)
+                if not data:
+                    break
+                output += data.decode(errors="replace")
+                if len(output) > self.max_output:
+                    output = output[-self.max_output:]
+                    truncated = True
+                updated.set()
+            status = await process.stderr.read()
+            await process.wait()
+
+        async def forward():
+            # Streamed from its own task, so slow updates don't eat into the wall clock limit
+            while True:
+                await asyncio.sleep(self.stream_interval)
+                await updated.wait()
+                updated.clear()
+                await stream(output)
+
+        forwarder = asyncio.create_task(forward()) if stream is not None else None
+        reason = None
+        try:
+            await asyncio.wait_for(pump(), self.wall_time)
+        except asyncio.TimeoutError:
+            reason = "timeout"
+        finally:
+            # Also when the command itself was cancelled, don't leave the worker behind
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            if forwarder is not None:
+                forwarder.cancel()
+                try:
+                    await forwarder
+                except asyncio.CancelledError:
+                    pass
+        returncode = process.returncode
+        if reason is None:
+            if returncode < 0 and -returncode in _CPU_SIGNALS:
+                reason = "cpu"
+            elif status.strip() == _OUT_OF_MEMORY:
+                reason = "memory"
+        return EvalResult(output, returncode, reason, time.perf_counter() - started, truncated)
+
+
+def format_output(output: str, status: Optional[str] = None, limit: int = 1900) -> str:
+    """Output as a code block that fits a message, the end is kept since that's what's newest
+
+    Args:
+        output (str): The output
+        status (str, optional): Line added under the block
+        limit (int): Characters the output may take up, defaults to 1900
+
+    Returns:
+        str: The message content
+    """
+    if len(output) > limit:
+        output = "..." + output[-limit:]
+    # Keep the code block closed
+    output = output.replace("```", "`\u200b``")
+    content = f"```\n{output}\n```"
+    return f"{content}\n{status}" if status else content
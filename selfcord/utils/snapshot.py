@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import struct
+import time
+from typing import TYPE_CHECKING, Optional
+
+import ujson
+
+from ..models import Convert, Guild
+from .logging import logging
+
+if TYPE_CHECKING:
+    from ..bot import Bot
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"SCSNAP"
+# 1 was a record per guild with an index, 2 one JSON document that had to be decoded in one go
+VERSION = 3
+# magic and version, then one JSON record per line
+HEADER = struct.Struct("<6sH")
+# Users, channels or members per record, so no record takes long to decode on the loop
+RECORD_SIZE = 1000
+
+
+def snapshot_payloads(bot: Bot) -> dict:
+    """Everything a snapshot holds, as payloads
+
+    to_payload builds new dicts and lists, and raw parts are only ever replaced rather than
+    changed in place, so the result can be encoded in another thread while the bot keeps running.
+
+    Args:
+        bot (Bot): The bot
+
+    Returns:
+        dict: user_id, users, relationships, private_channels and guilds
+    """
+    return {
+        "user_id": bot.user.id,
+        "users": [user.to_payload() for user in bot.cached_users.values() if user is not bot.user],
+        "relationships": {
+            "friends": [user.id for user in bot.user.friends],
+            "blocked": [user.id for user in bot.user.blocked],
+        },
+        "private_channels": [channel.to_payload() for channel in bot.user.private_channels],
+        "guilds": [guild.to_payload() for guild in bot.cached_guilds.values()],
+    }
+
+
+async def collect_snapshot(bot: Bot, batch_size: int = 500) -> dict:
+    """Same as snapshot_payloads, but yields to the event loop every batch_size objects
+
+    Args:
+        bot (Bot): The bot
+        batch_size (int): Users, channels or guild members to dump between yields
+
+    Returns:
+        dict: The payloads, see snapshot_payloads
+    """
+    done = 0
+
+    async def tick(count: int = 1):
+        nonlocal done
+        done += count
+        if done >= batch_size:
+            done = 0
+            await asyncio.sleep(0)
+
+    users = []
+    for user in list(bot.cached_users.values()):
+        if user is not bot.user:
+            users.append(user.to_payload())
+        await tick()
+    private_channels = []
+    for channel in list(bot.user.private_channels):
+        private_channels.append(channel.to_payload())
+        await tick()
+    guilds = []
+    for guild in list(bot.cached_guilds.values()):
+        guilds.append(guild.to_payload())
+        await tick(1 + len(guild.members))
+    return {
+        "user_id": bot.user.id,
+        "users": users,
+        "relationships": {
+            "friends": [user.id for user in bot.user.friends],
+            "blocked": [user.id for user in bot.user.blocked],
+        },
+        "private_channels": private_channels,
+        "guilds": guilds,
+    }
+
+
+def encode_snapshot(payloads: dict) -> bytes:
+    """Serialize payloads from snapshot_payloads or collect_snapshot into the snapshot format.
+
+    After the header every line is a JSON record. The first one has the account and the
+    relationships, the rest are ["users", [...]], ["private_channels", [...]], ["guild", {...}]
+    and ["members", guild_id, [...]] records of at most RECORD_SIZE objects each, so loading
+    can decode them one at a time. Pure, so it can run in an executor.
+
+    Args:
+        payloads (dict): The payloads
+
+    Returns:
+        bytes: The snapshot
+    """
+    lines = [ujson.dumps({
+        "user_id": payloads["user_id"],
+        "created_at": time.time(),
+        "relationships": payloads["relationships"],
+    })]
+
+    def records(*key, items: list):
+        for start in range(0, len(items), RECORD_SIZE):
+            lines.append(ujson.dumps([*key, items[start:start + RECORD_SIZE]]))
+
+    records("users", items=payloads["users"])
+    records("private_channels", items=payloads["private_channels"])
+    for guild in payloads["guilds"]:
+        lines.append(ujson.dumps(["guild", {key: value for key, value in guild.items() if key != "members"}]))
+        records("members", guild["id"], items=guild.get("members", []))
+    # JSON escapes newlines in strings, so they only ever separate records
+    return HEADER.pack(MAGIC, VERSION) + "\n".join(lines).encode()
+
+
+def dump_snapshot(bot: Bot) -> bytes:
+    """Serialize the bot's cache into the snapshot format in one go, see encode_snapshot
+
+    Args:
+        bot (Bot): The bot
+
+    Returns:
+        bytes: The snapshot
+    """
+    return encode_snapshot(snapshot_payloads(bot))
+
+
+def save_snapshot(path: str, payloads: dict):
+    """Encode and write a snapshot, what Bot.save_snapshot runs in an executor
+
+    Args:
+        path (str): Path of the snapshot file
+        payloads (dict): Payloads from collect_snapshot
+    """
+    write_snapshot(path, encode_snapshot(payloads))
+
+
+def write_snapshot(path: str, data: bytes):
+    """Write a snapshot, replacing the old one only once the new one is complete
+
+    Args:
+        path (str): Path of the snapshot file
+        data (bytes): Snapshot from dump_snapshot
+    """
+    temp = f"{path}.tmp"
+    with open(temp, "wb") as file:
+        file.write(data)
+    os.replace(temp, path)
+
+
+def read_snapshot(path: str, user_id: int) -> Optional[tuple[dict, list[bytes]]]:
+    """Read a snapshot file and split it into records, what load_snapshot runs in an executor
+
+    Args:
+        path (str): Path of the snapshot file
+        user_id (int): ID of the client, snapshots of other accounts are skipped
+
+    Returns:
+        tuple[dict, list[bytes]]: The first record and the rest still encoded, None for missing, stale or foreign snapshots
+    """
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    magic, version = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        log.warning(f"Ignoring snapshot {path}, unknown format")
+        return None
+    records = data[HEADER.size:].split(b"\n")
+    head = ujson.loads(records[0])
+    if head["user_id"] != user_id:
+        log.warning(f"Ignoring snapshot {path}, it belongs to another account")
+        return None
+    return head, records[1:]
+
+
+async def load_snapshot(bot: Bot, path: str, batch_size: int = 500) -> bool:
+    """Fill the bot's cache from a snapshot, meant to run before IDENTIFY
+
+    The file is read in an executor, its records are then decoded and hydrated one at a time
+    on the loop, yielding every batch_size objects. Guild emojis, stickers and roles still only
+    decode when they're first read, like after READY. Members READY doesn't confirm are dropped
+    once READY_SUPPLEMENTAL is in.
+
+    Args:
+        bot (Bot): The bot, bot.user has to be set already
+        path (str): Path of the snapshot file
+        batch_size (int): Users, channels or guild members to hydrate between yields
+
+    Returns:
+        bool: Whether the snapshot was loaded, missing, stale or foreign snapshots are skipped
+    """
+    snapshot = await asyncio.get_running_loop().run_in_executor(None, read_snapshot, path, bot.user.id)
+    if snapshot is None:
+        return False
+    head, records = snapshot
+    done = 0
+
+    async def tick(count: int):
+        nonlocal done
+        done += count
+        if done >= batch_size:
+            done = 0
+            await asyncio.sleep(0)
+
+    # Written in the same order as READY, users first since everything else references them by id
+    for record in records:
+        kind, *record = ujson.loads(record)
+        if kind == "users":
+            for user in record[0]:
+                bot.store_user(user)
+            await tick(len(record[0]))
+        elif kind == "private_channels":
+            for channel in record[0]:
+                channel = Convert(channel, bot)
+                bot.user.private_channels.append(channel)
+                bot.cached_channels[channel.id] = channel
+            await tick(len(record[0]))
+        elif kind == "guild":
+            guild = Guild(record[0], bot)
+            bot.cached_guilds[guild.id] = guild
+            await tick(1)
+        elif kind == "members":
+            guild_id, members = record
+            guild = bot.fetch_guild(guild_id)
+            for member in members:
+                guild.members.merge(member)
+            await tick(len(members))
+    relationships = head["relationships"]
+    bot.user.friends = [user for user in map(bot.fetch_user, relationships["friends"]) if user is not None]
+    bot.user.blocked = [user for user in map(bot.fetch_user, relationships["blocked"]) if user is not None]
+    log.info(f"Loaded snapshot {path} from {time.time() - head['created_at']:.0f}s ago")
+    return True
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import sys
+from types import FunctionType, ModuleType
+from typing import TYPE_CHECKING, Any, Iterable, Optional
+
+from ..models import MemberCollection
+
+if TYPE_CHECKING:
+    from ..bot import Bot
+    from ..models import Guild
+
+# Above this many items a collection is sized from an even sample and scaled up
+SAMPLE_SIZE = 1000
+
+# Top level parts of the report, in report order
+SECTIONS = ("users", "guilds", "channels", "messages", "deleted_messages")
+
+# Per guild parts, in report order
+GUILD_PARTS = ("members", "channels", "roles", "emojis", "stickers")
+
+
+def _slot_names(cls: type) -> list[str]:
+    names = []
+    for klass in cls.__mro__:
+        slots = klass.__dict__.get("__slots__", ())
+        names.extend((slots,) if isinstance(slots, str) else slots)
+    return names
+
+
+def deep_sizeof(obj: Any, seen: set[int]) -> int:
+    """Approximate size of an object and everything it references, in bytes
+
+    Objects already in seen are skipped, so sharing one set across calls counts shared
+    objects (users behind members, interned strings) only once. Put the bot's id in it
+    up front so models don't walk into it.
+
+    Args:
+        obj (Any): Object to size
+        seen (set[int]): ids of objects that are already counted, updated in place
+
+    Returns:
+        int: Approximate size in bytes
+    """
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, ModuleType, FunctionType)):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            for name in _slot_names(type(obj)):
+                value = getattr(obj, name, None) if name != "__weakref__" else None
+                if value is not None:
+                    stack.append(value)
+            if hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+    return size
+
+
+def size_items(items: Iterable, count: int, seen: set[int]) -> int:
+    """Size every item of a collection, sampling big ones
+
+    Args:
+        items (Iterable): The items
+        count (int): How many there are
+        seen (set[int]): Shared seen set, see deep_sizeof
+
+    Returns:
+        int: Approximate size in bytes
+    """
+    if count <= SAMPLE_SIZE:
+        return sum(deep_sizeof(item, seen) for item in items)
+    step = count / SAMPLE_SIZE
+    picks = {int(index * step) for index in range(SAMPLE_SIZE)}
+    sampled = 0
+    for index, item in enumerate(items):
+        if index in picks:
+            sampled += deep_sizeof(item, seen)
+        else:
+            # Already accounted for by the estimate, whatever holds the collection shouldn't walk into it
+            seen.add(id(item))
+    return int(sampled * count / len(picks))
+
+
+def _guild_part(guild: Guild, name: str) -> list:
+    # Lazy parts are measured as their raw payload when they haven't been decoded, sizing shouldn't decode
+    try:
+        return object.__getattribute__(guild, name)
+    except AttributeError:
+        return (guild._payload or {}).get(name, [])
+
+
+def _size_members(guild: Guild, seen: set[int]) -> int:
+    members = guild.members
+    if isinstance(members, MemberCollection):
+        return sys.getsizeof(members.members) + size_items(members.members.values(), len(members), seen)
+    # Columnar members are only arrays, iterating would build views that aren't stored anywhere
+    return deep_sizeof(members, seen)
+
+
+def collect_cache_stats(bot: Bot, top: int = 5) -> dict:
+    """Count and size everything the bot caches, see Bot.cache_stats
+
+    Args:
+        bot (Bot): The bot
+        top (int): How many of the biggest guilds to list
+
+    Returns:
+        dict: The report
+    """
+    seen: set[int] = {id(bot)}
+    stats: dict[str, Any] = {}
+    # Users first, so members only count what isn't shared with the user cache
+    users = bot.cached_users
+    stats["users"] = {"count": len(users), "bytes": size_items(users.values(), len(users), seen)}
+
+    # Guild channels count toward their guild, the channels section is what's left (DMs and groups)
+    guilds = []
+    for guild in bot.cached_guilds.values():
+        entry = {"id": guild.id, "name": guild.name, "bytes": 0}
+        for part in GUILD_PARTS:
+            if part == "members":
+                count, size = len(guild.members), _size_members(guild, seen)
+            else:
+                items = _guild_part(guild, part)
+                count, size = len(items), size_items(items, len(items), seen)
+            entry[part] = {"count": count, "bytes": size}
+            entry["bytes"] += size
+        entry["bytes"] += deep_sizeof(guild, seen)
+        guilds.append(entry)
+    stats["guilds"] = {"count": len(guilds), "bytes": sum(entry["bytes"] for entry in guilds)}
+
+    for name, items in (
+        ("channels", bot.cached_channels),
+        ("messages", bot.cached_messages.messages),
+        ("deleted_messages", bot.deleted_messages.messages),
+    ):
+        stats[name] = {"count": len(items), "bytes": size_items(items.values(), len(items), seen)}
+    stats["total_bytes"] = sum(stats[name]["bytes"] for name in SECTIONS)
+    stats["top_guilds"] = sorted(guilds, key=lambda entry: entry["bytes"], reverse=True)[:top]
+    return stats
+
+
+def cache_growth(stats: dict, previous: Optional[dict]) -> dict:
+    """Change in counts and sizes between two reports
+
+    Args:
+        stats (dict): The new report
+        previous (dict): The report before it, None for the first one
+
+    Returns:
+        dict: Section name to count and bytes change, plus total_bytes
+    """
+    growth = {}
+    for name in SECTIONS:
+        before = previous[name] if previous is not None else {"count": 0, "bytes": 0}
+        growth[name] = {
+            "count": stats[name]["count"] - before["count"],
+            "bytes": stats[name]["bytes"] - before["bytes"],
+        }
+    growth["total_bytes"] = stats["total_bytes"] - (previous["total_bytes"] if previous is not None else 0)
+    return growth
+
+
+def _mib(size: int) -> str:
+    return f"{size / 2**20:.1f} MiB"
+
+
+def format_cache_stats(stats: dict) -> str:
+    """Human readable version of a report, used by the cachestats command
+
+    Args:
+        stats (dict): Report from Bot.cache_stats
+
+    Returns:
+        str: The report
+    """
+    growth = stats["growth"]
+    lines = [f"Cache: {_mib(stats['total_bytes'])} ({growth['total_bytes'] / 2**20:+.1f} MiB)"]
+    for name in SECTIONS:
+        lines.append(
+            f"  {name}: {stats[name]['count']} ({growth[name]['count']:+}), {_mib(stats[name]['bytes'])}"
+        )
+    if stats["top_guilds"]:
+        lines.append("Biggest guilds:")
+    for entry in stats["top_guilds"]:
+        parts = ", ".join(f"{part} {entry[part]['count']}/{_mib(entry[part]['bytes'])}" for part in GUILD_PARTS)
+        lines.append(f"  {entry['name']} ({entry['id']}): {_mib(entry['bytes'])} - {parts}")
+    return "\n".join(lines)
@@ -0,0 +1,97 @@
+import pytest
+
+import selfcord
+from selfcord.api.events import Handler
+
+CLIENT_ID = "100000000000000000"
+
+
+def make_ready_payloads(guild_count: int, member_count: int, shared_users: int = 0):
+    """Build synthetic READY and READY_SUPPLEMENTAL payloads.
+
+    Args:
+        guild_count (int): Amount of guilds in the payloads
+        member_count (int): Members per guild, excluding the client
+        shared_users (int): Size of a user pool shared by every guild, so the same users show up in many guilds. 0 means every member is unique.
+
+    Returns:
+        tuple[dict, dict]: READY and READY_SUPPLEMENTAL data
+    """
+    guilds = []
+    ready_members = []
+    extra_members = []
+    presences = []
+    for g in range(guild_count):
+        guild_id = str(200000000000000000 + g)
+        guilds.append({
+            "id": guild_id,
+            "member_count": member_count + 1,
+            "properties": {"id": guild_id, "name": f"guild {g}", "owner_id": CLIENT_ID},
+            "roles": [{"id": guild_id, "name": "@everyone", "permissions": "1071698660929", "position": 0}],
+            "channels": [],
+            "emojis": [],
+            "stickers": [],
+        })
+        ready_members.append([
+            {"user_id": CLIENT_ID, "roles": [], "joined_at": "2023-01-01T00:00:00+00:00"}
+        ])
+        members = []
+        guild_presences = []
+        for m in range(member_count):
+            n = (g * member_count + m) % shared_users if shared_users else g * member_count + m
+            user_id = str(300000000000000000 + n)
+            members.append({
+                "user_id": user_id,
+                "roles": [guild_id],
+                "joined_at": "2023-01-01T00:00:00+00:00",
+                "nick": None,
+                "deaf": False,
+                "mute": False,
+            })
+            if m % 10 == 0:
+                guild_presences.append({
+                    "user_id": user_id,
+                    "status": "online",
+                    "client_status": {"desktop": "online"},
+                    "activities": [],
+                    "broadcast": None,
+                })
+        # The client shows up in both payloads, discord sends it twice
+        members.append({"user_id": CLIENT_ID, "roles": [], "joined_at": "2023-01-01T00:00:00+00:00"})
+        extra_members.append(members)
+        presences.append(guild_presences)
+
+    ready = {
+        "resume_gateway_url": "wss://gateway.discord.gg",
+        "session_id": "session",
+        "guilds": guilds,
+        "merged_members": ready_members,
+        "private_channels": [],
+        "users": [],
+        "relationships": [],
+    }
+    supplemental = {
+        "guilds": [{"id": guild["id"], "voice_states": [], "embedded_activities": []} for guild in guilds],
+        "merged_members": extra_members,
+        "merged_presences": {"guilds": presences, "friends": []},
+    }
+    return ready, supplemental
+
+
+@pytest.fixture
+def ready_payloads():
+    """Factory fixture for synthetic READY/READY_SUPPLEMENTAL payloads, see make_ready_payloads"""
+    return make_ready_payloads
+
+
+@pytest.fixture
+def bot():
+    bot = selfcord.Bot(prefixes=["!"])
+    bot.user = selfcord.Client({"id": CLIENT_ID, "username": "client", "discriminator": "0"}, bot)
+    bot.cached_users[bot.user.id] = bot.user
+    return bot
+
+
+@pytest.fixture
+def handler(bot):
+    return Handler(bot)
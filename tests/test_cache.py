@@ -0,0 +1,110 @@
+import pytest
+
+import selfcord
+from selfcord.utils import MessageCache, MessageCachePolicy
+
+
+def make_message(bot, message_id: int, channel_id: str = "1", content: str = "hi"):
+    return selfcord.Message(
+        {"id": str(message_id), "channel_id": channel_id, "content": content, "author": {"id": "2", "username": "a"}},
+        bot,
+    )
+
+
+class Test_message_cache:
+    def test_lru_eviction(self, bot):
+        cache = MessageCache(MessageCachePolicy(max_messages=3))
+        for i in range(3):
+            cache[str(i)] = make_message(bot, i)
+        # Touching 0 makes 1 the least recently used
+        assert cache.get("0") is not None
+        cache["3"] = make_message(bot, 3)
+        assert "1" not in cache
+        assert list(cache) == [2, 0, 3]
+        assert cache.stats()["evictions"] == 1
+        assert cache.get("1") is None
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_per_channel_and_bytes(self, bot):
+        cache = MessageCache(MessageCachePolicy(max_messages=None, per_channel=2))
+        for i in range(5):
+            cache[str(i)] = make_message(bot, i, channel_id="10")
+        cache["10"] = make_message(bot, 10, channel_id="11")
+        assert list(cache) == [3, 4, 10]
+
+        cache = MessageCache(MessageCachePolicy(max_messages=None, max_bytes=5000))
+        for i in range(10):
+            cache[str(i)] = make_message(bot, i, content="x" * 1000)
+        assert 0 < cache.bytes <= 5000
+        assert len(cache) < 10
+
+    def test_max_age(self, bot, monkeypatch):
+        now = [0.0]
+        monkeypatch.setattr("selfcord.utils.cache.time.monotonic", lambda: now[0])
+        cache = MessageCache(MessageCachePolicy(max_age=10))
+        cache["1"] = make_message(bot, 1)
+        now[0] = 11.0
+        assert cache.get("1") is None
+        cache["2"] = make_message(bot, 2)
+        assert len(cache) == 1
+
+
+class FakeMessagesEndpoint:
+    """Answers GET /channels/<id>/messages from a list of message ids"""
+
+    def __init__(self, channel_id: str, ids: range):
+        self.channel_id = channel_id
+        self.ids = sorted(ids, reverse=True)
+        self.requests = []
+
+    async def request(self, method, endpoint, *args, **kwargs):
+        self.requests.append(endpoint)
+        query = dict(part.split("=") for part in endpoint.split("?")[1].split("&"))
+        before = int(query.get("before", 1 << 63))
+        ids = [i for i in self.ids if i < before][: int(query["limit"])]
+        return [
+            {"id": str(i), "channel_id": self.channel_id, "content": "", "author": {"id": "2", "username": "a"}}
+            for i in ids
+        ]
+
+
+class Test_channel_history:
+    def test_cached_history(self, bot):
+        channel = selfcord.DMChannel({"id": "1", "type": 1}, bot)
+        bot.cached_channels[channel.id] = channel
+        for i in (5, 1, 3, 2, 4):
+            bot.cached_messages[str(i)] = make_message(bot, i)
+        assert [m.id for m in channel.cached_history()] == [5, 4, 3, 2, 1]
+        assert [m.id for m in channel.cached_history(before=4, after=1)] == [3, 2]
+        assert [m.id for m in channel.cached_history(limit=2)] == [5, 4]
+
+    @pytest.mark.asyncio
+    async def test_history_fills_gaps(self, bot):
+        endpoint = FakeMessagesEndpoint("1", range(1000, 1250))
+        bot.http.request = endpoint.request
+        channel = selfcord.DMChannel({"id": "1", "type": 1, "last_message_id": "1249"}, bot)
+
+        msgs = await channel.history(150)
+        assert [int(m.id) for m in msgs] == list(range(1249, 1099, -1))
+        assert len(endpoint.requests) == 2
+
+        endpoint.requests.clear()
+        msgs = await channel.history(200)
+        assert [int(m.id) for m in msgs] == list(range(1249, 1049, -1))
+        assert endpoint.requests == ["/channels/1/messages?limit=50&before=1100"]
+
+        # A gateway message right after the newest one keeps the cache usable
+        new = make_message(bot, 1250)
+        bot.cached_messages.add(new.id, new, channel.last_message_id)
+        channel.last_message_id = new.id
+        endpoint.requests.clear()
+        msgs = await channel.history(10)
+        assert msgs[0].id == 1250
+        assert endpoint.requests == []
+
+        # Reaching the start of the channel is remembered too
+        msgs = await channel.history(500)
+        assert len(msgs) == 251
+        endpoint.requests.clear()
+        assert len(await channel.history(500)) == 251
+        assert endpoint.requests == []
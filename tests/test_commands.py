@@ -0,0 +1,255 @@
+import asyncio
+import gc
+import sys
+import warnings
+from datetime import timedelta
+
+import pytest
+
+import selfcord
+from selfcord.utils import Extension, tokenize
+
+from .conftest import CLIENT_ID
+
+
+def shout(ctx, word: selfcord.User, times: int):
+    # Module level so the process pool can find it
+    return f"{ctx.command} {word['username'].upper() * times}"
+
+
+def make_message(bot, content: str, author_id: str = CLIENT_ID):
+    return selfcord.Message(
+        {"id": "1", "channel_id": "2", "content": content, "author": {"id": author_id, "username": "a"}},
+        bot,
+    )
+
+
+class Test_command_router:
+    def test_match(self, bot):
+        bot.prefixes = ["!", "!!", "s."]
+
+        @bot.cmd(aliases=["h", "Hi"])
+        async def hello(ctx, name):
+            pass
+
+        route = bot.router.match("!HI there  world")
+        assert route.command is hello and route.prefix == "!" and route.alias == "Hi"
+        assert route.arguments == " there  world"
+        assert bot.router.match("!!hello").prefix == "!!"
+        assert bot.router.match("s.h\nline").arguments == "\nline"
+        # Whole words only, and prefixes are case sensitive
+        assert bot.router.match("!hellothere") is None
+        assert bot.router.match("S.hello") is None
+        assert bot.router.match("hello") is None and bot.router.match("") is None
+
+        ctx = selfcord.Context(make_message(bot, "!h bob"), bot)
+        assert (ctx.prefix, ctx.alias, ctx.command, ctx.command_content) == ("!", "h", hello, " bob")
+        assert selfcord.Context(make_message(bot, "!nothing"), bot).prefix == "!"
+
+    def test_rebuilds_on_change(self, bot):
+        assert bot.router.match("!later") is None
+
+        @bot.cmd()
+        async def later(ctx):
+            pass
+
+        assert bot.router.match("!later").command is later
+        bot.prefixes.append("?")
+        assert bot.router.match("?later").command is later
+        bot.commands.remove(later)
+        assert bot.router.match("!later") is None
+
+        class Ext(selfcord.Extender, name="ext"):
+            def __init__(self, bot):
+                self.bot = bot
+
+            @selfcord.Extender.cmd(aliases=["ping"])
+            async def pong(self, ctx):
+                pass
+
+        ext = Ext(bot)
+        bot.extensions.add(Extension(name=Ext.name, description="", ext=ext))
+        route = bot.router.match("!ping")
+        assert route.command.name == "pong" and route.extension is ext
+        assert selfcord.Context(make_message(bot, "!ping"), bot).extension is ext
+
+    @pytest.mark.asyncio
+    async def test_invoke(self, bot):
+        calls = []
+
+        @bot.cmd()
+        async def echo(ctx, word, *, rest):
+            calls.append((word, rest))
+
+        await bot.process_commands(make_message(bot, "!echo one two three"))
+        await bot.process_commands(make_message(bot, "just chatting"))
+        await asyncio.sleep(0)
+        assert calls == [("one", "two three")]
+
+
+@pytest.mark.asyncio
+class Test_message_filter:
+    async def test_filter(self, bot, handler):
+        calls = []
+
+        @bot.cmd()
+        async def ping(ctx):
+            calls.append(ctx.author.id)
+
+        stranger = "400000000000000000"
+        for author, content in ((stranger, "!ping"), (CLIENT_ID, "hello"), (CLIENT_ID, "!nope"), (CLIENT_ID, "!ping")):
+            await handler.handle_message_create({"id": "1", "channel_id": "2", "content": content, "author": {"id": author, "username": "a"}})
+        await asyncio.sleep(0)
+        assert calls == [int(CLIENT_ID)]
+        assert bot.router.stats() == {
+            "accepted": 1, "rejected": 3, "rejected_author": 1, "rejected_prefix": 1, "rejected_command": 1,
+        }
+
+        # Userbots take commands from anyone
+        bot.userbot = True
+        assert bot.router.filter({"content": "!ping", "author": {"id": stranger}}).command is ping
+
+
+class Test_argument_binding:
+    def test_tokenize(self):
+        assert [token for token, _ in tokenize('  a "b c"  don\'t \'d \\\' e\' "open')] == ["a", "b c", "don't", "d ' e", '"open']
+        assert [token for token, _ in tokenize('"x"y "')] == ['"x"y', '"']
+
+    @pytest.mark.asyncio
+    async def test_bind(self, bot):
+        user = bot.store_user({"id": "300000000000000001", "username": "cached"})
+        requested = []
+
+        async def get_user(user_id):
+            requested.append(user_id)
+            await asyncio.sleep(0)
+            return bot.store_user({"id": user_id, "username": "fetched"})
+
+        bot.get_user = get_user
+        calls = []
+
+        @bot.cmd()
+        async def bind(ctx, count: int, target: selfcord.User, wait: timedelta, *users: selfcord.User):
+            calls.append((count, target, wait, users))
+
+        @bot.cmd()
+        async def code(ctx, flag: "bool", *, body):
+            calls.append((flag, body))
+
+        stranger = "<@300000000000000002>"
+        ctx = selfcord.Context(make_message(bot, ""), bot)
+        assert await bind.plan.bind(ctx, "") == ([], {})
+        args, kwargs = await bind.plan.bind(ctx, f"3 <@!{user.id}> 1h30m {stranger} {stranger}")
+        assert args[:3] == [3, user, timedelta(hours=1, minutes=30)]
+        assert args[3] is args[4] and args[3].username == "fetched" and not kwargs
+        # Cached users never hit the API and the same user is only fetched once
+        assert requested == ["300000000000000002"]
+
+        # A bad argument after a lookup closes the lookup instead of leaving it unawaited
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            with pytest.raises(ValueError):
+                await bind.plan.bind(ctx, "3 <@300000000000000003> soon")
+            gc.collect()
+        assert not [warning for warning in caught if "never awaited" in str(warning.message)]
+        assert requested == ["300000000000000002"]
+
+        await bot.process_commands(make_message(bot, "!code yes print(1)\n    indented  twice"))
+        await bot.process_commands(make_message(bot, "!bind notanumber"))
+        await asyncio.sleep(0)
+        # The rest is passed as typed, the bad int stops bind from running at all
+        assert calls == [(True, "print(1)\n    indented  twice")]
+
+
+class Test_executors:
+    @pytest.mark.asyncio
+    async def test_commands_and_listeners(self, bot, monkeypatch):
+        replies = []
+
+        async def reply(ctx, content, *args, **kwargs):
+            replies.append(content)
+
+        monkeypatch.setattr(selfcord.Context, "reply", reply)
+        with pytest.raises(Exception):
+            bot.cmd(executor="thread")(reply)
+        with pytest.raises(ValueError):
+            bot.cmd(executor="fiber")(shout)
+
+        @bot.cmd(executor="thread")
+        def count(ctx, *, text):
+            assert isinstance(ctx, selfcord.ExecutorContext)
+            return len(text.split())
+
+        bot.cmd(executor="process")(shout)
+        seen = []
+
+        @bot.on("message", executor="thread")
+        def listener(message):
+            seen.append(message.content)
+
+        bot.store_user({"id": "300000000000000001", "username": "bob"})
+        try:
+            ctx = selfcord.Context(make_message(bot, "!count a b c"), bot)
+            await ctx.invoke()
+            await selfcord.Context(make_message(bot, "!shout 300000000000000001 2"), bot).invoke()
+            await bot.emit("message", make_message(bot, "hi"))
+            for _ in range(100):
+                if seen:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            bot.executors.shutdown(wait=True)
+        # Processes get the user as its payload
+        assert replies == [3, "shout BOBBOB"] and seen == ["hi"]
+        stats = bot.executors.stats()
+        assert stats["thread"]["completed"] == 2 and stats["process"]["completed"] == 1
+        assert stats["thread"]["pending"] == stats["process"]["queued"] == 0
+
+
+@pytest.mark.asyncio
+class Test_eval:
+    async def test_sandboxed_and_trusted(self, bot, monkeypatch):
+        sent = []
+
+        class Reply:
+            async def edit(self, content):
+                sent.append(content)
+
+        async def reply(ctx, content, *args, **kwargs):
+            sent.append(content)
+            return Reply()
+
+        monkeypatch.setattr(selfcord.Context, "reply", reply)
+        bot.inbuilt_help = False
+        bot.eval = True
+        bot.eval_sandbox = selfcord.EvalSandbox(wall_time=1, stream_interval=0)
+        await bot.inbuilt_commands()
+
+        await selfcord.Context(make_message(bot, "!eval ```py\nprint(bot)\n```"), bot).invoke()
+        # The worker has no bot, streamed output is edited into the first reply
+        assert "NameError" in sent[-1] and "Exited with 1" in sent[-1]
+        sent.clear()
+        await selfcord.Context(make_message(bot, "!eval import time\nprint('start')\ntime.sleep(5)"), bot).invoke()
+        assert "start" in sent[-1] and "wall clock limit" in sent[-1]
+
+        sent.clear()
+        bot.eval = "trusted"
+        await selfcord.Context(make_message(bot, "!eval print(ctx.author is bot.user)"), bot).invoke()
+        assert sent == ["```\nTrue\n\n```"]
+
+    async def test_sandbox_status(self):
+        sandbox = selfcord.EvalSandbox(wall_time=2, stream_interval=0, memory=256 * 2**20)
+        # Exiting with any code is the code's own business, not a memory failure
+        result = await sandbox.run("import sys\nprint('bye', file=sys.stderr)\nsys.exit(3)")
+        assert (result.output, result.returncode, result.reason) == ("bye\n", 3, None)
+
+        # Slow updates don't count against the wall clock
+        async def stream(output):
+            await asyncio.sleep(1)
+
+        result = await sandbox.run("import time\nfor i in range(5):\n    print(i)\n    time.sleep(0.2)", stream)
+        assert result.reason is None and result.output.split() == ["0", "1", "2", "3", "4"]
+
+        if sys.platform != "win32":
+            result = await sandbox.run("data = bytearray(2**31)")
+            assert result.reason == "memory" and "memory" in result.summary
@@ -0,0 +1,247 @@
+import asyncio
+import os
+from time import perf_counter
+
+import pytest
+
+import selfcord
+from selfcord.utils import Extension
+
+from .conftest import CLIENT_ID
+
+GUILD_ID = "200000000000000000"
+
+
+@pytest.mark.asyncio
+class Test_member_events:
+    async def test_member_lifecycle(self, bot, handler, ready_payloads):
+        ready, supplemental = ready_payloads(1, 10)
+        await handler.handle_ready(ready)
+        await handler.handle_ready_supplemental(supplemental)
+        guild = bot.fetch_guild(GUILD_ID)
+        assert guild.me is not None and guild.me.id == int(CLIENT_ID)
+
+        user = {"id": "400000000000000000", "username": "joiner", "discriminator": "0"}
+        await handler.handle_guild_member_add({"guild_id": GUILD_ID, "user": user, "roles": [], "joined_at": "2023-01-01T00:00:00+00:00"})
+        member = guild.fetch_member(user["id"])
+        assert isinstance(member, selfcord.Member)
+        assert member.username == "joiner"
+        assert len(guild.members) == 12
+
+        await handler.handle_guild_member_update({"guild_id": GUILD_ID, "user": user, "roles": [], "nick": "nick"})
+        assert guild.fetch_member(user["id"]) is member
+        assert member.nick == "nick"
+
+        await handler.handle_guild_member_remove({"guild_id": GUILD_ID, "user": user})
+        assert guild.fetch_member(user["id"]) is None
+        assert user["id"] not in guild.members
+        assert len(guild.members) == 11
+
+
+@pytest.mark.asyncio
+class Test_message_events:
+    async def test_author_is_shared(self, bot, handler):
+        author = {"id": "400000000000000000", "username": "author", "discriminator": "0"}
+        await handler.handle_message_create({"id": "1", "channel_id": "2", "content": "a", "author": author})
+        await handler.handle_message_create({"id": "3", "channel_id": "2", "content": "b", "author": {**author, "username": "renamed"}})
+        first, second = bot.fetch_message("1"), bot.fetch_message("3")
+        assert first.author is second.author is bot.fetch_user(author["id"])
+        assert first.author.username == "renamed"
+
+    async def test_edit_is_diffed(self, bot, handler):
+        edits = []
+
+        @bot.on("message_edit")
+        async def message_edit(message, changes):
+            edits.append((message, changes))
+
+        messages = []
+
+        @bot.on("message")
+        async def on_message(message):
+            messages.append(message)
+
+        author = {"id": "400000000000000000", "username": "author"}
+        embeds = [{"title": "old"}]
+        await handler.handle_message_create({"id": "1", "channel_id": "2", "content": "a", "author": author, "embeds": embeds, "pinned": False})
+        message = bot.fetch_message("1")
+        assert message.embeds[0].title == "old"
+        # Partial update, the fields it leaves out are kept
+        await handler.handle_message_update({"id": "1", "channel_id": "2", "content": "b", "embeds": [{"title": "new"}], "edited_timestamp": "now"})
+        await asyncio.sleep(0)
+        edited, changes = edits[0]
+        assert edited is message and bot.fetch_message("1") is message
+        # Still emitted as a message as well
+        assert messages == [message, message]
+        assert set(changes) == {"content", "embeds", "edited_timestamp"}
+        assert changes["content"] == ("a", "b") and message.author.username == "author" and message.pinned is False
+        before = changes.before
+        assert before is not message and before.content == "a" and before.edited_timestamp is None
+        assert before.embeds[0].title == "old" and message.embeds[0].title == "new"
+
+
+@pytest.mark.asyncio
+class Test_update_events:
+    async def test_member_and_guild_updates(self, bot, handler, ready_payloads):
+        ready, supplemental = ready_payloads(1, 10)
+        await handler.handle_ready(ready)
+        await handler.handle_ready_supplemental(supplemental)
+        guild = bot.fetch_guild(GUILD_ID)
+        events = []
+
+        @bot.on("member_update")
+        async def member_update(member, changes):
+            events.append(changes)
+
+        @bot.on("guild_update")
+        async def guild_update(guild, changes):
+            events.append(changes)
+
+        user = {"id": "300000000000000001", "username": "renamed"}
+        await handler.handle_guild_member_update({"guild_id": GUILD_ID, "user": user, "roles": [GUILD_ID], "nick": "nick"})
+        await asyncio.sleep(0)
+        changes = events.pop()
+        assert set(changes) == {"nick", "user"} and changes["nick"] == (None, "nick")
+        assert changes["user"]["username"] == (None, "renamed")
+        before = changes.before
+        assert before.nick is None and before.user.username is None and changes.after.username == "renamed"
+
+        # Nothing changed, nothing reported
+        await handler.handle_guild_member_update({"guild_id": GUILD_ID, "user": user, "roles": [GUILD_ID], "nick": "nick"})
+        await asyncio.sleep(0)
+        assert not events.pop()
+
+        # GUILD_UPDATE has the properties at the top level
+        await handler.handle_guild_update({"id": GUILD_ID, "name": "renamed", "icon": "a" * 32, "roles": ready["guilds"][0]["roles"]})
+        await asyncio.sleep(0)
+        changes = events.pop()
+        assert set(changes) == {"name", "icon_hash"} and guild.name == "renamed"
+        assert guild.icon.hash == "a" * 32 and changes.before.icon is None and changes.before.name == "guild 0"
+
+
+@pytest.mark.asyncio
+class Test_permission_resolver:
+    async def test_overwrites_and_invalidation(self, bot, handler):
+        P = selfcord.Permission
+        everyone, mod = "5", "6"
+        guild = selfcord.Guild({
+            "id": everyone,
+            "properties": {"owner_id": "4"},
+            "roles": [
+                {"id": everyone, "name": "@everyone", "permissions": str(P.VIEW_CHANNEL | P.SEND_MESSAGES)},
+                {"id": mod, "name": "mod", "permissions": str(P.MANAGE_MESSAGES)},
+            ],
+            "channels": [
+                {"id": "10", "type": 0, "name": "rules", "permission_overwrites": [
+                    {"id": everyone, "type": 0, "allow": "0", "deny": str(P.SEND_MESSAGES)},
+                    {"id": mod, "type": 0, "allow": str(P.SEND_MESSAGES), "deny": "0"},
+                    {"id": "3", "type": 1, "allow": "0", "deny": str(P.VIEW_CHANNEL)},
+                ]},
+                {"id": "11", "type": 0, "name": "general"},
+            ],
+            "members": [
+                {"user": {"id": "1", "username": "a"}, "roles": []},
+                {"user": {"id": "2", "username": "b"}, "roles": [mod]},
+                {"user": {"id": "3", "username": "c"}, "roles": [mod]},
+                {"user": {"id": "4", "username": "owner"}, "roles": []},
+            ],
+        }, bot)
+        bot.cached_guilds[guild.id] = guild
+        rules, general = guild.channels
+        a, b, c, owner = (guild.fetch_member(user_id) for user_id in "1234")
+
+        assert a.permissions_in(rules) == P.VIEW_CHANNEL
+        assert b.permissions_in(rules).has("SEND_MESSAGES", "MANAGE_MESSAGES")
+        # The member overwrite hides the channel, nothing else applies then
+        assert c.permissions_in(rules) == 0
+        assert owner.permissions_in(rules) == P.all()
+        assert bot.permissions.visible_channels(guild, c) == [general]
+        senders = bot.permissions.members_with(rules, "SEND_MESSAGES")
+        assert [member.id for member in senders] == [2, 4]
+
+        await handler.handle_guild_member_update({"guild_id": everyone, "user": {"id": "1"}, "roles": [mod]})
+
+        await asyncio.sleep(0)
+        assert a.permissions_in(rules).has("SEND_MESSAGES")
+        await handler.handle_channel_update({"id": "11", "type": 0, "guild_id": everyone, "permission_overwrites": [
+            {"id": everyone, "type": 0, "allow": "0", "deny": str(P.VIEW_CHANNEL)},
+        ]})
+        assert bot.permissions.visible_channels(guild, c) == []
+        await handler.handle_guild_role_update({"guild_id": everyone, "role": {
+            "id": mod, "name": "mod", "permissions": str(P.ADMINISTRATOR),
+        }})
+        assert c.permissions_in(general) == P.all()
+        assert [member.id for member in bot.permissions.members_with(general)] == [1, 2, 3, 4]
+
+    async def test_unknown_flags(self, bot):
+        P = selfcord.Permission
+        unknown = 1 << 49
+        guild = selfcord.Guild({
+            "id": "5",
+            "properties": {"owner_id": "4"},
+            "roles": [{"id": "5", "name": "@everyone", "permissions": str(unknown | P.VIEW_CHANNEL | P.SEND_MESSAGES)}],
+            "channels": [{"id": "10", "type": 0, "name": "rules", "permission_overwrites": [
+                {"id": "5", "type": 0, "allow": "0", "deny": str(P.SEND_MESSAGES)},
+            ]}],
+            "members": [{"user": {"id": "1", "username": "a"}, "roles": []}],
+        }, bot)
+        bot.cached_guilds[guild.id] = guild
+        assert guild.fetch_member(1).permissions_in(guild.channels[0]) == P.VIEW_CHANNEL | unknown
+
+
+@pytest.mark.asyncio
+class Test_listener_dispatch:
+    async def test_dispatch(self, bot):
+        seen = []
+
+        @bot.on("ping", inline=True)
+        def counter(value):
+            seen.append(("inline", value))
+
+        @bot.on("ping")
+        async def failing(value):
+            raise RuntimeError(value)
+
+        @bot.on("ping")
+        async def no_args():
+            seen.append(("task", None))
+
+        async def coroutine(value):
+            pass
+
+        with pytest.raises(Exception):
+            bot.on("ping", inline=True)(coroutine)
+        with pytest.raises(ValueError):
+            bot.on("ping", inline=True, executor="thread")(counter)
+
+        class Ext(selfcord.Extender, name="listeners"):
+            def __init__(self, bot):
+                self.bot = bot
+
+            @selfcord.Extender.on("ping", inline=True)
+            def method(self, value):
+                seen.append(("ext", self.bot is bot))
+
+        ext = Extension(name=Ext.name, description="", ext=Ext(bot))
+        bot.extensions.add(ext)
+        bot._events["ping"].extend(event.bind(ext.ext) for event in ext._events["ping"])
+
+        await bot.emit("ping", 1)
+        # Inline listeners ran before emit returned, tasks haven't yet
+        assert seen == [("inline", 1), ("ext", True)]
+        await asyncio.sleep(0)
+        assert seen[2:] == [("task", None)]
+
+        stats = {entry["listener"]: entry for entry in bot.listener_stats()["ping"]}
+        assert stats["counter"]["calls"] == stats["no_args"]["calls"] == stats["method"]["calls"] == 1
+        assert stats["failing"]["errors"] == 1 and stats["counter"]["errors"] == 0
+
+    @pytest.mark.skipif(not os.environ.get("SELFCORD_BENCHMARK"), reason="set SELFCORD_BENCHMARK=1 to run")
+    async def test_emit_benchmark(self, bot):
+        for _ in range(10):
+            bot.on("presence_update", inline=True)(lambda presence: None)
+        start = perf_counter()
+        for _ in range(100_000):
+            await bot.emit("presence_update", None)
+        elapsed = perf_counter() - start
+        print(f"100k emits to 10 inline listeners: {elapsed:.2f}s, {elapsed * 10:.1f}us per emit")
@@ -0,0 +1,228 @@
+import gc
+import os
+import tracemalloc
+from time import perf_counter
+
+import pytest
+
+import selfcord
+
+from .conftest import CLIENT_ID
+
+
+def message_payload(message_id: str = "1", **extra):
+    return {
+        "id": message_id, "channel_id": "2", "content": "hi",
+        "author": {"id": "400000000000000000", "username": "author"},
+        "embeds": [{"title": "embed", "fields": [{"name": "a", "value": "b"}]}],
+        "mentions": [{"id": "400000000000000001", "username": "mentioned"}],
+        "referenced_message": {"id": "0", "channel_id": "2", "content": "original"},
+        **extra,
+    }
+
+
+class Test_lazy_models:
+    def test_message_decodes_on_access(self, bot):
+        message = selfcord.Message(message_payload(), bot)
+        # Nothing decoded yet, mentioned users aren't even cached
+        assert bot.fetch_user("400000000000000001") is None
+
+        embeds = message.embeds
+        assert isinstance(embeds[0], selfcord.Embed) and embeds[0].fields[0].name == "a"
+        assert message.embeds is embeds
+        assert message.mentions[0] is bot.fetch_user("400000000000000001")
+        assert message.replied_message.content == "original"
+
+        message.update(message_payload(embeds=[]))
+        assert message.embeds == []
+
+    def test_materialize(self, bot):
+        message = selfcord.Message(message_payload(), bot).materialize()
+        assert message._payload == {}
+        assert message.embeds[0].title == "embed"
+        assert message.attachments is None
+        with pytest.raises(AttributeError):
+            message.not_a_field
+
+    def test_guild_and_channel_children(self, bot):
+        guild = selfcord.Guild({
+            "id": "5",
+            "roles": [{"id": "5", "name": "@everyone", "permissions": "1024"}],
+            "channels": [{"id": "6", "type": 0, "name": "general", "permission_overwrites": [
+                {"id": "5", "type": 0, "allow": "0", "deny": "2048"},
+            ]}],
+        }, bot)
+        assert guild.roles[0].name == "@everyone"
+        assert guild.emojis == [] and guild.stickers == []
+        channel = bot.fetch_channel("6")
+        assert channel.permission_overwrites[0].deny.raw_value == "2048"
+
+    @pytest.mark.benchmark
+    @pytest.mark.skipif(not os.environ.get("SELFCORD_BENCHMARK"), reason="set SELFCORD_BENCHMARK=1 to run")
+    def test_message_create_benchmark(self, bot):
+        payloads = [message_payload(str(i)) for i in range(100_000)]
+        start = perf_counter()
+        for payload in payloads:
+            message = selfcord.Message(payload, bot)
+            message.content, message.author.id, message.channel_id
+        elapsed = perf_counter() - start
+        print(f"100k messages: {elapsed:.2f}s, {elapsed * 10:.1f}us per message")
+
+
+class Test_model_schema:
+    def test_channel_factory(self, bot):
+        voice = selfcord.Convert({"id": "1", "type": 2, "guild_id": "5", "parent_id": "3", "rate_limit_per_user": 5}, bot)
+        assert isinstance(voice, selfcord.VoiceChannel)
+        assert (voice.type, voice.guild_id, voice.category_id, voice.slowdown) == (2, 5, 3, 5)
+        assert type(selfcord.Convert({"id": "1", "type": 99}, bot)) is selfcord.TextChannel
+
+        group = selfcord.Convert({"id": "2", "type": 3, "recipient_ids": [CLIENT_ID]}, bot)
+        assert group.recipient == [bot.user] and group.icon is None and group.guild_id is None
+
+    def test_compiled_defaults(self, bot):
+        member = selfcord.Member({"user": {"id": "7", "username": "a"}, "permissions": "8"}, bot)
+        assert member.roles == [] and member.nick is None
+        assert member.permissions.raw_value == "8"
+        user = bot.fetch_user("7")
+        assert (user.flags, user.is_bot, user.avatar) == (0, False, None)
+
+    @pytest.mark.benchmark
+    @pytest.mark.skipif(not os.environ.get("SELFCORD_BENCHMARK"), reason="set SELFCORD_BENCHMARK=1 to run")
+    def test_parse_benchmark(self, bot):
+        payloads = {
+            selfcord.Message: message_payload(),
+            selfcord.User: {"id": "7", "username": "a", "global_name": "A", "avatar": "abc", "discriminator": "0"},
+            selfcord.Member: {"user_id": "7", "joined_at": "2023-01-01T00:00:00+00:00", "nick": "n", "roles": ["1"]},
+            selfcord.TextChannel: {"id": "1", "type": 0, "guild_id": "5", "name": "general", "position": 1, "parent_id": "3"},
+            selfcord.VoiceChannel: {"id": "1", "type": 2, "guild_id": "5", "name": "voice", "bitrate": 64000},
+            selfcord.Role: {"id": "5", "name": "@everyone", "permissions": "1024", "position": 0},
+        }
+        for model, payload in payloads.items():
+            start = perf_counter()
+            for _ in range(50_000):
+                model(payload, bot)
+            elapsed = perf_counter() - start
+            print(f"{model.__name__}: {50_000 / elapsed:,.0f} parses/s")
+
+
+class Test_snowflake:
+    def test_parts(self):
+        # Example id from the Discord docs
+        snowflake = selfcord.Snowflake("175928847299117063")
+        assert snowflake.timestamp == 1462015105796
+        assert (snowflake.worker_id, snowflake.process_id, snowflake.increment) == (1, 0, 7)
+        assert selfcord.Snowflake.from_datetime(snowflake.created_at) == snowflake >> 22 << 22
+        assert str(snowflake) == "175928847299117063"
+
+    def test_ids_are_ints(self, bot):
+        message = selfcord.Message(message_payload("175928847299117063"), bot)
+        assert message.id == 175928847299117063 and message.channel_id == 2
+        bot.cached_messages[message.id] = message
+        assert bot.fetch_message("175928847299117063") is bot.fetch_message(175928847299117063) is message
+        assert bot.fetch_user("400000000000000000") is bot.fetch_user(400000000000000000) is message.author
+
+
+@pytest.mark.asyncio
+class Test_columnar_members:
+    async def test_views_and_queries(self, bot, handler, ready_payloads):
+        bot.columnar_members = 100
+        ready, supplemental = ready_payloads(2, 200)
+        ready["guilds"][1]["member_count"] = 10
+        await handler.handle_ready(ready)
+        await handler.handle_ready_supplemental(supplemental)
+        large, small = bot.user.guilds
+        assert isinstance(large.members, selfcord.ColumnarMemberCollection)
+        assert isinstance(small.members, selfcord.MemberCollection)
+        assert len(large.members) == 201 and large.me.user is bot.user
+
+        member = large.fetch_member("300000000000000000")
+        assert (member.guild_id, member.roles, member.deaf) == (large.id, [large.id], False)
+        assert member.joined_at == "2023-01-01T00:00:00+00:00"
+        assert len(large.members.with_role(large.id)) == 200
+
+        user = {"id": "400000000000000000", "username": "joiner", "global_name": "Joiner"}
+        await handler.handle_guild_member_add({
+            "guild_id": str(large.id), "user": user, "roles": ["5", "6"],
+            "joined_at": "2024-01-01T00:00:00+00:00", "nick": "nick", "pending": True,
+        })
+        # Not cached, the view builds a user from the name columns
+        assert bot.fetch_user(user["id"]) is None
+        joiner = large.fetch_member(user["id"])
+        assert (joiner.display_name, joiner.nick, joiner.roles) == ("Joiner", "nick", [5, 6])
+        assert large.members.query(role=6, joined_after="2023-06-01T00:00:00+00:00") == [joiner.id]
+        assert large.members.query(joined_before="2023-06-01T00:00:00+00:00", flags=large.members.PENDING) == []
+
+        await handler.handle_guild_member_update({"guild_id": str(large.id), "user": user, "roles": ["5"], "pending": False})
+        assert large.members.with_role(6) == []
+        assert large.fetch_member(user["id"]).pending is False
+
+        # User changes come from the name columns when the user isn't cached, and from the User when it is
+        _, changes = large.members.diff({"user": {**user, "username": "renamed"}, "roles": ["5"]})
+        assert set(changes) == {"user"} and changes["user"]["username"] == ("joiner", "renamed")
+        assert changes.before.username == "joiner" and changes.after.username == "renamed"
+        cached = bot.store_user({"id": "300000000000000001", "username": "cached"})
+        _, changes = large.members.diff({"user": {"id": "300000000000000001", "username": "again"}})
+        assert changes["user"]["username"] == ("cached", "again") and cached.username == "again"
+        _, changes = large.members.diff({"user": {"id": "300000000000000001", "username": "again"}})
+        assert not changes
+
+        removed = [large.members.remove(300000000000000000 + n) for n in range(150)]
+        assert all(isinstance(member, selfcord.Member) for member in removed)
+        # Most rows were dead so the store compacted, everything left still resolves
+        assert len(large.members) == 52 and len(large.members._ids) < 202
+        assert large.fetch_member(user["id"]).nick == "nick"
+        assert len(large.members.with_role(large.id)) == 50
+
+    @pytest.mark.benchmark
+    @pytest.mark.skipif(not os.environ.get("SELFCORD_BENCHMARK"), reason="set SELFCORD_BENCHMARK=1 to run")
+    async def test_memory_benchmark(self, bot, handler, ready_payloads):
+        bot.columnar_members = 0
+        ready, supplemental = ready_payloads(1, 100_000)
+        await handler.handle_ready(ready)
+        gc.collect()
+        tracemalloc.start()
+        await handler.handle_ready_supplemental(supplemental)
+        gc.collect()
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        guild = bot.user.guilds[0]
+        print(f"100k columnar members: {used / 2**20:.1f} MiB, {used / len(guild.members):.0f} bytes per member")
+        start = perf_counter()
+        guild.members.query(role=guild.id, joined_after=0)
+        print(f"role + joined_at query: {(perf_counter() - start) * 1000:.1f}ms")
+
+
+class Test_permission:
+    def test_flags(self):
+        permission = selfcord.Permission("3072")
+        assert permission == selfcord.Permission.VIEW_CHANNEL | selfcord.Permission.SEND_MESSAGES
+        assert permission.has("VIEW_CHANNEL", selfcord.Permission.SEND_MESSAGES) and "SEND_MESSAGES" in permission
+        assert not permission.has("ADMINISTRATOR")
+        assert list(permission) == ["VIEW_CHANNEL", "SEND_MESSAGES"]
+        assert permission is selfcord.Permission(3072)
+
+        assert isinstance(permission | 8, selfcord.Permission)
+        assert permission - selfcord.Permission.SEND_MESSAGES == selfcord.Permission.VIEW_CHANNEL
+        assert ~permission & permission == 0 and (~permission).has("ADMINISTRATOR")
+        # Flags without a name yet survive ~ and -
+        unknown = 1 << 49
+        assert (~permission).has(unknown) and ~~selfcord.Permission(permission | unknown) == permission | unknown
+        assert (permission | unknown) - selfcord.Permission.SEND_MESSAGES == selfcord.Permission.VIEW_CHANNEL | unknown
+        assert list(selfcord.Permission(permission | unknown)) == ["VIEW_CHANNEL", "SEND_MESSAGES"]
+        assert selfcord.Permission.from_names("VIEW_CHANNEL", "SEND_MESSAGES") is permission
+        assert permission.raw_value == str(permission) == "3072"
+
+
+class Test_assets:
+    def test_hash_only(self, bot):
+        user = selfcord.User({"id": "7", "username": "a", "avatar": "a_" + "f" * 30, "banner": "b" * 32}, bot)
+        other = selfcord.User({"id": "8", "username": "b", "avatar": "a_" + "f" * 30}, bot)
+        assert user.avatar_hash is other.avatar_hash
+        assert user.avatar.url == f"https://cdn.discordapp.com/avatars/7/a_{'f' * 30}.gif?size=4096"
+        assert user.banner.url_for(size=512, format="webp") == f"https://cdn.discordapp.com/banners/7/{'b' * 32}.webp?size=512"
+
+        user.partial_update({"avatar": None})
+        assert user.avatar is None and other.avatar.is_animated
+        guild = selfcord.Guild({"id": "5", "properties": {"icon": "c" * 32}}, bot)
+        guild.partial_update({"banner": "d" * 32})
+        assert str(guild.icon).startswith("https://cdn.discordapp.com/icons/5/") and guild.banner.hash == "d" * 32
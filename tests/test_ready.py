@@ -0,0 +1,259 @@
+import asyncio
+import gc
+import os
+import tracemalloc
+from time import perf_counter
+
+import pytest
+import ujson
+
+import selfcord
+from selfcord.api.events import Handler
+
+from .conftest import CLIENT_ID
+
+
+@pytest.mark.asyncio
+class Test_ready_supplemental:
+    async def test_merge(self, bot, handler, ready_payloads):
+        ready, supplemental = ready_payloads(5, 200, shared_users=300)
+        await handler.handle_ready(ready)
+        await handler.handle_ready_supplemental(supplemental)
+
+        assert len(bot.user.guilds) == 5
+        for guild in bot.user.guilds:
+            ids = [member.id for member in guild.members]
+            assert len(ids) == len(set(ids)) == 201
+            assert all(isinstance(member, selfcord.Member) for member in guild.members)
+            assert all(member.guild_id == guild.id for member in guild.members)
+        # The shared pool is 300 users plus the client
+        assert len(bot.cached_users) == 301
+        assert bot.fetch_user(CLIENT_ID) is bot.user
+        first, second = bot.user.guilds[:2]
+        user_id = next(iter(first.members)).id
+        assert first.fetch_member(user_id).user is second.fetch_member(user_id).user is bot.fetch_user(user_id)
+        assert first.me.user is bot.user
+
+    async def test_cooperative_hydration(self, bot, handler, ready_payloads):
+        ready, supplemental = ready_payloads(10, 30)
+        bot.ready_batch_size = 50
+        bot.initial_guild = int(ready["guilds"][7]["id"])
+        batches = []
+
+        @bot.on("ready_partial")
+        async def ready_partial(guilds):
+            batches.append([guild.id for guild in guilds])
+
+        ticks = 0
+
+        async def heartbeat():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        task = asyncio.create_task(heartbeat())
+        # Supplemental waits for READY even when it's dispatched right behind it
+        await asyncio.gather(handler.handle_ready(ready), handler.handle_ready_supplemental(supplemental))
+        await asyncio.sleep(0)
+        task.cancel()
+
+        assert ticks > 5
+        assert batches[0][0] == bot.initial_guild
+        assert len(batches) > 2 and sum(map(len, batches)) == 20
+        assert all(len(guild.members) == 31 for guild in bot.user.guilds)
+
+    @pytest.mark.benchmark
+    @pytest.mark.skipif(not os.environ.get("SELFCORD_BENCHMARK"), reason="set SELFCORD_BENCHMARK=1 to run")
+    async def test_benchmark(self, bot, handler, ready_payloads):
+        ready, supplemental = ready_payloads(100, 10_000)
+        await handler.handle_ready(ready)
+        start = perf_counter()
+        await handler.handle_ready_supplemental(supplemental)
+        elapsed = perf_counter() - start
+        print(f"READY_SUPPLEMENTAL 100 guilds x 10k members: {elapsed:.2f}s")
+        assert sum(len(guild.members) for guild in bot.user.guilds) == 100 * 10_001
+
+    @pytest.mark.benchmark
+    @pytest.mark.skipif(not os.environ.get("SELFCORD_BENCHMARK"), reason="set SELFCORD_BENCHMARK=1 to run")
+    async def test_memory_benchmark(self, bot, handler, ready_payloads):
+        # Decoded while tracing like the gateway does, so ids and names the models keep are counted
+        raw = [ujson.dumps(payload) for payload in ready_payloads(100, 1_000, shared_users=50_000)]
+        gc.collect()
+        tracemalloc.start()
+        ready, supplemental = (ujson.loads(payload) for payload in raw)
+        await handler.handle_ready(ready)
+        await handler.handle_ready_supplemental(supplemental)
+        del ready, supplemental
+        gc.collect()
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        members = sum(len(guild.members) for guild in bot.user.guilds)
+        print(f"READY 100 guilds x 1k members: {used / 2**20:.1f} MiB, {used / members:.0f} bytes per member")
+
+
+@pytest.mark.asyncio
+class Test_snapshot:
+    async def test_round_trip(self, bot, handler, ready_payloads, tmp_path):
+        ready, supplemental = ready_payloads(3, 20)
+        ready["users"] = [{"id": "300000000000000000", "username": "friend", "avatar": "a" * 32, "client_status": {"desktop": "online"}}]
+        ready["relationships"] = [{"id": "300000000000000000", "type": 1}]
+        ready["private_channels"] = [{"id": "50", "type": 1, "recipient_ids": ["300000000000000000"]}]
+        ready["guilds"][0]["channels"] = [{"id": "60", "type": 0, "name": "general", "permission_overwrites": [
+            {"id": ready["guilds"][0]["id"], "type": 0, "allow": "0", "deny": "2048"},
+        ]}]
+        await handler.handle_ready(ready)
+        await handler.handle_ready_supplemental(supplemental)
+        # Collecting in small batches yields to the loop but gives the same payloads
+        snapshot = selfcord.utils.snapshot
+        assert await snapshot.collect_snapshot(bot, 7) == snapshot.snapshot_payloads(bot)
+        path = str(tmp_path / "cache.snapshot")
+        bot.snapshot = path
+        await bot.save_snapshot()
+
+        warm = selfcord.Bot(prefixes=["!"])
+        warm.user = selfcord.Client({"id": CLIENT_ID, "username": "client"}, warm)
+        warm.cached_users[warm.user.id] = warm.user
+        assert await selfcord.utils.snapshot.load_snapshot(warm, path, 7)
+        assert len(warm.user.guilds) == 3 and len(warm.cached_users) == len(bot.cached_users)
+        friend = warm.fetch_user("300000000000000000")
+        assert warm.user.friends == [friend] and friend.avatar.hash == "a" * 32
+        assert friend.client_status.platforms == ["desktop"]
+        assert warm.fetch_channel("50").recipient is friend
+        guild = warm.fetch_guild(ready["guilds"][0]["id"])
+        member = guild.fetch_member("300000000000000000")
+        assert member.roles == [guild.id] and member.user is friend
+        assert guild.name == "guild 0" and guild.roles[0].permissions == 1071698660929
+        channel = warm.fetch_channel("60")
+        assert channel.guild_id == guild.id and channel.permission_overwrites[0].deny == 2048
+
+        # READY is applied over the snapshot, the guild left while offline is dropped
+        left = ready["guilds"].pop()
+        ready["merged_members"].pop()
+        await Handler(warm).handle_ready(ready)
+        assert warm.fetch_guild(left["id"]) is None and len(warm.user.guilds) == 2
+        assert warm.fetch_guild(guild.id) is guild and warm.fetch_channel("60") is channel
+        assert guild.fetch_member("300000000000000000") is member
+        assert warm.user.friends == [friend] and len(warm.user.private_channels) == 1
+        # Members READY_SUPPLEMENTAL doesn't have anymore left while offline, unless a chunk had them
+        supplemental["guilds"].pop()
+        supplemental["merged_members"].pop()
+        supplemental["merged_members"][0] = [payload for payload in supplemental["merged_members"][0] if payload["user_id"] != "300000000000000001"]
+        supplemental["merged_members"][1] = supplemental["merged_members"][1][:1]
+        handler = Handler(warm)
+        await handler.handle_ready(ready)
+        await handler.handle_guild_members_chunk({"guild_id": str(guild.id), "members": [{"user": {"id": "300000000000000002"}, "roles": []}]})
+        await handler.handle_ready_supplemental(supplemental)
+        assert guild.fetch_member("300000000000000001") is None and guild.fetch_member("300000000000000002") is not None
+        assert len(guild.members) == 20 and guild.me is not None
+        assert len(warm.user.guilds[1].members) == 2
+
+        assert not await selfcord.utils.snapshot.load_snapshot(warm, str(tmp_path / "missing"))
+        # Snapshots of an older format are skipped rather than misread
+        (tmp_path / "old").write_bytes(snapshot.MAGIC + b"\x01\x00" + bytes(16))
+        assert not await snapshot.load_snapshot(warm, str(tmp_path / "old"))
+
+
+@pytest.mark.asyncio
+class Test_cache_stats:
+    async def test_report(self, bot, handler, ready_payloads):
+        ready, supplemental = ready_payloads(3, 50)
+        ready["guilds"][1]["channels"] = [{"id": "60", "type": 0, "name": "general"}]
+        await handler.handle_ready(ready)
+        await handler.handle_ready_supplemental(supplemental)
+
+        stats = bot.cache_stats(top=2)
+        assert stats["users"]["count"] == 151 and stats["guilds"]["count"] == 3
+        assert stats["channels"]["count"] == 1 and stats["messages"]["count"] == 0
+        assert len(stats["top_guilds"]) == 2
+        assert all(entry["members"]["count"] == 51 and entry["members"]["bytes"] > 0 for entry in stats["top_guilds"])
+        assert stats["total_bytes"] == sum(stats[name]["bytes"] for name in ("users", "guilds", "channels", "messages", "deleted_messages"))
+        # The first report grows from nothing
+        assert stats["growth"]["users"]["count"] == 151
+
+        bot.store_user({"id": "400000000000000000", "username": "new"})
+        stats = bot.cache_stats()
+        assert stats["growth"]["users"]["count"] == 1 and stats["growth"]["guilds"]["count"] == 0
+        report = selfcord.utils.stats.format_cache_stats(stats)
+        assert "users: 152 (+1)" in report and "guild 0" in report
+
+
+@pytest.mark.asyncio
+class Test_cache_policy:
+    async def test_ready(self, bot, handler, ready_payloads):
+        ready, supplemental = ready_payloads(3, 50)
+        kept = ready["guilds"][1]["id"]
+        for guild in ready["guilds"]:
+            guild["emojis"] = [{"id": str(i), "name": f"e{i}"} for i in range(10)]
+        bot.cache_policy = selfcord.CachePolicy(
+            members=False, presences=[kept], emojis=3, stickers="never", guilds={kept: {"members": 20}},
+        )
+        await handler.handle_ready(ready)
+        await handler.handle_ready_supplemental(supplemental)
+
+        first, second, _ = bot.user.guilds
+        # Only the client's member, nobody else was ever built
+        assert [member.id for member in first.members] == [bot.user.id]
+        assert len(second.members) == 20 and second.me is not None
+        # The client, 19 more members and 3 presences of users that aren't members
+        assert len(bot.cached_users) == 1 + 19 + 3
+        assert len(first.emojis) == 3 and first._payload.get("stickers") is None
+        # Presences of the first guild were dropped instead of creating users
+        assert bot.fetch_user(300000000000000010) is None
+        assert bot.fetch_user(300000000000000060).status == "online"
+
+    async def test_rejected_members(self, bot, handler, ready_payloads):
+        ready, supplemental = ready_payloads(2, 5)
+        bot.cache_policy = selfcord.CachePolicy(members=False)
+        bot.columnar_members = 5
+        ready["guilds"][0]["member_count"] = 5
+        await handler.handle_ready(ready)
+        await handler.handle_ready_supplemental(supplemental)
+        users = len(bot.cached_users)
+        columnar, plain = bot.user.guilds
+        assert isinstance(columnar.members, selfcord.models.ColumnarMemberCollection)
+        for guild in (columnar, plain):
+            member = guild.members.merge({"user": {"id": "400000000000000000", "username": "new"}, "roles": []})
+            assert member.username == "new" and member.guild_id == guild.id and member.id not in guild.members
+        assert len(bot.cached_users) == users and bot.fetch_user(400000000000000000) is None
+
+    async def test_interacted(self, bot, handler, ready_payloads):
+        ready, supplemental = ready_payloads(1, 5)
+        bot.cache_policy = selfcord.CachePolicy(members="interacted", messages="interacted", roles="interacted")
+        await handler.handle_ready(ready)
+        await handler.handle_ready_supplemental(supplemental)
+        guild = bot.user.guilds[0]
+        assert len(guild.members) == 1 and guild.roles == []
+
+        def message(message_id, author_id):
+            return {
+                "id": str(message_id), "channel_id": "60", "guild_id": str(guild.id), "content": "hi",
+                "author": {"id": str(author_id), "username": "someone"}, "member": {"roles": [], "joined_at": None},
+            }
+
+        await handler.handle_message_create(message(1, 300000000000000001))
+        assert guild.fetch_member(300000000000000001) is not None
+        assert 1 not in bot.cached_messages and guild.roles == []
+        # Role events while roles are held back still count once they're decoded
+        await handler.handle_guild_role_create({"guild_id": str(guild.id), "role": {"id": "9", "name": "new"}})
+        # The client talking opens up the guild
+        await handler.handle_message_create(message(2, CLIENT_ID))
+        await handler.handle_message_create(message(3, 300000000000000001))
+        assert 2 in bot.cached_messages and 3 in bot.cached_messages
+        assert [role.id for role in guild.roles] == [guild.id, 9]
+
+    async def test_interacted_keeps_decoded(self, bot, handler, ready_payloads):
+        ready, supplemental = ready_payloads(1, 5)
+        bot.cache_policy = selfcord.CachePolicy(messages="interacted")
+        await handler.handle_ready(ready)
+        await handler.handle_ready_supplemental(supplemental)
+        guild = bot.user.guilds[0]
+        guild_id = str(guild.id)
+        await handler.handle_guild_role_create({"guild_id": guild_id, "role": {"id": "9", "name": "new"}})
+        await handler.handle_guild_role_update({"guild_id": guild_id, "role": {"id": "9", "name": "renamed"}})
+        await handler.handle_guild_role_delete({"guild_id": guild_id, "role_id": guild_id})
+        await handler.handle_message_create({
+            "id": "2", "channel_id": "60", "guild_id": guild_id, "content": "hi",
+            "author": {"id": str(CLIENT_ID), "username": "client"},
+        })
+        assert [(role.id, role.name) for role in guild.roles] == [(9, "renamed")]